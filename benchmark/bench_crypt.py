@@ -0,0 +1,104 @@
+"""
+p99 latency of /healthz while bcrypt load runs on the same process.
+
+before: bcrypt verification runs inline on the IOLoop, like the old handlers did
+after:  bcrypt verification is awaited through tool.cryptTool.check_same_async
+
+usage: python3 benchmark/bench_crypt.py [--duration 5] [--load 8] [--executor process]
+"""
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Add path of cwd to sys
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # config is loaded by relative path
+import json
+import time
+import asyncio
+import argparse
+
+import tornado.httpserver
+import tornado.httpclient
+import tornado.testing
+
+from tool.cryptTool import encrypt, checkSame, check_same_async, initCryptService
+from service import service_main
+
+
+class NullStatsd(object):
+    def incr(self, *args, **kwargs):
+        pass
+
+    def timing(self, *args, **kwargs):
+        pass
+
+
+def percentile(samples, p):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    index = min(len(samples) - 1, int(round(p / 100.0 * (len(samples) - 1))))
+    return samples[index]
+
+
+async def bcryptLoad(mode, hashed, deadline):
+    done = 0
+    while time.monotonic() < deadline:
+        if mode == 'before':
+            checkSame('123456', hashed)
+            await asyncio.sleep(0)
+        else:
+            await check_same_async('123456', hashed)
+        done += 1
+    return done
+
+
+async def probe(url, deadline, interval=0.01):
+    client = tornado.httpclient.AsyncHTTPClient()
+    latencies = []
+    while time.monotonic() < deadline:
+        start = time.monotonic()
+        await client.fetch(url)
+        latencies.append((time.monotonic() - start) * 1000)
+        await asyncio.sleep(interval)
+    return latencies
+
+
+async def run(mode, duration, load, port):
+    hashed = encrypt('123456')
+    deadline = time.monotonic() + duration
+    results = await asyncio.gather(probe('http://127.0.0.1:{}/healthz'.format(port), deadline),
+                                   *[bcryptLoad(mode, hashed, deadline) for _ in range(load)])
+    latencies = results[0]
+    return {
+        'mode': mode,
+        'probes': len(latencies),
+        'bcrypt_ops': sum(results[1:]),
+        'healthz_p50_ms': round(percentile(latencies, 50), 2),
+        'healthz_p99_ms': round(percentile(latencies, 99), 2),
+        'healthz_max_ms': round(max(latencies) if latencies else 0.0, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--load', type=int, default=8, help='concurrent bcrypt callers')
+    parser.add_argument('--executor', default='process', choices=['process', 'thread'])
+    parser.add_argument('--workers', type=int, default=0)
+    args = parser.parse_args()
+
+    service_main.STATSD_CONN = NullStatsd()
+    initCryptService(kind=args.executor, max_workers=args.workers, max_pending=max(64, args.load))
+
+    sock, port = tornado.testing.bind_unused_port()
+    server = tornado.httpserver.HTTPServer(service_main.make_app())
+    server.add_sockets([sock])
+
+    loop = asyncio.get_event_loop()
+    for mode in ('before', 'after'):
+        print(json.dumps(loop.run_until_complete(run(mode, args.duration, args.load, port))))
+
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
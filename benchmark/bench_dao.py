@@ -0,0 +1,86 @@
+"""
+Per call cost of the DAO read and write paths on the local SQLite stand-in (no query latency),
+so the numbers are the DAO layer's own work: statement building, row mapping and date formatting.
+
+For every operation it reports microseconds per call, and the memory blocks and bytes still allocated per
+call while the N results are kept alive (what a cache holding the rows pays), measured with tracemalloc.
+
+usage: python3 benchmark/bench_dao.py [--calls 20000]
+"""
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Add path of cwd to sys
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # config is loaded by relative path
+import gc
+import json
+import time
+import asyncio
+import argparse
+import tracemalloc
+
+from tool.Config import Config
+
+Config.getInstance().update({'LOG_LEVEL': 'WARNING'})  # measure the DAOs, not the log writer
+
+from tool.LocalMysqlPool import LocalMysqlPool
+from dao.UserDAO import UserDAO
+from dao.ImageDAO import ImageDAO
+
+
+async def measure(name, calls, call):
+    await call(0)  # warm up
+    gc.collect()
+    gc.disable()
+    results = []
+    start = time.perf_counter()
+    for i in range(calls):
+        results.append(await call(i))
+    elapsed = time.perf_counter() - start
+
+    results = []
+    tracemalloc.start()
+    blocks = sys.getallocatedblocks()
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(calls):
+        results.append(await call(i))
+    after = tracemalloc.get_traced_memory()[0]
+    blocks = sys.getallocatedblocks() - blocks
+    tracemalloc.stop()
+    gc.enable()
+    return {
+        'op': name,
+        'us_per_call': round(elapsed / calls * 1000000, 2),
+        'retained_blocks_per_call': round(blocks / calls, 1),
+        'retained_bytes_per_call': round((after - before) / calls, 1),
+    }
+
+
+async def run(calls):
+    pool = LocalMysqlPool(maxsize=1).getPool()
+    users = UserDAO(connect_pool=pool)
+    images = ImageDAO(connect_pool=pool)
+    await users.createUser('Jane', 'Doe', 'jane@example.com', 'hash')
+    await images.createUserImage('a.png', 'bucket/u1/a.png', 'u1')
+
+    report = [
+        await measure('getUserContextByUsername', calls, lambda i: users.getUserContextByUsername('jane@example.com')),
+        await measure('getUserInfoByUsername', calls, lambda i: users.getUserInfoByUsername('jane@example.com')),
+        await measure('usernameExist', calls, lambda i: users.usernameExist('jane@example.com')),
+        await measure('getUserImage', calls, lambda i: images.getUserImage('u1')),
+        await measure('createUser', calls, lambda i: users.createUser('Jane', 'Doe', 'user-{}@example.com'.format(i), 'hash')),
+        await measure('createUserImage', calls, lambda i: images.createUserImage('a.png', 'bucket/u/a.png', 'u-{}'.format(i))),
+    ]
+    pool.close()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=20000)
+    args = parser.parse_args()
+    for result in asyncio.new_event_loop().run_until_complete(run(args.calls)):
+        print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Encode cost per response body of GET /v1/user/self and GET /v1/user/self/pic.
+
+- tornado: what self.write(record.toDict()) did before tool.Serializer, strftime dict + tornado json_encode
+- json / orjson: tool.Serializer encoders on each backend, dates formatted while encoding
+- cached: the body memoized by ProfileCache / ImageCache, what a cache hit pays
+
+usage: python3 benchmark/bench_serializer.py [--calls 200000]
+"""
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Add path of cwd to sys
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # config is loaded by relative path
+import json
+import time
+import datetime
+import argparse
+
+from tornado.escape import json_encode
+
+from tool import Serializer
+from tool.ProfileCache import ProfileCache
+from tool.ImageCache import ImageCache
+from tool.UserContext import UserContext
+from tool.ImageRecord import ImageRecord
+
+
+def tornadoUser(user):
+    return json_encode({
+        'id': user.id,
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+        'username': user.username,
+        'account_created': user.account_created.strftime("%Y-%m-%d %H:%M:%S"),
+        'account_updated': user.account_updated.strftime("%Y-%m-%d %H:%M:%S"),
+        'verified': user.verified
+    }).encode()
+
+
+def tornadoImage(image):
+    return json_encode({
+        'id': image.id,
+        'file_name': image.file_name,
+        'user_id': image.user_id,
+        'url': image.url,
+        'upload_date': image.upload_date.strftime("%Y-%m-%d")
+    }).encode()
+
+
+def measure(resource, encoder, calls, encode):
+    encode()  # warm up
+    start = time.perf_counter()
+    for _ in range(calls):
+        encode()
+    elapsed = time.perf_counter() - start
+    return {'resource': resource, 'encoder': encoder, 'us_per_response': round(elapsed / calls * 1000000, 3),
+            'bytes': len(encode())}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=200000)
+    args = parser.parse_args()
+
+    now = datetime.datetime.now().replace(microsecond=0)
+    user = UserContext('6e0f5a1c-8a4f-11ee-b9d1-0242ac120002', 'Jane', 'Doe', 'jane@example.com', 'hash', now, now, True)
+    image = ImageRecord('7a4b2c3d-8a4f-11ee-b9d1-0242ac120002', 'a.png', user.id, 'bucket/{}/a.png'.format(user.id),
+                        now.date())
+
+    profile_cache = ProfileCache()
+    image_cache = ImageCache()
+    # fill the caches the way a first request does
+    profile_cache.etag(user)
+    image_cache.etag(image)
+
+    backends = [('json', Serializer._stdlibDumps)]
+    if Serializer.orjson is not None:
+        backends.append(('orjson', Serializer._orjsonDumps))
+
+    report = [measure('user', 'tornado', args.calls, lambda: tornadoUser(user))]
+    report += [measure('user', name, args.calls, lambda dumps=dumps: dumps(Serializer.userFields(user)))
+               for name, dumps in backends]
+    report.append(measure('user', 'cached', args.calls, lambda: profile_cache.body(user)))
+    report.append(measure('image', 'tornado', args.calls, lambda: tornadoImage(image)))
+    report += [measure('image', name, args.calls, lambda dumps=dumps: dumps(Serializer.imageFields(image)))
+               for name, dumps in backends]
+    report.append(measure('image', 'cached', args.calls, lambda: image_cache.body(image)))
+    for result in report:
+        print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
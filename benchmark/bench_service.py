@@ -0,0 +1,284 @@
+"""
+Load test of make_app() with local stand-ins: SQLite for MySQL, a directory for S3,
+an in-memory SNS publisher and a SQLite verification table.
+
+Every endpoint is first driven alone, then all of them together in a realistic mix.
+For every phase and endpoint it reports requests/sec, p50/p95/p99 latency seen by the clients and
+the event loop lag of the server, and writes the results as JSON so runs can be compared.
+
+usage: python3 benchmark/bench_service.py [--duration 5] [--clients 2] [--concurrency 8]
+                                          [--phases each,mix] [--output results.json]
+"""
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Add path of cwd to sys
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # config is loaded by relative path
+import json
+import time
+import uuid
+import base64
+import random
+import shutil
+import asyncio
+import argparse
+import datetime
+import platform
+import tempfile
+import subprocess
+import multiprocessing
+
+import tornado.httpserver
+import tornado.httpclient
+import tornado.testing
+
+from tool.Config import Config
+from tool.Metrics import LatencyHistogram
+from tool.JwtAuth import createToken
+from tool.cryptTool import encrypt
+
+PASSWORD = 'Bench-123456'
+
+# endpoint -> weight in the mix phase, roughly the traffic of a profile page
+MIX = {
+    'GET /healthz': 10,
+    'GET /metrics': 1,
+    'POST /v1/user': 2,
+    'GET /v1/verifyUserEmail': 2,
+    'GET /v1/user/self': 40,
+    'PUT /v1/user/self': 5,
+    'POST /v1/user/self/pic': 5,
+    'GET /v1/user/self/pic': 30,
+    'DELETE /v1/user/self/pic': 5,
+}
+
+
+def basicAuth(username):
+    return 'Basic ' + base64.b64encode('{}:{}'.format(username, PASSWORD).encode()).decode()
+
+
+class ClientLoop(object):
+    """ One simulated user, sends one request at a time """
+
+    def __init__(self, base_url, username, tokens, picture):
+        self.base_url = base_url
+        self.username = username
+        self.auth = basicAuth(username)
+        self.tokens = tokens
+        self.picture = picture
+        self.created = 0
+
+    def request(self, endpoint):
+        method, path = endpoint.split(' ', 1)
+        headers = {}
+        body = None
+        if path in ('/v1/user/self', '/v1/user/self/pic'):
+            headers['Authorization'] = self.auth
+
+        if endpoint == 'POST /v1/user':
+            self.created += 1
+            body = json.dumps({'first_name': 'Bench', 'last_name': 'User', 'password': PASSWORD,
+                               'username': 'new-{}-{}@example.com'.format(uuid.uuid4().hex[:12], self.created)})
+        elif endpoint == 'GET /v1/verifyUserEmail':
+            username, token = self.tokens.pop() if self.tokens else (self.username, 'used-up')
+            path = '{}?email={}&token={}'.format(path, username, token)
+        elif endpoint == 'PUT /v1/user/self':
+            body = json.dumps({'first_name': random.choice(['Ann', 'Bob', 'Cid']), 'last_name': 'User',
+                               'username': self.username})
+        elif endpoint == 'POST /v1/user/self/pic':
+            headers['Content-Type'] = 'multipart/form-data; boundary=BenchBoundary'
+            body = self.picture
+
+        return tornado.httpclient.HTTPRequest(self.base_url + path, method=method, headers=headers, body=body,
+                                              request_timeout=60)
+
+    async def run(self, endpoints, weights, deadline, samples):
+        client = tornado.httpclient.AsyncHTTPClient(force_instance=True)
+        while time.monotonic() < deadline:
+            endpoint = random.choices(endpoints, weights)[0]
+            start = time.monotonic()
+            response = await client.fetch(self.request(endpoint), raise_error=False)
+            samples.append((endpoint, response.code, (time.monotonic() - start) * 1000))
+        client.close()
+
+
+def clientProcess(base_url, loops, endpoints, weights, duration, results):
+    # load runs in other processes, so client work doesn't compete with the server's IOLoop
+    tornado.httpclient.AsyncHTTPClient.configure(None, max_clients=len(loops))
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    deadline = time.monotonic() + duration
+    samples = []
+    clients = [ClientLoop(base_url, *loop) for loop in loops]
+    asyncio.get_event_loop().run_until_complete(
+        asyncio.gather(*[client.run(endpoints, weights, deadline, samples) for client in clients]))
+    results.put(samples)
+
+
+async def monitorLoopLag(histogram, stop, interval=0.01):
+    """ Record how late the IOLoop wakes up a sleeping task, in microseconds """
+    while not stop.is_set():
+        start = time.monotonic()
+        await asyncio.sleep(interval)
+        histogram.record((time.monotonic() - start - interval) * 1000000)
+
+
+def summarize(latency, elapsed):
+    return {
+        'requests': latency.count,
+        'rps': round(latency.count / elapsed, 1),
+        'p50_ms': latency.percentile(50) / 1000.0,
+        'p95_ms': latency.percentile(95) / 1000.0,
+        'p99_ms': latency.percentile(99) / 1000.0,
+        'max_ms': (latency.max or 0) / 1000.0,
+    }
+
+
+def lagSummary(lag):
+    return {'p50_ms': lag.percentile(50) / 1000.0, 'p99_ms': lag.percentile(99) / 1000.0, 'max_ms': (lag.max or 0) / 1000.0}
+
+
+async def warmUp(base_url, users):
+    # verified Basic auth credentials are cached after the first request, measure the steady state
+    client = tornado.httpclient.AsyncHTTPClient()
+    await asyncio.gather(*[client.fetch(base_url + '/v1/user/self', headers={'Authorization': basicAuth(username)},
+                                        raise_error=False, request_timeout=120) for username in users])
+
+
+async def runPhase(name, mix, args, base_url, users, tokens, picture):
+    endpoints = list(mix)
+    weights = [mix[endpoint] for endpoint in endpoints]
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+
+    # every client loop gets its own user and its own share of verification tokens
+    loops = [(users[i], tokens[i::len(users)], picture) for i in range(len(users))]
+    processes = [context.Process(target=clientProcess,
+                                 args=(base_url, loops[i::args.clients], endpoints, weights, args.duration, results))
+                 for i in range(args.clients)]
+
+    lag = LatencyHistogram()
+    stop = asyncio.Event()
+    monitor = asyncio.ensure_future(monitorLoopLag(lag, stop))
+    for process in processes:
+        process.start()
+    start = time.monotonic()
+    samples = []
+    for _ in processes:
+        samples.extend(await asyncio.get_event_loop().run_in_executor(None, results.get))
+    elapsed = max(time.monotonic() - start, args.duration)
+    stop.set()
+    await monitor
+    for process in processes:
+        process.join()
+
+    latencies = {}
+    statuses = {}
+    total = LatencyHistogram()
+    for endpoint, code, ms in samples:
+        latencies.setdefault(endpoint, LatencyHistogram()).record(ms * 1000)
+        endpoint_statuses = statuses.setdefault(endpoint, {})
+        endpoint_statuses[str(code)] = endpoint_statuses.get(str(code), 0) + 1
+        total.record(ms * 1000)
+
+    result = {'phase': name, 'duration_s': round(elapsed, 2), 'loop_lag': lagSummary(lag), 'total': summarize(total, elapsed),
+              'endpoints': {}}
+    for endpoint in endpoints:
+        if endpoint in latencies:
+            result['endpoints'][endpoint] = dict(summarize(latencies[endpoint], elapsed), status=statuses[endpoint])
+    return result
+
+
+def seed(pool, users, unverified):
+    """ Insert verified users sharing one bcrypt hash, and unverified ones for the verify endpoint """
+    hashed = encrypt(PASSWORD)
+    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    rows = [(str(uuid.uuid4()), 'Bench', 'User', username, hashed, now, now, 1) for username in users]
+    rows += [(str(uuid.uuid4()), 'Bench', 'User', username, hashed, now, now, 0) for username in unverified]
+    pool.db.executemany("INSERT INTO user (id, first_name, last_name, username, password, account_created, "
+                        "account_updated, verified) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+
+def multipartPicture(size):
+    return (b'--BenchBoundary\r\n'
+            b'Content-Disposition: form-data; name="profilePic"; filename="bench.png"\r\n'
+            b'Content-Type: image/png\r\n\r\n' + os.urandom(size) + b'\r\n--BenchBoundary--\r\n')
+
+
+def gitRevision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--duration', type=float, default=5, help='seconds per phase')
+    parser.add_argument('--clients', type=int, default=2, help='load generating processes')
+    parser.add_argument('--concurrency', type=int, default=8, help='simulated users per client process')
+    parser.add_argument('--phases', default='each,mix', help="'each' drives every endpoint alone, 'mix' all together")
+    parser.add_argument('--query-latency', type=float, default=0.0005, help='seconds added to every SQL statement')
+    parser.add_argument('--picture-size', type=int, default=64 * 1024)
+    parser.add_argument('--verify-tokens', type=int, default=2000, help='unverified users with a verification token')
+    parser.add_argument('--output', default=None, help='also write the JSON results to this file')
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    Config.getInstance().update({
+        'MYSQL_POOL': 'local', 'MYSQL_LOCAL_PATH': ':memory:', 'MYSQL_LOCAL_LATENCY': args.query_latency,
+        'OBJECT_STORE': 'local', 'OBJECT_STORE_DIR': tmp_dir,
+        'SNS_PUBLISHER': 'local', 'SNS_OUTBOX_SPILL_FILE': '',
+        'VERIFICATION_STORE': 'local', 'VERIFICATION_STORE_PATH': ':memory:', 'VERIFICATION_EXPIRE_INTERVAL': 0,
+        'TOKEN_REPLAY_STORE': 'memory',
+    })
+    from service import service_main
+    service_main.initWorker()
+    loop = asyncio.get_event_loop()
+
+    users = ['bench-{}@example.com'.format(i) for i in range(args.clients * args.concurrency)]
+    tokens = [('verify-{}@example.com'.format(i), createToken(payload={'username': 'verify-{}@example.com'.format(i)},
+                                                               timeout=60)) for i in range(args.verify_tokens)]
+    seed(service_main.MYSQL_CONN_POOL.getPool(), users, [username for username, _ in tokens])
+    for username, token in tokens:
+        loop.run_until_complete(service_main.VERIFICATION_STORE.putRecord(username, token, 3600))
+    picture = multipartPicture(args.picture_size)
+
+    sock, port = tornado.testing.bind_unused_port()
+    server = tornado.httpserver.HTTPServer(service_main.make_app())
+    server.add_sockets([sock])
+    base_url = 'http://127.0.0.1:{}'.format(port)
+
+    report = {
+        'timestamp': datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+        'revision': gitRevision(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'args': vars(args),
+        'phases': [],
+    }
+    try:
+        loop.run_until_complete(warmUp(base_url, users))
+        phases = args.phases.split(',')
+        # a token verifies only once, the two phases get their own halves
+        each_tokens, mix_tokens = tokens[:len(tokens) // 2], tokens[len(tokens) // 2:]
+        if 'each' in phases:
+            for endpoint in MIX:
+                result = loop.run_until_complete(runPhase(endpoint, {endpoint: 1}, args, base_url, users, each_tokens, picture))
+                report['phases'].append(result)
+                print(json.dumps(result), file=sys.stderr)
+        if 'mix' in phases:
+            result = loop.run_until_complete(runPhase('mix', MIX, args, base_url, users, mix_tokens, picture))
+            report['phases'].append(result)
+            print(json.dumps(result), file=sys.stderr)
+    finally:
+        server.stop()
+        service_main.closeWorker()
+        shutil.rmtree(tmp_dir)
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import functools
+import collections
+
+from tool.Logger import Logger
+
+# name -> Statement, every DAO module registers its statements once at import
+STATEMENTS = {}
+
+Statement = collections.namedtuple('Statement', ('name', 'sql'))
+
+FETCH_NONE = 0
+FETCH_ONE = 1
+FETCH_ALL = 2
+
+
+def statement(name: str, sql: str) -> Statement:
+    if name in STATEMENTS:
+        raise ValueError('statement[{}] is already registered'.format(name))
+    STATEMENTS[name] = Statement(name, sql)
+    return STATEMENTS[name]
+
+
+def insertStatement(name: str, table: str, columns) -> Statement:
+    return statement(name, "INSERT INTO {table} ({keys}) VALUES ({values})".format(
+        table=table, keys=', '.join(columns), values=', '.join(['%s'] * len(columns))))
+
+
+@functools.lru_cache(maxsize=64)
+def expandIn(stmt: Statement, count: int) -> Statement:
+    """ Statement with its {in} list expanded to count placeholders, built once per count """
+    return Statement(stmt.name, stmt.sql.format(**{'in': ', '.join(['%s'] * count)}))
+
+
+async def execute(connect_pool, stmt: Statement, args=(), fetch: int = FETCH_NONE, mapper=None, commit: bool = False,
+                  key=None):
+    """
+    Run one statement on a connection of connect_pool.
+    Errors are logged, not raised, like everywhere in the DAOs.
+    :param fetch: FETCH_NONE, FETCH_ONE or FETCH_ALL
+    :param mapper: turns a fetched row into a record, e.g. UserContext.fromRow
+    :param key: logged along with the statement name, never log args, they may carry a password hash
+    :return: (affected or selected row count, None / record / list of records), (0, None) on errors
+    """
+    affectRowNum = 0
+    result = None
+    async with connect_pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            try:
+                affectRowNum = await cursor.execute(stmt.sql, args)
+                if fetch == FETCH_ONE:
+                    result = await cursor.fetchone()
+                    if result is not None and mapper is not None:
+                        result = mapper(result)
+                elif fetch == FETCH_ALL:
+                    result = await cursor.fetchall()
+                    if mapper is not None:
+                        result = [mapper(row) for row in result]
+                if commit:
+                    await conn.commit()
+                Logger.getInstance().info('execute sql[%s], key[%s], affectRowNum[%s]', stmt.name, key, affectRowNum)
+
+            except Exception as e:
+                affectRowNum = 0
+                result = None
+                Logger.getInstance().exception(e)
+
+    return affectRowNum, result
+
+
+async def executeMany(connect_pool, stmt: Statement, rows: list, key=None) -> int:
+    """
+    Run one statement for every row in a single transaction, an INSERT is sent as one multi-row INSERT.
+    :return: affected row count, 0 if the transaction was rolled back
+    """
+    affectRowNum = 0
+    async with connect_pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            try:
+                affectRowNum = await cursor.executemany(stmt.sql, rows)
+                await conn.commit()
+                Logger.getInstance().info('execute sql[%s] for %s rows, key[%s], affectRowNum[%s]',
+                                          stmt.name, len(rows), key, affectRowNum)
+
+            except Exception as e:
+                affectRowNum = 0
+                await conn.rollback()
+                Logger.getInstance().info('execute sql[%s] for %s rows rolled back: %r', stmt.name, len(rows), e)
+
+    return affectRowNum
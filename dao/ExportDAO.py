@@ -0,0 +1,56 @@
+import aiomysql
+
+from tool.Logger import Logger
+from tool.RoutingPool import reads
+from tool.ImageRecord import ImageRecord
+from dao.DaoCore import statement
+
+# table -> exported columns, id first. the password hash is never exported
+EXPORT_COLUMNS = {
+    'user': ('id', 'first_name', 'last_name', 'username', 'account_created', 'account_updated', 'verified'),
+    'image': ImageRecord.__slots__,
+}
+
+# keyset pagination on id, a page starts after the last id of the previous one
+SELECT_PAGE = {
+    table: statement('export.{}_page'.format(table),
+                     "SELECT {columns} FROM {table} WHERE id > %s ORDER BY id LIMIT %s".format(
+                         columns=', '.join(columns), table=table))
+    for table, columns in EXPORT_COLUMNS.items()
+}
+
+
+class ExportDAO(object):
+
+    def __init__(self, connect_pool):
+        self.connect_pool = connect_pool
+
+    @reads()
+    async def streamTable(self, table: str, after: str = '', page_size: int = 10000, chunk_size: int = 500):
+        """
+        Rows of table ordered by id, yielded in lists of at most chunk_size rows.
+        Every page is one query on an unbuffered server-side cursor (SSCursor), rows are read off the socket
+        as they are consumed, so memory doesn't grow with the table. A connection is held for one page,
+        not for the whole export, and the next page starts after the last id sent.
+        Unlike the other DAOs errors are raised, a truncated export must not look like a complete one.
+        :param after: export rows with an id greater than this, e.g. to resume an interrupted export
+        """
+        stmt = SELECT_PAGE[table]
+        total = 0
+        while True:
+            count = 0
+            async with self.connect_pool.acquire() as conn:
+                async with conn.cursor(aiomysql.SSCursor) as cursor:
+                    await cursor.execute(stmt.sql, (after, page_size))
+                    while True:
+                        rows = await cursor.fetchmany(chunk_size)
+                        if not rows:
+                            break
+                        count += len(rows)
+                        after = rows[-1][0]
+                        yield rows
+
+            total += count
+            if count < page_size:
+                Logger.getInstance().info('execute sql[%s], exported %s rows', stmt.name, total)
+                return
@@ -1,125 +1,134 @@
 import uuid
 import datetime
 
-import pymysql
-
-from tool.Config import Config
 from tool.Logger import Logger
+from tool.RoutingPool import reads, writes
+from tool.ImageRecord import ImageRecord
+from dao.DaoCore import statement, insertStatement, execute, FETCH_ONE
+
+SELECT_USER_ID = statement('image.select_user_id', "SELECT user_id FROM image WHERE user_id = %s")
+SELECT_IMAGE = statement('image.select', "SELECT " + ImageRecord.COLUMNS + " FROM image WHERE user_id = %s")
+SELECT_IMAGE_FOR_UPDATE = statement('image.select_for_update',
+                                    "SELECT " + ImageRecord.COLUMNS + " FROM image WHERE user_id = %s FOR UPDATE")
+UPDATE_IMAGE = statement('image.update', "UPDATE image SET file_name = %s, url = %s, upload_date = %s where user_id = %s")
+DELETE_IMAGE = statement('image.delete', "DELETE FROM image WHERE user_id = %s")
+INSERT_IMAGE = insertStatement('image.insert', 'image', ImageRecord.__slots__)
 
 
 class ImageDAO(object):
 
-    def __init__(self, connect_pool):
+    def __init__(self, connect_pool, image_cache=None):
         self.connect_pool = connect_pool
+        self.image_cache = image_cache  # tool.ImageCache of response bodies, invalidated on writes
 
-    async def userImageExist(self, user_id: str):
-        selectResult = None
-        async with self.connect_pool.acquire() as conn:
-            async with conn.cursor() as cursor:
-                try:
-                    await cursor.execute("SELECT user_id FROM image WHERE user_id = %s", [user_id, ])
-                    selectResult = await cursor.fetchone()
-                    Logger.getInstance().info('execute sql to determine exist of image by user_id [%s]' % user_id)
-
-                except Exception as e:
-                    Logger.getInstance().exception(e)
+    def __invalidate(self, user_id: str):
+        if self.image_cache is not None:
+            self.image_cache.invalidate(user_id)
 
+    @reads(key='user_id')
+    async def userImageExist(self, user_id: str):
+        _, selectResult = await execute(self.connect_pool, SELECT_USER_ID, (user_id, ), fetch=FETCH_ONE, key=user_id)
         return selectResult is not None
 
+    @reads(key='user_id')
     async def getUserImage(self, user_id: str):
-        selectResult = None
-        async with self.connect_pool.acquire() as conn:
-            async with conn.cursor() as cursor:
-                try:
-                    await cursor.execute(
-                        "SELECT id, file_name, user_id, url, upload_date FROM image WHERE user_id = %s",
-                        [user_id, ])
-                    Logger.getInstance().info('execute sql to get info of image by user_id[%s]' % user_id)
-                    selectResult = await cursor.fetchone()
-
-                except Exception as e:
-                    Logger.getInstance().exception(e)
-
-        if selectResult is not None:
-            return {
-                'id': selectResult[0],
-                'file_name': selectResult[1],
-                'user_id': selectResult[2],
-                'url': selectResult[3],
-                'upload_date': selectResult[4].strftime("%Y-%m-%d")
-            }
-        else:
-            return None
+        """ :return: ImageRecord, None if the user has no image """
+        _, image = await execute(self.connect_pool, SELECT_IMAGE, (user_id, ), fetch=FETCH_ONE,
+                                 mapper=ImageRecord.fromRow, key=user_id)
+        return image
 
+    @writes(key='user_id')
     async def updateUserImage(self, file_name: str, url: str, user_id: str):
-        affectRowNum = 0
-        async with self.connect_pool.acquire() as conn:
-            async with conn.cursor() as cursor:
-                try:
-                    affectRowNum = await cursor.execute(
-                        "UPDATE image SET file_name = %s, url = %s, upload_date = %s where user_id = %s",
-                        [file_name,
-                         url,
-                         datetime.datetime.now().strftime("%Y-%m-%d"),
-                         user_id, ])
-
-                    Logger.getInstance().info('execute sql for updating image info by user_id[%s]' % user_id)
-                    await conn.commit()
-                except Exception as e:
-                    Logger.getInstance().exception(e)
-
+        affectRowNum, _ = await execute(self.connect_pool, UPDATE_IMAGE, (file_name, url, datetime.date.today(), user_id),
+                                        commit=True, key=user_id)
+        self.__invalidate(user_id)
         if affectRowNum:
             return True
         else:
             return False
 
+    @writes(key='user_id')
     async def deleteUserImage(self, user_id: str):
+        affectRowNum, _ = await execute(self.connect_pool, DELETE_IMAGE, (user_id, ), commit=True, key=user_id)
+        self.__invalidate(user_id)
+        if affectRowNum:
+            return True
+        else:
+            return False
+
+    @writes(key='user_id')
+    async def createUserImage(self, file_name: str, url: str, user_id: str):
+        image = ImageRecord(str(uuid.uuid1()), file_name, user_id, url, datetime.date.today())
+        affectRowNum, _ = await execute(self.connect_pool, INSERT_IMAGE, image.toRow(), commit=True, key=user_id)
+        self.__invalidate(user_id)
+        if affectRowNum:
+            return True, image
+        else:
+            return False, image
+
+    @writes(key='user_id')
+    async def upsertUserImage(self, file_name: str, url: str, user_id: str):
+        """
+        Create or replace the image of a user in one transaction on one connection.
+        The existing row is locked with SELECT ... FOR UPDATE, so concurrent uploads of the same user are serialized.
+        :return: (isSuccess, previous url or None, new ImageRecord)
+        """
+        previousResult = None
         affectRowNum = 0
+        image = ImageRecord(str(uuid.uuid1()), file_name, user_id, url, datetime.date.today())
         async with self.connect_pool.acquire() as conn:
             async with conn.cursor() as cursor:
                 try:
-                    affectRowNum = await cursor.execute(
-                        "DELETE FROM image WHERE user_id = %s",
-                        [user_id, ]
-                    )
-
-                    Logger.getInstance().info('execute sql for deleting image info by user_id[%s]' % user_id)
+                    await cursor.execute(SELECT_IMAGE_FOR_UPDATE.sql, (user_id, ))
+                    previousResult = await cursor.fetchone()
+                    if previousResult is not None:
+                        image.id = previousResult[0]
+                        await cursor.execute(UPDATE_IMAGE.sql, (file_name, url, image.upload_date, user_id))
+                        # the locked row is updated, even when uploading the same image again changes nothing in it
+                        affectRowNum = 1
+                    else:
+                        affectRowNum = await cursor.execute(INSERT_IMAGE.sql, image.toRow())
                     await conn.commit()
+                    Logger.getInstance().info('execute sql for upserting image info by user_id[%s]', user_id)
+
                 except Exception as e:
+                    affectRowNum = 0
+                    await conn.rollback()
                     Logger.getInstance().exception(e)
 
+        self.__invalidate(user_id)
+        previousUrl = previousResult[3] if previousResult is not None else None
         if affectRowNum:
-            return True
+            return True, previousUrl, image
         else:
-            return False
-
-    async def createUserImage(self, file_name: str, url: str, user_id: str):
-        table = 'image'
-        data = {
-            'id': str(uuid.uuid1()),
-            'file_name': file_name,
-            'url': url,
-            'user_id': user_id,
-            'upload_date': datetime.datetime.now().strftime("%Y-%m-%d"),
-        }
-        keys = ', '.join(data.keys())
-        values = ', '.join(['%s'] * len(data))
-        insert_sql = "INSERT INTO {table} ({keys}) VALUES ({values})".format(table=table, keys=keys, values=values)
-
+            return False, previousUrl, image
+
+    @writes(key='user_id')
+    async def fetchAndDeleteUserImage(self, user_id: str):
+        """
+        Delete the image of a user and return the deleted row, in one transaction on one connection.
+        :return: deleted ImageRecord, None if user has no image or deleting failed
+        """
+        image = None
         affectRowNum = 0
         async with self.connect_pool.acquire() as conn:
             async with conn.cursor() as cursor:
                 try:
-                    affectRowNum = await cursor.execute(insert_sql, tuple(data.values()))
+                    await cursor.execute(SELECT_IMAGE_FOR_UPDATE.sql, (user_id, ))
+                    selectResult = await cursor.fetchone()
+                    if selectResult is not None:
+                        image = ImageRecord.fromRow(selectResult)
+                        affectRowNum = await cursor.execute(DELETE_IMAGE.sql, (user_id, ))
                     await conn.commit()
-                    Logger.getInstance().info(
-                        'execute sql for inserting a image, affectRowNum[{}], insert sql[{}], values[{}]'.format(
-                            affectRowNum, insert_sql, tuple(data.values())))
+                    Logger.getInstance().info('execute sql for fetching and deleting image info by user_id[%s]', user_id)
 
                 except Exception as e:
+                    affectRowNum = 0
+                    await conn.rollback()
                     Logger.getInstance().exception(e)
 
-        if affectRowNum:
-            return True, data
+        self.__invalidate(user_id)
+        if image is not None and affectRowNum:
+            return image
         else:
-            return False, data
+            return None
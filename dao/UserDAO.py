@@ -1,162 +1,132 @@
 import uuid
 import datetime
 
-import pymysql
+from tool.RoutingPool import reads, writes
+from tool.UserContext import UserContext
+from dao.DaoCore import statement, insertStatement, expandIn, execute, executeMany, FETCH_ONE, FETCH_ALL
 
-from tool.Config import Config
-from tool.Logger import Logger
+SELECT_VERIFIED_ID = statement('user.select_verified_id', "SELECT id FROM user WHERE username = %s and verified = TRUE")
+SELECT_ID = statement('user.select_id', "SELECT id FROM user WHERE username = %s")
+SELECT_USERNAMES_IN = statement('user.select_usernames_in', "SELECT username FROM user WHERE username IN ({in})")
+SELECT_USER = statement('user.select', "SELECT " + UserContext.COLUMNS + " FROM user WHERE username = %s")
+UPDATE_USER = statement('user.update',
+                        "UPDATE user SET first_name = %s, last_name = %s, password = %s, account_updated = %s where username = %s")
+UPDATE_VERIFIED = statement('user.update_verified', "UPDATE user SET verified = TRUE where username = %s")
+INSERT_USER = insertStatement('user.insert', 'user', UserContext.__slots__)
 
 
 class UserDAO(object):
 
-    def __init__(self, connect_pool):
+    def __init__(self, connect_pool, profile_cache=None):
         self.connect_pool = connect_pool
+        self.profile_cache = profile_cache  # tool.ProfileCache of response bodies, invalidated on writes
 
-    async def usernameVerified(self, username: str):
-        selectResult = None
-        async with self.connect_pool.acquire() as conn:
-            async with conn.cursor() as cursor:
-                try:
-                    await cursor.execute("SELECT id FROM user WHERE username = %s and verified = TRUE", [username, ])
-                    selectResult = await cursor.fetchone()
-                    Logger.getInstance().info('execute sql to determine verification of username[%s]' % username)
-
-                except Exception as e:
-                    Logger.getInstance().exception(e)
+    def __invalidate(self, username: str):
+        if self.profile_cache is not None:
+            self.profile_cache.invalidate(username)
 
+    @reads(key='username')
+    async def usernameVerified(self, username: str):
+        _, selectResult = await execute(self.connect_pool, SELECT_VERIFIED_ID, (username, ), fetch=FETCH_ONE, key=username)
         return selectResult is not None
 
+    @reads(key='username')
     async def usernameExist(self, username: str):
-        selectResult = None
-        async with self.connect_pool.acquire() as conn:
-            async with conn.cursor() as cursor:
-                try:
-                    await cursor.execute("SELECT id FROM user WHERE username = %s", [username, ])
-                    selectResult = await cursor.fetchone()
-                    Logger.getInstance().info('execute sql to determine exist of username[%s]' % username)
-
-                except Exception as e:
-                    Logger.getInstance().exception(e)
-
+        _, selectResult = await execute(self.connect_pool, SELECT_ID, (username, ), fetch=FETCH_ONE, key=username)
         return selectResult is not None
 
+    @reads(key='username')
     async def getUserIdByUserName(self, username: str):
-        selectResult = None
-        async with self.connect_pool.acquire() as conn:
-            async with conn.cursor() as cursor:
-                try:
-                    await cursor.execute("SELECT id FROM user WHERE username = %s", [username, ])
-                    selectResult = await cursor.fetchone()
-                    Logger.getInstance().info('execute sql to determine exist of username[%s]' % username)
-
-                except Exception as e:
-                    Logger.getInstance().exception(e)
-
+        _, selectResult = await execute(self.connect_pool, SELECT_ID, (username, ), fetch=FETCH_ONE, key=username)
         if selectResult is not None:
             return True, selectResult[0]
         else:
             return False, None
 
+    @reads(key='username')
     async def getUserInfoByUsername(self, username: str):
-        selectResult = None
-        async with self.connect_pool.acquire() as conn:
-            async with conn.cursor() as cursor:
-                try:
-                    await cursor.execute(
-                        "SELECT id, first_name, last_name, username, password, account_created, account_updated, verified FROM user WHERE userName = %s",
-                        [username, ])
-                    Logger.getInstance().info('execute sql to get info of user by username[%s]' % username)
-                    selectResult = await cursor.fetchone()
-
-                except Exception as e:
-                    Logger.getInstance().exception(e)
+        """ :return: UserContext (password hash included), None if there is no such user """
+        return await self.__loadUserContext(username)
 
-        if selectResult is not None:
-            return {
-                'id': selectResult[0],
-                'first_name': selectResult[1],
-                'last_name': selectResult[2],
-                'username': selectResult[3],
-                'password': selectResult[4],
-                'account_created': selectResult[5].strftime("%Y-%m-%d %H:%M:%S"),
-                'account_updated': selectResult[6].strftime("%Y-%m-%d %H:%M:%S"),
-                'verified': selectResult[7]
-            }
-        else:
-            return None
+    @reads(key='username')
+    async def getUserContextByUsername(self, username: str):
+        # principal resolution, the whole user row (verified included) in one query.
+        # always read from the database, a cached row of this process may hold a password changed on another worker
+        return await self.__loadUserContext(username)
 
-    async def updateUser(self, first_name: str, last_name: str, username: str, password: str):
-        affectRowNum = 0
-        async with self.connect_pool.acquire() as conn:
-            async with conn.cursor() as cursor:
-                try:
-                    affectRowNum = await cursor.execute(
-                        "UPDATE user SET first_name = %s, last_name = %s, password = %s, account_updated = %s where username = %s",
-                        [first_name,
-                         last_name,
-                         password,
-                         datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                         username, ])
-
-                    Logger.getInstance().info('execute sql to update info of user by username[%s]' % username)
-                    await conn.commit()
-                except Exception as e:
-                    Logger.getInstance().exception(e)
+    async def __loadUserContext(self, username: str):
+        _, user = await execute(self.connect_pool, SELECT_USER, (username, ), fetch=FETCH_ONE,
+                                mapper=UserContext.fromRow, key=username)
+        return user
 
+    @writes(key='username')
+    async def updateUser(self, first_name: str, last_name: str, username: str, password: str):
+        affectRowNum, _ = await execute(self.connect_pool, UPDATE_USER,
+                                        (first_name, last_name, password, datetime.datetime.now().replace(microsecond=0),
+                                         username),
+                                        commit=True, key=username)
+        self.__invalidate(username)
         if affectRowNum:
             return True
         else:
             return False
 
+    @writes(key='username')
     async def updateVerifiedByUsername(self, username: str):
-        affectRowNum = 0
-        async with self.connect_pool.acquire() as conn:
-            async with conn.cursor() as cursor:
-                try:
-                    affectRowNum = await cursor.execute("UPDATE user SET verified = TRUE where username = %s",
-                                                        [username, ])
-
-                    Logger.getInstance().info('execute sql to update verified by username[%s]' % username)
-                    await conn.commit()
-                except Exception as e:
-                    Logger.getInstance().exception(e)
-
+        affectRowNum, _ = await execute(self.connect_pool, UPDATE_VERIFIED, (username, ), commit=True, key=username)
+        self.__invalidate(username)
         if affectRowNum:
             return True
         else:
             return False
 
+    @writes(key='username')
     async def createUser(self, first_name: str, last_name: str, username: str, password: str):
-        table = 'user'
-        data = {
-            'id': str(uuid.uuid1()),
-            'first_name': first_name,
-            'last_name': last_name,
-            'username': username,
-            'password': password,
-            'account_created': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            'account_updated': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            'verified': False
-        }
-        keys = ', '.join(data.keys())
-        values = ', '.join(['%s'] * len(data))
-        insert_sql = "INSERT INTO {table} ({keys}) VALUES ({values})".format(table=table, keys=keys, values=values)
-
-        affectRowNum = 0
-        async with self.connect_pool.acquire() as conn:
-            async with conn.cursor() as cursor:
-                try:
-                    affectRowNum = await cursor.execute(insert_sql, tuple(data.values()))
-                    await conn.commit()
-                    Logger.getInstance().info(
-                        'execute sql of inserting a user, affectRowNum[{}], insert sql[{}], values[{}]'.format(
-                            affectRowNum, insert_sql, tuple(data.values())))
-
-                except Exception as e:
-                    Logger.getInstance().exception(e)
-
-        data.pop("password")  # 返回不应该有密码
+        """ :return: (isSuccess, UserContext of the new user), the password never reaches a response, see tool.Serializer.encodeUser """
+        now = datetime.datetime.now().replace(microsecond=0)
+        user = UserContext(str(uuid.uuid1()), first_name, last_name, username, password, now, now, False)
+        affectRowNum, _ = await execute(self.connect_pool, INSERT_USER, user.toRow(), commit=True, key=username)
+        self.__invalidate(username)
         if affectRowNum:
-            return True, data
+            return True, user
+        else:
+            return False, user
+
+    async def existingUsernames(self, usernames: list) -> set:
+        """
+        One IN (...) query for a chunk of usernames, not declared @reads:
+        uniqueness is checked on the primary, a lagging replica would miss users created moments ago
+        """
+        if not usernames:
+            return set()
+        _, rows = await execute(self.connect_pool, expandIn(SELECT_USERNAMES_IN, len(usernames)), tuple(usernames),
+                                fetch=FETCH_ALL, key='{} usernames'.format(len(usernames)))
+        return set(row[0] for row in rows or ())
+
+    @writes(key=lambda arguments: [user[2] for user in arguments['users']])
+    async def createUsers(self, users: list) -> list:
+        """
+        Insert a chunk of users in one transaction. If it is rolled back (e.g. a username was taken meanwhile)
+        every user is inserted on its own, so one bad row doesn't fail the others.
+        :param users: (first_name, last_name, username, password hash) of every new user
+        :return: (isSuccess, UserContext) of every user
+        """
+        now = datetime.datetime.now().replace(microsecond=0)
+        records = [UserContext(str(uuid.uuid1()), first_name, last_name, username, password, now, now, False)
+                   for first_name, last_name, username, password in users]
+        if not records:
+            return []
+
+        affectRowNum = await executeMany(self.connect_pool, INSERT_USER, [user.toRow() for user in records],
+                                         key='{} users'.format(len(records)))
+        if affectRowNum == len(records):
+            results = [(True, user) for user in records]
         else:
-            return False, data
+            results = []
+            for user in records:
+                affectRowNum, _ = await execute(self.connect_pool, INSERT_USER, user.toRow(), commit=True, key=user.username)
+                results.append((bool(affectRowNum), user))
+
+        for user in records:
+            self.__invalidate(user.username)
+        return results
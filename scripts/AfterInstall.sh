@@ -2,6 +2,10 @@ sudo systemctl stop webservice.service
 
 sudo cp /home/ec2-user/service_main.py /home/ec2-user/webservice/service/
 
+sudo cp -r /home/ec2-user/tool /home/ec2-user/webservice/
+
+sudo cp -r /home/ec2-user/dao /home/ec2-user/webservice/
+
 sudo cp /home/ec2-user/cloudwatch-config.json /home/ec2-user/webservice/
 
 sudo /opt/aws/amazon-cloudwatch-agent/bin/amazon-cloudwatch-agent-ctl -a fetch-config -m ec2 -c file:/home/ec2-user/webservice/cloudwatch-config.json -s
@@ -1,30 +1,102 @@
 import os
 import sys
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Add path of cwd to sys
+import io
+import csv
 import json
+import hmac
+import datetime
+import signal
 import asyncio
-from io import BytesIO
 import time
+import uuid
+import mimetypes
 
 import statsd
 import tornado.web
 import tornado.ioloop
 import tornado.httpserver
+import tornado.netutil
 import tornado.gen
-import boto3
+import tornado.iostream
 
 from tool.Config import Config
 from tool.Logger import Logger
 from tool.regexTool import isValidEmail
-from tool.cryptTool import encrypt, checkSame
+from tool.cryptTool import encrypt_async, encrypt_many_async, check_same_async, initCryptService, CryptBusyError
 from tool.BasicAuth import isBasicAuth, parseBasicAuth
 from tool.JwtAuth import createToken, parsePayload
-from tool.MysqlConnectPool import MysqlConnectPool
+from tool.MysqlConnectPool import createMysqlPool
+from tool.RoutingPool import RoutingPool
+from tool.CredentialCache import CredentialCache
+from tool.TokenCache import VerifiedTokenCache
+from tool.ProfileCache import ProfileCache
+from tool.ImageCache import ImageCache
+from tool.ObjectStore import createObjectStore
+from tool.SnsOutbox import createSnsOutbox
+from tool.VerificationStore import createVerificationStore, expireStaleRecords
+from tool.TokenReplayStore import createTokenReplayStore, ReplayStoreFullError, DEFAULT_TOKEN_TTL
+from tool.Prefork import Supervisor
+from tool.Metrics import StatsdPipeline, RouteMetrics
+from tool.Serializer import dumps, encodeUser, encodeImage, userFields, formatDatetime, formatDate
+from tool.Conditional import userLastModified, imageLastModified, parseHttpDate, parseRange
+from tool.DiskCache import DiskCache
+from tool.MultipartParser import MultipartParser, MultipartError, parseBoundary
 from dao.UserDAO import UserDAO
 from dao.ImageDAO import ImageDAO
+from dao.ExportDAO import ExportDAO, EXPORT_COLUMNS
+
+PICTURE_MAX_SIZE = Config.getInstance().get('PICTURE_MAX_SIZE', 10 * 1024 * 1024)  # bytes
+PICTURE_UPLOAD_STREAMING = Config.getInstance().get('PICTURE_UPLOAD_STREAMING', False)
+PICTURE_PRESIGN_EXPIRES = Config.getInstance().get('PICTURE_PRESIGN_EXPIRES', 300)  # seconds a presigned url is valid
+PICTURE_CONTENT_CHUNK = Config.getInstance().get('PICTURE_CONTENT_CHUNK', 64 * 1024)  # bytes per read and flush
+READ_STICKY_SECONDS = Config.getInstance().get('MYSQL_READ_STICKY_SECONDS', 5)
+READ_STICKY_COOKIE = 'read_primary_until'  # unix time until which the client's rows are read from the primary
+MULTIPART_OVERHEAD_SIZE = 64 * 1024  # room for multipart boundaries, headers and other form fields
+BATCH_IMPORT_CHUNK = Config.getInstance().get('BATCH_IMPORT_CHUNK', 500)  # users per query, transaction and outbox batch
+BATCH_IMPORT_MAX_ROWS = Config.getInstance().get('BATCH_IMPORT_MAX_ROWS', 10000)
+EXPORT_PAGE_SIZE = Config.getInstance().get('EXPORT_PAGE_SIZE', 10000)  # rows per keyset query of an export
+EXPORT_CHUNK = Config.getInstance().get('EXPORT_CHUNK', 500)  # rows per write and flush of an export
+
+ACTIVE_REQUESTS = 0  # requests in flight in this worker, drained on graceful shutdown
+ROUTE_METRICS = RouteMetrics()  # replaced by a statsd backed one in initWorker
+CACHES = {}  # name -> in-process cache, stats are served by /metrics
+MYSQL_CONN_POOL = None  # created in initWorker
+PICTURE_CACHE = None  # created in initWorker
+
+
+def invalidatePictureContent(*urls):
+    # bytes of replaced or deleted pictures must not be served from the disk cache of this process
+    if PICTURE_CACHE is not None:
+        for url in urls:
+            PICTURE_CACHE.invalidate(url)
 
 
 class BaseHandler(tornado.web.RequestHandler):
+    def initialize(self):
+        global ACTIVE_REQUESTS
+        ACTIVE_REQUESTS += 1
+        self.request_counted = True
+
+    def on_finish(self):
+        self.__releaseRequest()
+
+    def on_connection_close(self):
+        # tornado doesn't call on_finish when the client goes away before the response, e.g. in the middle of a
+        # streamed request body
+        super().on_connection_close()
+        self.__releaseRequest()
+
+    def __releaseRequest(self):
+        global ACTIVE_REQUESTS
+        if self.request_counted:
+            self.request_counted = False
+            ACTIVE_REQUESTS -= 1
+            # count, status and latency of every route are recorded here, handlers don't time themselves.
+            # 499 (client closed request, as nginx logs it) if the response was not finished
+            status = self.get_status() if self._finished else 499
+            ROUTE_METRICS.record(self.request.method, self.request.path, status, self.request.request_time())
+
     @tornado.gen.coroutine
     def prepare(self):
         super(BaseHandler, self).prepare()
@@ -32,6 +104,46 @@ class BaseHandler(tornado.web.RequestHandler):
     def set_default_headers(self):
         super().set_default_headers()
 
+    def notModified(self, etag: str, last_modified) -> bool:
+        """
+        Set the validators of the response, True if the client's copy is current and a 304 is to be sent.
+        If-None-Match wins over If-Modified-Since (RFC 7232 section 6).
+        HTTP dates have whole seconds, a date of the current second may predate a change made later in it.
+        """
+        self.set_header("Etag", etag)
+        self.set_header("Last-Modified", last_modified)
+        if "If-None-Match" in self.request.headers:
+            return self.check_etag_header()
+        since = parseHttpDate(self.request.headers.get("If-Modified-Since", ""))
+        now = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+        return since is not None and last_modified.replace(microsecond=0) <= since < now
+
+    def stickToPrimary(self):
+        """
+        After a successful write: the client's rows are read from the primary for READ_STICKY_SECONDS, whichever
+        worker its next requests reach. The window travels with the client as a cookie, see readYourWrites
+        """
+        self.set_cookie(READ_STICKY_COOKIE, '{:.3f}'.format(time.time() + READ_STICKY_SECONDS),
+                        max_age=int(READ_STICKY_SECONDS) + 1, httponly=True)
+
+    def readYourWrites(self, *keys):
+        """ Read keys from the primary while the client's sticky window is open, the write may be another worker's """
+        try:
+            remaining = float(self.get_cookie(READ_STICKY_COOKIE, '')) - time.time()
+        except ValueError:
+            return
+        pool = MYSQL_CONN_POOL.getPool()
+        if remaining > 0 and isinstance(pool, RoutingPool):
+            pool.markWritten(keys, ttl=remaining)  # never longer than the pool's own window
+
+    def adminAuthorized(self):
+        """ Authorization is "Bearer ADMIN_API_KEY", always False while no key is configured """
+        admin_key = Config.getInstance().get('ADMIN_API_KEY') or ''
+        token = self.request.headers.get('Authorization', '')
+        if not admin_key or not token.startswith('Bearer '):
+            return False
+        return hmac.compare_digest(token[len('Bearer '):].encode(), admin_key.encode())
+
 
 class TokenHandler(BaseHandler):
     @tornado.gen.coroutine
@@ -41,6 +153,16 @@ class TokenHandler(BaseHandler):
         token = head.get("Authorization", "")
         self.token_passed = False
 
+        try:
+            yield self.authenticate(token)
+        except CryptBusyError as err:
+            Logger.getInstance().info('Crypt service is busy, reject request: {err}'.format(err=err))
+            self.set_status(503)
+            self.finish()
+
+    @tornado.gen.coroutine
+    def authenticate(self, token):
+        # resolve the principal with a single user query, verified flag comes with the row
         if isBasicAuth(token):
             # basic auth token
             result = parseBasicAuth(token)
@@ -51,20 +173,25 @@ class TokenHandler(BaseHandler):
                     username = self.token_msg.get("username", None)
                     password = self.token_msg.get("password", None)
                     if username is not None and password is not None:
+                        self.readYourWrites(username)
                         dao = UserDAO(connect_pool=MYSQL_CONN_POOL.getPool())
-                        userInfo = yield dao.getUserInfoByUsername(username)
-                        if userInfo is not None and (username == userInfo["username"] and checkSame(password, userInfo["password"])):
-                            username_verified = yield dao.usernameVerified(username)
-                            if username_verified:
+                        user = yield dao.getUserContextByUsername(username)
+                        password_matched = False
+                        if user is not None and username == user.username:
+                            password_matched = yield self.checkPassword(username, password, user.password)
+                        if password_matched:
+                            if user.verified:
                                 Logger.getInstance().info('Username from basic token is verified!')
+                                self.current_user = user
                                 self.token_passed = True
+                                self.readYourWrites(user.id)  # image rows are keyed by user id
                             else:
                                 Logger.getInstance().info('Username from basic token is unverified......')
                         else:
                             Logger.getInstance().info('Username and password from basic token are unmatched with database')
         else:
             # jwt auth token
-            result = parsePayload(token)
+            result = parsePayload(token, cache=TOKEN_CACHE)
             if result["status"]:
                 # 解析 payload, 提取 username 和 password 进行比对
                 data = result["data"]
@@ -74,61 +201,87 @@ class TokenHandler(BaseHandler):
                     username = self.token_msg.get("username", None)
                     password = self.token_msg.get("password", None)
                     if username is not None and password is not None:
+                        self.readYourWrites(username)
                         dao = UserDAO(connect_pool=MYSQL_CONN_POOL.getPool())
-                        userInfo = yield dao.getUserInfoByUsername(username)
-                        if userInfo is not None and (userInfo["username"] == username and userInfo["password"] == password):
-                            username_verified = yield dao.usernameVerified(username)
-                            if username_verified:
+                        user = yield dao.getUserContextByUsername(username)
+                        if user is not None and (user.username == username and user.password == password):
+                            if user.verified:
+                                self.current_user = user
                                 self.token_passed = True
+                                self.readYourWrites(user.id)
                             else:
                                 Logger.getInstance().info('Username from jwt token is unverified')
                         else:
                             Logger.getInstance().info('Username and password jwt from token are unmatched with database')
 
+    @staticmethod
+    async def checkPassword(username, password, hashed):
+        # bcrypt verify is expensive, skip it for credentials verified recently
+        if CREDENTIAL_CACHE.check(username, password, hashed):
+            return True
+
+        if await check_same_async(password, hashed):
+            CREDENTIAL_CACHE.add(username, password, hashed)
+            return True
+
+        return False
+
 
 class HealthzHandler(BaseHandler):
     def get(self):
-        service_start_time = time.time()
         try:
-            STATSD_CONN.incr('[GET] healthz')
             self.set_header("Content-Type", "application/json; charset=utf-8")
-            Logger.getInstance().info('[GET] healthz')
-            STATSD_CONN.timing('timing [GET] healthz ', (time.time() - service_start_time) * 1000)
+            Logger.getInstance().debug('[GET] healthz')  # load balancer probes, not logged at INFO
             self.finish()
             return
         except Exception as err:
             Logger.getInstance().exception(err)
             self.set_status(500)
-            STATSD_CONN.timing('timing [GET] healthz ', (time.time() - service_start_time) * 1000)
             self.write(str(err))
             return
 
 
+class MetricsHandler(BaseHandler):
+    def get(self):
+        # metrics of this worker process only
+        snapshot = ROUTE_METRICS.snapshot()
+        snapshot['active_requests'] = ACTIVE_REQUESTS
+        snapshot['caches'] = {name: cache.stats() for name, cache in CACHES.items()}
+        if MYSQL_CONN_POOL is not None:
+            snapshot['mysql_pool'] = MYSQL_CONN_POOL.getPool().stats()
+        self.set_header("Content-Type", "application/json; charset=utf-8")
+        self.write(snapshot)
+
+
 # class HealthHandler(BaseHandler):
 #     def get(self):
-#         service_start_time = time.time()
 #         try:
-#             STATSD_CONN.incr('[GET] health')
 #             self.set_header("Content-Type", "application/json; charset=utf-8")
 #             Logger.getInstance().info('[GET] health')
-#             STATSD_CONN.timing('timing [GET] health ', (time.time() - service_start_time) * 1000)
 #             self.finish()
 #             return
 #         except Exception as err:
 #             Logger.getInstance().exception(err)
 #             self.set_status(500)
-#             STATSD_CONN.timing('timing [GET] health ', (time.time() - service_start_time) * 1000)
 #             self.write(str(err))
 #             return
 
 
+def verificationMessage(username: str) -> dict:
+    # 创建 token, ??? mins 后过期
+    token = createToken(payload={"username": username}, timeout=999999999)
+    verify_link = "https://prod.weifenglai.me/v1/verifyUserEmail?email={username}&token={token}".format(username=username, token=token)
+    return {
+        'email': username,
+        'token': token,
+        'verify_link': verify_link
+    }
+
+
 class UserCreateHandler(BaseHandler):
     @tornado.gen.coroutine
     def post(self):
-        service_start_time = time.time()
         try:
-            STATSD_CONN.incr('[POST] /v1/user')
-
             self.set_header("Content-Type", "application/json; charset=utf-8")  # set response header
 
             data = json.loads(self.request.body)
@@ -141,64 +294,237 @@ class UserCreateHandler(BaseHandler):
             if not isValidEmail(username):
                 Logger.getInstance().info('{username} is not a valid email address'.format(username=username))
                 self.set_status(400)
-                STATSD_CONN.timing('timing [POST] /v1/user ', (time.time() - service_start_time) * 1000)
                 self.finish()
                 return
 
             # Validate duplicated username
-            dao = UserDAO(connect_pool=MYSQL_CONN_POOL.getPool())
+            dao = UserDAO(connect_pool=MYSQL_CONN_POOL.getPool(), profile_cache=PROFILE_CACHE)
             usernameExist = yield dao.usernameExist(username)
             if usernameExist:
                 Logger.getInstance().info('duplicated username[{username}]'.format(username=username))
                 self.set_status(400)
-                STATSD_CONN.timing('timing [POST] /v1/user ', (time.time() - service_start_time) * 1000)
                 self.finish()
                 return
 
             # create user
-            password = encrypt(password)  # encrypt password
-            isSuccess, respBodyDict = yield dao.createUser(first_name, last_name, username, password)
+            password = yield encrypt_async(password)  # encrypt password in crypt service
+            isSuccess, user = yield dao.createUser(first_name, last_name, username, password)
             if isSuccess:
-                # 创建 token, ??? mins 后过期
-                token = createToken(payload={"username": username}, timeout=999999999)
-
-                # Publish sns, 触发 Lambda 操作, 操作 DynamoDb 并发邮件
-                sns_client = boto3.client('sns', region_name='us-east-1')
-                verify_link = "https://prod.weifenglai.me/v1/verifyUserEmail?email={username}&token={token}".format(username=username, token=token)
-                sns_message = {
-                    'email': username,
-                    'token': token,
-                    'verify_link': verify_link
-                }
+                # Publish sns through outbox, 触发 Lambda 操作, 操作 DynamoDb 并发邮件
+                sns_message = verificationMessage(username)
                 Logger.getInstance().info('sns_message: {msg}'.format(msg=sns_message))
-                Logger.getInstance().info('TopicArn: {TopicArn}'.format(TopicArn=Config.getInstance()['SNSTopic']))
-                sns_client.publish(TopicArn=Config.getInstance()['SNSTopic'],
-                                   Message=json.dumps(sns_message))
+                SNS_OUTBOX.enqueue(sns_message)
 
                 # respBodyDict['token'] = createToken(payload={"username": username, "password": password}, timeout=20)  # JWT token
+                self.stickToPrimary()
                 self.set_status(201)
-                STATSD_CONN.timing('timing [POST] /v1/user ', (time.time() - service_start_time) * 1000)
-                self.write(respBodyDict)
+                self.write(encodeUser(user))
             else:
                 self.set_status(500)
-                STATSD_CONN.timing('timing [POST] /v1/user ', (time.time() - service_start_time) * 1000)
                 self.finish()
 
+        except CryptBusyError as err:
+            Logger.getInstance().info('Crypt service is busy: {err}'.format(err=err))
+            self.set_status(503)
+            self.finish()
+            return
+
         except Exception as err:
             Logger.getInstance().exception(err)
             self.set_status(500)
-            STATSD_CONN.timing('timing [POST] /v1/user ', (time.time() - service_start_time) * 1000)
             self.write(str(err))
             return
 
 
+class UserBatchHandler(BaseHandler):
+    """
+    POST /v1/users:batch, bulk import for migrations and partner imports, authorized by "Bearer ADMIN_API_KEY".
+    The body is NDJSON, every line a user like the body of POST /v1/user. Users are imported in chunks of
+    BATCH_IMPORT_CHUNK: one IN (...) query for taken usernames, passwords hashed across the crypt pool,
+    one INSERT transaction and one outbox enqueue per chunk.
+    The response streams an NDJSON result per input line as every chunk is done, and a summary line last.
+    """
+
+    @tornado.gen.coroutine
+    def post(self):
+        try:
+            self.set_header("Content-Type", "application/x-ndjson; charset=utf-8")  # set response header
+
+            if not self.adminAuthorized():
+                Logger.getInstance().info('batch import without a valid admin key')
+                self.set_status(403)
+                self.finish()
+                return
+
+            lines = [(line_no, line) for line_no, line in enumerate(self.request.body.splitlines(), 1) if line.strip()]
+            if len(lines) > BATCH_IMPORT_MAX_ROWS:
+                Logger.getInstance().info('batch import of %s users is too large', len(lines))
+                self.set_status(413)
+                self.finish()
+                return
+
+            dao = UserDAO(connect_pool=MYSQL_CONN_POOL.getPool(), profile_cache=PROFILE_CACHE)
+            created = 0
+            for start in range(0, len(lines), BATCH_IMPORT_CHUNK):
+                results = yield self.importChunk(dao, lines[start:start + BATCH_IMPORT_CHUNK])
+                created += sum(1 for result in results if result['status'] == 201)
+                self.write(b''.join(dumps(result) + b'\n' for result in results))
+                yield self.flush()
+
+            Logger.getInstance().info('batch import of %s users, %s created', len(lines), created)
+            self.write(dumps({'summary': {'rows': len(lines), 'created': created, 'failed': len(lines) - created}}) + b'\n')
+
+        except tornado.iostream.StreamClosedError:
+            Logger.getInstance().info('batch import client went away')
+            return
+
+        except Exception as err:
+            Logger.getInstance().exception(err)
+            if not self._headers_written:
+                self.set_status(500)
+                self.write(str(err))
+            return
+
+    @tornado.gen.coroutine
+    def importChunk(self, dao, lines):
+        """ :return: result of every line, in order """
+        results = {}
+        users = []  # (line, first_name, last_name, username, password)
+        for line_no, line in lines:
+            try:
+                data = json.loads(line)
+            except ValueError:
+                data = None
+            if not isinstance(data, dict):
+                results[line_no] = {'line': line_no, 'status': 400, 'error': 'invalid json'}
+                continue
+
+            username = data.get('username', None)
+            password = data.get('password', None)
+            if not isinstance(username, str) or not isValidEmail(username):
+                results[line_no] = {'line': line_no, 'status': 400, 'error': 'invalid email address'}
+            elif not isinstance(password, str) or not password:
+                results[line_no] = {'line': line_no, 'status': 400, 'error': 'missing password'}
+            else:
+                users.append((line_no, data.get('first_name', None), data.get('last_name', None), username, password))
+
+        # duplicated in the chunk or taken already
+        existing = yield dao.existingUsernames(list(set(user[3] for user in users)))
+        unique = []
+        for user in users:
+            if user[3] in existing:
+                results[user[0]] = {'line': user[0], 'status': 400, 'error': 'duplicated username'}
+            else:
+                existing.add(user[3])
+                unique.append(user)
+
+        try:
+            hashed = yield encrypt_many_async([user[4] for user in unique])
+        except CryptBusyError as err:
+            Logger.getInstance().info('Crypt service is busy: {err}'.format(err=err))
+            for user in unique:
+                results[user[0]] = {'line': user[0], 'status': 503, 'error': 'crypt service is busy, retry'}
+            unique = []
+            hashed = []
+
+        inserted = yield dao.createUsers([(user[1], user[2], user[3], password) for user, password in zip(unique, hashed)])
+        messages = [verificationMessage(record.username) for is_success, record in inserted if is_success]
+        notified = SNS_OUTBOX.enqueueMany(messages)
+        for user, (is_success, record) in zip(unique, inserted):
+            if is_success:
+                results[user[0]] = {'line': user[0], 'status': 201, 'user': userFields(record), 'notified': notified > 0}
+                notified -= 1
+            else:
+                results[user[0]] = {'line': user[0], 'status': 500, 'error': 'cannot create user'}
+
+        return [results[line_no] for line_no, _ in lines]
+
+
+class ExportHandler(BaseHandler):
+    """
+    GET /v1/export/(user|image)?format=ndjson|csv&after=<id>, dump of a table for analytics,
+    authorized by "Bearer ADMIN_API_KEY". Rows are sorted by id and never include password hashes.
+    Rows are streamed from an unbuffered cursor and every EXPORT_CHUNK rows are flushed, the next chunk
+    is read only when the client took the previous one, so a slow client slows the export down instead
+    of filling the memory. An interrupted export is resumed with after=<last id received>.
+    An export that fails midway is cut off without the terminating chunk, never ends like a complete one.
+    """
+
+    @staticmethod
+    def csvValue(value):
+        if isinstance(value, datetime.datetime):
+            return formatDatetime(value)
+        if isinstance(value, datetime.date):
+            return formatDate(value)
+        return value
+
+    def formatRows(self, export_format, columns, rows):
+        if export_format == 'csv':
+            output = io.StringIO()
+            csv.writer(output).writerows([self.csvValue(value) for value in row] for row in rows)
+            return output.getvalue().encode()
+        return b''.join(dumps(dict(zip(columns, row))) + b'\n' for row in rows)
+
+    @tornado.gen.coroutine
+    def get(self, table):
+        rows = None
+        exported = 0
+        try:
+            if not self.adminAuthorized():
+                Logger.getInstance().info('export without a valid admin key')
+                self.set_status(403)
+                self.finish()
+                return
+
+            export_format = self.get_argument('format', 'ndjson')
+            if export_format not in ('ndjson', 'csv'):
+                self.set_status(400)
+                self.write('format must be ndjson or csv')
+                return
+
+            columns = EXPORT_COLUMNS[table]
+            if export_format == 'csv':
+                self.set_header("Content-Type", "text/csv; charset=utf-8")
+                self.write(','.join(columns) + '\r\n')
+            else:
+                self.set_header("Content-Type", "application/x-ndjson; charset=utf-8")
+            self.set_header("Content-Disposition", 'attachment; filename="{}.{}"'.format(table, export_format))
+
+            dao = ExportDAO(connect_pool=MYSQL_CONN_POOL.getPool())
+            rows = dao.streamTable(table, after=self.get_argument('after', ''), page_size=EXPORT_PAGE_SIZE,
+                                   chunk_size=EXPORT_CHUNK)
+            while True:
+                try:
+                    chunk = yield rows.__anext__()
+                except StopAsyncIteration:
+                    break
+                self.write(self.formatRows(export_format, columns, chunk))
+                exported += len(chunk)
+                yield self.flush()  # resolves once the chunk is written to the socket
+
+            Logger.getInstance().info('export of %s: %s rows', table, exported)
+
+        except tornado.iostream.StreamClosedError:
+            Logger.getInstance().info('export of %s: client went away after %s rows', table, exported)
+
+        except Exception as err:
+            Logger.getInstance().exception(err)
+            if not self._headers_written:
+                self.set_status(500)
+                self.write(str(err))
+            else:
+                Logger.getInstance().info('export of %s failed after %s rows, closing the connection', table, exported)
+                self.request.connection.stream.close()
+
+        finally:
+            if rows is not None:
+                yield rows.aclose()
+
+
 class UserVerifyHandler(BaseHandler):
     @tornado.gen.coroutine
     def get(self):
-        service_start_time = time.time()
         try:
-            STATSD_CONN.incr('[GET] /v1/verifyUserEmail')
-
             self.set_header("Content-Type", "application/json; charset=utf-8")  # set response header
 
             username = self.get_argument('email', default=None)
@@ -210,7 +536,6 @@ class UserVerifyHandler(BaseHandler):
                 if token is None:
                     Logger.getInstance().info("can't get token from GET request API /v1/verifyUserEmail")
 
-                STATSD_CONN.timing('timing [GET] /v1/verifyUserEmail', (time.time() - service_start_time) * 1000)
                 self.set_status(400)
                 self.finish()
                 return
@@ -218,19 +543,12 @@ class UserVerifyHandler(BaseHandler):
             Logger.getInstance().info("get email & token from GET request API /v1/verifyUserEmail, email is {email}, token is {token}".format(email=username, token=token))
 
             # 根据 ttl 查 DynamoDB, 查看 record 有没有过期
-            db_resource = boto3.resource('dynamodb', region_name='us-east-1')
-            table = db_resource.Table('verification')
-            search_response = table.get_item(
-                Key={
-                    "email": username
-                }
-            )
-            if 'Item' in search_response:
+            record = yield VERIFICATION_STORE.getRecord(username)
+            if record is not None:
                 Logger.getInstance().info('find record in dynamodb with email {}'.format(username))
             else:
                 Logger.getInstance().info('Cannot find record in dynamodb with email {}, probably record is expired'.format(username))
                 self.set_status(400)
-                STATSD_CONN.timing('timing [GET] /v1/verifyUserEmail', (time.time() - service_start_time) * 1000)
                 self.finish()
                 return
 
@@ -240,7 +558,6 @@ class UserVerifyHandler(BaseHandler):
             if not token_good:
                 Logger.getInstance().info('Token error, probably it has been expired, token info[{}]'.format(token))
                 self.set_status(400)
-                STATSD_CONN.timing('timing [GET] /v1/verifyUserEmail', (time.time() - service_start_time) * 1000)
                 self.finish()
                 return
             else:
@@ -250,43 +567,45 @@ class UserVerifyHandler(BaseHandler):
                     if token_username is None or token_username != username:
                         Logger.getInstance().info("Token error, token doesn't has username or unmatched username, token info[{}]".format(token))
                         self.set_status(400)
-                        STATSD_CONN.timing('timing [GET] /v1/verifyUserEmail', (time.time() - service_start_time) * 1000)
                         self.finish()
                         return
                 else:
                     Logger.getInstance().info("Token error, fail to get data field within token, token info[{}]".format(token))
                     self.set_status(400)
-                    STATSD_CONN.timing('timing [GET] /v1/verifyUserEmail', (time.time() - service_start_time) * 1000)
                     self.finish()
                     return
 
-            if token in TOKEN_SET:
+            # remember the token until its own exp (DEFAULT_TOKEN_TTL at most), a second use is a replay
+            token_exp = data.get("exp", time.time() + DEFAULT_TOKEN_TTL)
+            if not TOKEN_REPLAY_STORE.markUsed(token, token_exp):
                 Logger.getInstance().info('One-time token was used, token info[{}]'.format(token))
                 self.set_status(400)
-                STATSD_CONN.timing('timing [GET] /v1/verifyUserEmail', (time.time() - service_start_time) * 1000)
                 self.finish()
                 return
-            else:
-                TOKEN_SET.add(token)
 
-            dao = UserDAO(connect_pool=MYSQL_CONN_POOL.getPool())
+            dao = UserDAO(connect_pool=MYSQL_CONN_POOL.getPool(), profile_cache=PROFILE_CACHE)
             is_success = yield dao.updateVerifiedByUsername(username)
             if is_success:
+                CREDENTIAL_CACHE.invalidate(username)
                 Logger.getInstance().info('update user verification successfully, username[%s]' % username)
+                self.stickToPrimary()
                 self.set_status(200)
-                STATSD_CONN.timing('timing [GET] /v1/verifyUserEmail', (time.time() - service_start_time) * 1000)
                 self.finish()
             else:
                 Logger.getInstance().info('Failed to update user verification, username[%s]' % username)
                 self.set_status(400)
-                STATSD_CONN.timing('timing [GET] /v1/verifyUserEmail', (time.time() - service_start_time) * 1000)
                 self.finish()
                 return
 
+        except ReplayStoreFullError as err:
+            Logger.getInstance().info('Cannot remember the one-time token: {err}'.format(err=err))
+            self.set_status(503)
+            self.finish()
+            return
+
         except Exception as e:
             self.set_status(500)
             Logger.getInstance().exception(e)
-            STATSD_CONN.timing('timing [GET] /v1/verifyUserEmail', (time.time() - service_start_time) * 1000)
             self.write(str(e))
             return
 
@@ -294,44 +613,37 @@ class UserVerifyHandler(BaseHandler):
 class UserInfoHandler(TokenHandler):
     @tornado.gen.coroutine
     def get(self):
-        service_start_time = time.time()
         try:
-            STATSD_CONN.incr('[GET] /v1/user/self')
-
             self.set_header("Content-Type", "application/json; charset=utf-8")  # set response header
 
             if not self.token_passed:
                 Logger.getInstance().info('token auth fail')
                 self.set_status(400)
-                STATSD_CONN.timing('timing [GET] /v1/user/self ', (time.time() - service_start_time) * 1000)
                 self.finish()
                 return
 
-            username = self.token_msg['username']
-            dao = UserDAO(connect_pool=MYSQL_CONN_POOL.getPool())
-            respBodyDict = yield dao.getUserInfoByUsername(username)
-            respBodyDict.pop("password")
+            # user row was just read by TokenHandler.prepare, the body and its ETag are cached while the row is unchanged
+            if self.notModified(PROFILE_CACHE.etag(self.current_user), userLastModified(self.current_user)):
+                self.set_status(304)
+                self.finish()
+                return
             self.set_status(200)
-            STATSD_CONN.timing('timing [GET] /v1/user/self ', (time.time() - service_start_time) * 1000)
-            self.write(respBodyDict)
+            self.write(PROFILE_CACHE.body(self.current_user))
 
         except Exception as e:
             Logger.getInstance().exception(e)
-            STATSD_CONN.timing('timing [GET] /v1/user/self ', (time.time() - service_start_time) * 1000)
+            self.set_status(500)
+            self.write(str(e))
             return
 
     @tornado.gen.coroutine
     def put(self):
-        service_start_time = time.time()
         try:
-            STATSD_CONN.incr('[PUT] /v1/user/self')
-
             self.set_header("Content-Type", "application/json; charset=utf-8")  # set response header
 
             if not self.token_passed:
                 Logger.getInstance().info('token auth fail')
                 self.set_status(400)
-                STATSD_CONN.timing('timing [PUT] /v1/user/self ', (time.time() - service_start_time) * 1000)
                 self.finish()
                 return
 
@@ -351,48 +663,51 @@ class UserInfoHandler(TokenHandler):
                 if key not in allowFields:
                     Logger.getInstance().info('Only allow modify first_name, last_name, and password')
                     self.set_status(400)
-                    STATSD_CONN.timing('timing [PUT] /v1/user/self ', (time.time() - service_start_time) * 1000)
                     self.finish()
                     return
 
-            # Validate username exist
-            dao = UserDAO(connect_pool=MYSQL_CONN_POOL.getPool())
-            userInfo = yield dao.getUserInfoByUsername(username)
-            if userInfo is None:
+            # Only the authenticated user can be changed
+            userInfo = self.current_user
+            if username != userInfo.username:
                 Logger.getInstance().info('username[{username}] is not allowed to change'.format(username=username))
                 self.set_status(400)
-                STATSD_CONN.timing('timing [PUT] /v1/user/self ', (time.time() - service_start_time) * 1000)
                 self.finish()
                 return
 
             # update user
             # 由于 update sql 只有固定一条, 所以这四个字段都不能为空
             if first_name is None:
-                first_name = userInfo['first_name']
+                first_name = userInfo.first_name
 
             if last_name is None:
-                last_name = userInfo['last_name']
+                last_name = userInfo.last_name
 
             if password is None:
-                password = userInfo['password']
+                password = userInfo.password
             else:
-                password = encrypt(password)  # encrypt password
+                password = yield encrypt_async(password)  # encrypt password in crypt service
 
+            dao = UserDAO(connect_pool=MYSQL_CONN_POOL.getPool(), profile_cache=PROFILE_CACHE)
             isSuccess = yield dao.updateUser(first_name, last_name, username, password)
             if isSuccess:
+                CREDENTIAL_CACHE.invalidate(username)
                 Logger.getInstance().info('update user successfully, username[%s]' % username)
+                self.stickToPrimary()
                 self.set_status(204)
-                STATSD_CONN.timing('timing [PUT] /v1/user/self ', (time.time() - service_start_time) * 1000)
                 self.finish()
             else:
                 self.set_status(500)
-                STATSD_CONN.timing('timing [PUT] /v1/user/self ', (time.time() - service_start_time) * 1000)
                 self.finish()
 
+        except CryptBusyError as err:
+            Logger.getInstance().info('Crypt service is busy: {err}'.format(err=err))
+            self.set_status(503)
+            self.finish()
+            return
+
         except Exception as err:
             self.set_status(500)
             Logger.getInstance().exception(err)
-            STATSD_CONN.timing('timing [PUT] /v1/user/self ', (time.time() - service_start_time) * 1000)
             self.write(str(err))
             return
 
@@ -406,204 +721,634 @@ class PictureHandler(TokenHandler):
 
     @tornado.gen.coroutine
     def post(self):
-        service_start_time = time.time()
         try:
-            STATSD_CONN.incr('[POST] /v1/user/self/pic')
-
             self.set_header("Content-Type", "application/json; charset=utf-8")  # set response header
 
             if not self.token_passed:
                 Logger.getInstance().info('token auth fail')
                 self.set_status(400)
-                STATSD_CONN.timing('timing [POST] /v1/user/self/pic ', (time.time() - service_start_time) * 1000)
                 self.finish()
                 return
 
-            # Grab uploaded file data
-            files = self.request.files["profilePic"]
-            if len(files) == 0:
-                Logger.getInstance().info('Cannot receive any picture file')
-                self.set_status(400)
-                STATSD_CONN.timing('timing [POST] /v1/user/self/pic ', (time.time() - service_start_time) * 1000)
-                self.finish()
-
-            file = files[0]
-            file_name = file.get('filename', None)
-            if file_name is None:
-                Logger.getInstance().info('Cannot get picture file name')
-                self.set_status(400)
-                STATSD_CONN.timing('timing [POST] /v1/user/self/pic ', (time.time() - service_start_time) * 1000)
-                self.finish()
-
-            file_data = file.get('body', None)
-            if file_data is None:
-                Logger.getInstance().info('Cannot get picture file data')
-                self.set_status(400)
-                STATSD_CONN.timing('timing [POST] /v1/user/self/pic ', (time.time() - service_start_time) * 1000)
-                self.finish()
-
-            file_type = file.get('content_type', None)
-            if file_type is None:
-                Logger.getInstance().info('Cannot get picture file type')
-                self.set_status(400)
-                STATSD_CONN.timing('timing [POST] /v1/user/self/pic ', (time.time() - service_start_time) * 1000)
+            # Grab uploaded file data and put it into object store
+            error_status, file_name, url = yield self.storePicture()
+            if error_status is not None:
+                self.set_status(error_status)
                 self.finish()
+                return
 
             # Get user info
-            user_dao = UserDAO(connect_pool=MYSQL_CONN_POOL.getPool())
-            sql_status, user_id = yield user_dao.getUserIdByUserName(username=self.token_msg['username'])
+            user_id = self.current_user.id
 
-            # Add or update image info
-            img_dao = ImageDAO(connect_pool=MYSQL_CONN_POOL.getPool())
-            img_exist = yield img_dao.userImageExist(user_id)
-
-            s3resource = boto3.resource('s3')
-            s3bucket_name = Config.getInstance()['S3BUCKETNAME']
+            # Add or update image info, returns url of the replaced image and the new row
+            img_dao = ImageDAO(connect_pool=MYSQL_CONN_POOL.getPool(), image_cache=IMAGE_CACHE)
+            is_success, previous_url, image = yield img_dao.upsertUserImage(file_name=file_name, url=url, user_id=user_id)
+            invalidatePictureContent(url, previous_url)
+            if not is_success:
+                self.set_status(500)
+                self.finish()
+                return
 
-            if img_exist:
-                image_record = yield img_dao.getUserImage(user_id)
-                url = image_record['url']
+            if previous_url is not None and previous_url != url:
                 """ S3 删除旧图片 """
-                s3resource.Object(s3bucket_name, url).delete()
-
-                """ S3 上传新图片 """
-                url = s3bucket_name + "/" + user_id + "/" + file_name
-                s3resource.Object(s3bucket_name, url).put(Body=BytesIO(file_data))
-
-                yield img_dao.updateUserImage(file_name=file_name, url=url, user_id=user_id)
-            else:
-                """ S3 图片需要上传 """
-                url = s3bucket_name + "/" + user_id + "/" + file_name
-                s3resource.Object(s3bucket_name, url).put(Body=BytesIO(file_data))
-
-                yield img_dao.createUserImage(file_name=file_name, url=url, user_id=user_id)
-
-            # Make response
-            resp_body = yield img_dao.getUserImage(user_id)
+                yield OBJECT_STORE.delete(previous_url)
 
+            self.stickToPrimary()
             self.set_status(201)
-            STATSD_CONN.timing('timing [POST] /v1/user/self/pic ', (time.time() - service_start_time) * 1000)
-            self.write(resp_body)
+            self.write(encodeImage(image))
 
         except Exception as err:
             Logger.getInstance().exception(err)
             self.set_status(500)
-            STATSD_CONN.timing('timing [POST] /v1/user/self/pic ', (time.time() - service_start_time) * 1000)
             self.write(str(err))
             return
 
+    def pictureUrl(self, file_name):
+        return OBJECT_STORE.bucket + "/" + self.current_user.id + "/" + file_name
+
+    @tornado.gen.coroutine
+    def storePicture(self):
+        """
+        Validate the buffered picture file and put it into the object store
+        :return: (error status or None, file name, object url)
+        """
+        files = self.request.files.get("profilePic", [])
+        if len(files) == 0:
+            Logger.getInstance().info('Cannot receive any picture file')
+            return 400, None, None
+
+        file = files[0]
+        file_name = file.get('filename', None)
+        if not file_name:
+            Logger.getInstance().info('Cannot get picture file name')
+            return 400, None, None
+
+        file_data = file.get('body', None)
+        if file_data is None:
+            Logger.getInstance().info('Cannot get picture file data')
+            return 400, None, None
+
+        if len(file_data) > PICTURE_MAX_SIZE:
+            Logger.getInstance().info('Picture file is too large, size[{}]'.format(len(file_data)))
+            return 413, None, None
+
+        file_type = file.get('content_type', None)
+        if file_type is None:
+            Logger.getInstance().info('Cannot get picture file type')
+            return 400, None, None
+
+        """ S3 上传新图片 """
+        url = self.pictureUrl(file_name)
+        yield OBJECT_STORE.put(url, file_data, content_type=file_type)
+        return None, file_name, url
+
     @tornado.gen.coroutine
     def get(self):
-        service_start_time = time.time()
         try:
-            STATSD_CONN.incr('[GET] /v1/user/self/pic')
-
             self.set_header("Content-Type", "application/json; charset=utf-8")  # set response header
 
             if not self.token_passed:
                 Logger.getInstance().info('token auth fail')
                 self.set_status(400)
-                STATSD_CONN.timing('timing [GET] /v1/user/self/pic ', (time.time() - service_start_time) * 1000)
                 self.finish()
                 return
 
-            user_dao = UserDAO(connect_pool=MYSQL_CONN_POOL.getPool())
-            sql_status, user_id = yield user_dao.getUserIdByUserName(username=self.token_msg['username'])
-            img_dao = ImageDAO(connect_pool=MYSQL_CONN_POOL.getPool())
-
-            img_exist = yield img_dao.userImageExist(user_id)
-            if img_exist:
-                resp_body = yield img_dao.getUserImage(user_id)
+            user_id = self.current_user.id
+            img_dao = ImageDAO(connect_pool=MYSQL_CONN_POOL.getPool(), image_cache=IMAGE_CACHE)
 
+            image = yield img_dao.getUserImage(user_id)
+            if image is not None:
+                # the body and its ETag are reused while the row is unchanged
+                if self.notModified(IMAGE_CACHE.etag(image), imageLastModified(image)):
+                    self.set_status(304)
+                    self.finish()
+                    return
                 self.set_status(200)
-                STATSD_CONN.timing('timing [GET] /v1/user/self/pic ', (time.time() - service_start_time) * 1000)
-                self.write(resp_body)
+                self.write(IMAGE_CACHE.body(image))
             else:
                 self.set_status(404)
-                STATSD_CONN.timing('timing [GET] /v1/user/self/pic ', (time.time() - service_start_time) * 1000)
                 self.finish()
 
         except Exception as err:
             Logger.getInstance().exception(err)
             self.set_status(500)
-            STATSD_CONN.timing('timing [GET] /v1/user/self/pic ', (time.time() - service_start_time) * 1000)
             self.write(str(err))
             return
 
     @tornado.gen.coroutine
     def delete(self):
-        service_start_time = time.time()
         try:
-            STATSD_CONN.incr('[DELETE] /v1/user/self/pic')
-
             self.set_header("Content-Type", "application/json; charset=utf-8")  # set response header
 
             if not self.token_passed:
                 Logger.getInstance().info('token auth fail')
                 self.set_status(400)
-                STATSD_CONN.timing('timing [DELETE] /v1/user/self/pic ', (time.time() - service_start_time) * 1000)
                 self.finish()
                 return
 
-            user_dao = UserDAO(connect_pool=MYSQL_CONN_POOL.getPool())
-            sql_status, user_id = yield user_dao.getUserIdByUserName(username=self.token_msg['username'])
-            img_dao = ImageDAO(connect_pool=MYSQL_CONN_POOL.getPool())
+            user_id = self.current_user.id
+            img_dao = ImageDAO(connect_pool=MYSQL_CONN_POOL.getPool(), image_cache=IMAGE_CACHE)
 
-            img_exist = yield img_dao.userImageExist(user_id)
-            if img_exist:
+            # 删除 DB metadata, returns the deleted row
+            image_record = yield img_dao.fetchAndDeleteUserImage(user_id)
+            if image_record is not None:
+                invalidatePictureContent(image_record.url)
                 """ S3 操作 删除图片 """
-                s3resource = boto3.resource('s3')
-                s3bucket_name = Config.getInstance()['S3BUCKETNAME']
-                image_record = yield img_dao.getUserImage(user_id)
-                url = image_record['url']
-                s3resource.Object(s3bucket_name, url).delete()
-
-                # 删除 DB metadata
-                yield img_dao.deleteUserImage(user_id)
+                yield OBJECT_STORE.delete(image_record.url)
 
+                self.stickToPrimary()
                 self.set_status(204)
-                STATSD_CONN.timing('timing [DELETE] /v1/user/self/pic ', (time.time() - service_start_time) * 1000)
                 self.finish()
             else:
                 self.set_status(404)
-                STATSD_CONN.timing('timing [DELETE] /v1/user/self/pic ', (time.time() - service_start_time) * 1000)
                 self.finish()
 
         except Exception as err:
             self.set_status(500)
             Logger.getInstance().exception(err)
-            STATSD_CONN.timing('timing [DELETE] /v1/user/self/pic ', (time.time() - service_start_time) * 1000)
             self.write(str(err))
             return
 
 
+@tornado.web.stream_request_body
+class PictureStreamHandler(PictureHandler):
+    """
+    /v1/user/self/pic with streaming uploads, enabled by PICTURE_UPLOAD_STREAMING.
+    The multipart body is parsed as it arrives and the picture part is piped into an object store upload,
+    so memory per upload is bounded by the chunk (or S3 part) size instead of the file size.
+    """
+
+    @tornado.gen.coroutine
+    def prepare(self):
+        self.upload_parser = None
+        self.upload = None
+        self.upload_file_name = None
+        self.upload_in_picture = False
+        self.upload_error = None
+
+        yield super().prepare()
+        if self._finished or self.request.method != 'POST' or not self.token_passed:
+            return
+
+        content_length = int(self.request.headers.get('Content-Length', 0) or 0)
+        if content_length > PICTURE_MAX_SIZE + MULTIPART_OVERHEAD_SIZE:
+            Logger.getInstance().info('Picture upload is too large, Content-Length[{}]'.format(content_length))
+            self.set_status(413)
+            self.finish()
+            return
+        self.request.connection.set_max_body_size(PICTURE_MAX_SIZE + MULTIPART_OVERHEAD_SIZE)
+
+        boundary = parseBoundary(self.request.headers.get('Content-Type', ''))
+        if boundary is None:
+            self.upload_error = 400
+            Logger.getInstance().info('Picture upload is not multipart/form-data')
+            return
+        self.upload_parser = MultipartParser(boundary)
+
+    @tornado.gen.coroutine
+    def data_received(self, chunk):
+        if self.upload_parser is None or self.upload_error is not None:
+            return
+
+        try:
+            for event, value in self.upload_parser.feed(chunk):
+                if event == 'part':
+                    # only the first profilePic part is kept, other form fields are skipped
+                    self.upload_in_picture = (value['name'] == 'profilePic' and self.upload is None)
+                    if self.upload_in_picture:
+                        if not value['filename'] or value['content_type'] is None:
+                            Logger.getInstance().info('Cannot get picture file name or type')
+                            self.upload_error = 400
+                            return
+                        self.upload_file_name = value['filename']
+                        self.upload = OBJECT_STORE.openUpload(self.pictureUrl(value['filename']),
+                                                              content_type=value['content_type'])
+                elif event == 'data' and self.upload_in_picture:
+                    if self.upload.size + len(value) > PICTURE_MAX_SIZE:
+                        Logger.getInstance().info('Picture file is too large, size over[{}]'.format(PICTURE_MAX_SIZE))
+                        self.upload_error = 413
+                        yield self.upload.abort()
+                        return
+                    yield self.upload.write(value)
+                elif event == 'end':
+                    self.upload_in_picture = False
+        except MultipartError as err:
+            Logger.getInstance().info('Malformed picture upload: {err}'.format(err=err))
+            self.upload_error = 400
+            if self.upload is not None:
+                yield self.upload.abort()
+
+    def on_connection_close(self):
+        super().on_connection_close()
+        if self.upload is not None:
+            tornado.ioloop.IOLoop.current().add_callback(self.upload.abort)
+
+    @tornado.gen.coroutine
+    def storePicture(self):
+        """
+        Finish the streamed upload
+        :return: (error status or None, file name, object url)
+        """
+        if self.upload_error is None and (self.upload_parser is None or not self.upload_parser.finished):
+            Logger.getInstance().info('Picture upload body is incomplete')
+            self.upload_error = 400
+        if self.upload_error is None and self.upload is None:
+            Logger.getInstance().info('Cannot receive any picture file')
+            self.upload_error = 400
+
+        if self.upload_error is not None:
+            if self.upload is not None:
+                yield self.upload.abort()
+            return self.upload_error, None, None
+
+        upload, self.upload = self.upload, None
+        yield upload.complete()
+        return None, self.upload_file_name, upload.key
+
+
+class PictureDirectHandler(TokenHandler):
+    """
+    Profile pictures transferred directly between clients and the object store, the service handles metadata only:
+
+    - POST /v1/user/self/pic:presign {"file_name", "content_type", "size"} returns a presigned PUT url, valid for
+      PICTURE_PRESIGN_EXPIRES seconds and only for exactly size bytes of content_type
+    - the client PUTs the picture to the url, then POST /v1/user/self/pic:commit {"key"} makes it the user's
+      picture, the previous one is deleted
+    - GET /v1/user/self/pic:download redirects to a presigned GET url of the picture
+
+    Every presign gets a new key, an upload never overwrites the current picture before it is committed.
+    Uploads that were never committed are deleted by the next commit once their url has expired.
+    """
+
+    def set_default_headers(self):
+        self.set_header("Access-Control-Allow-Origin", "*")
+        self.set_header("Access-Control-Allow-Headers", "x-requested-with")
+        self.set_header('Access-Control-Allow-Methods', 'POST, GET')
+
+    def keyPrefix(self):
+        return OBJECT_STORE.bucket + "/" + self.current_user.id + "/"
+
+    def directTransferSupported(self):
+        """ False and a 501 is sent if OBJECT_STORE has no presigned URLs, e.g. OBJECT_STORE is 'local' """
+        if OBJECT_STORE.supports_presign:
+            return True
+        Logger.getInstance().info('Direct picture transfers are not supported by {store}'.format(
+            store=OBJECT_STORE.__class__.__name__))
+        self.set_status(501)
+        self.finish()
+        return False
+
+    @tornado.gen.coroutine
+    def post(self, action):
+        try:
+            self.set_header("Content-Type", "application/json; charset=utf-8")  # set response header
+
+            if not self.token_passed:
+                Logger.getInstance().info('token auth fail')
+                self.set_status(400)
+                self.finish()
+                return
+
+            try:
+                data = json.loads(self.request.body)
+            except ValueError:
+                data = None
+            if not isinstance(data, dict) or action not in ('presign', 'commit'):
+                self.set_status(400)
+                self.finish()
+                return
+            if not self.directTransferSupported():
+                return
+
+            if action == 'presign':
+                yield self.presign(data)
+            else:
+                yield self.commit(data)
+
+        except Exception as err:
+            Logger.getInstance().exception(err)
+            self.set_status(500)
+            self.write(str(err))
+            return
+
+    @tornado.gen.coroutine
+    def presign(self, data):
+        file_name = data.get('file_name', None)
+        content_type = data.get('content_type', None)
+        size = data.get('size', None)
+        if not isinstance(file_name, str) or not file_name or '/' in file_name or file_name in ('.', '..'):
+            Logger.getInstance().info('Invalid picture file name[{}]'.format(file_name))
+            self.set_status(400)
+            self.finish()
+            return
+        if not isinstance(content_type, str) or not content_type or not isinstance(size, int) or size <= 0:
+            Logger.getInstance().info('Cannot get picture file type or size')
+            self.set_status(400)
+            self.finish()
+            return
+        if size > PICTURE_MAX_SIZE:
+            Logger.getInstance().info('Picture file is too large, size[{}]'.format(size))
+            self.set_status(413)
+            self.finish()
+            return
+
+        key = self.keyPrefix() + uuid.uuid4().hex + "/" + file_name
+        upload = yield OBJECT_STORE.presign_put(key, content_type, size, expires=PICTURE_PRESIGN_EXPIRES)
+        self.set_status(200)
+        self.write(dumps(dict(upload, key=key, expires_in=PICTURE_PRESIGN_EXPIRES)))
+
+    @tornado.gen.coroutine
+    def commit(self, data):
+        key = data.get('key', None)
+        if not isinstance(key, str) or not key.startswith(self.keyPrefix()) or '/../' in key:
+            Logger.getInstance().info('Picture key[{}] is not an upload of this user'.format(key))
+            self.set_status(400)
+            self.finish()
+            return
+
+        head = yield OBJECT_STORE.head(key)
+        if head is None:
+            Logger.getInstance().info('Picture[{}] was not uploaded'.format(key))
+            self.set_status(400)
+            self.finish()
+            return
+        if head['size'] > PICTURE_MAX_SIZE:
+            Logger.getInstance().info('Picture file is too large, size[{}]'.format(head['size']))
+            yield OBJECT_STORE.delete(key)
+            self.set_status(413)
+            self.finish()
+            return
+
+        img_dao = ImageDAO(connect_pool=MYSQL_CONN_POOL.getPool(), image_cache=IMAGE_CACHE)
+        is_success, previous_url, image = yield img_dao.upsertUserImage(file_name=key.rsplit("/", 1)[1], url=key,
+                                                                        user_id=self.current_user.id)
+        invalidatePictureContent(key, previous_url)
+        if not is_success:
+            self.set_status(500)
+            self.finish()
+            return
+
+        if previous_url is not None and previous_url != key:
+            yield OBJECT_STORE.delete(previous_url)
+        yield self.deleteStaleUploads(key)
+
+        self.stickToPrimary()
+        self.set_status(201)
+        self.write(encodeImage(image))
+
+    @tornado.gen.coroutine
+    def deleteStaleUploads(self, committed_key):
+        """ Objects of the user other than committed_key whose presigned url has expired, the bucket keeps them otherwise """
+        try:
+            expired = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=PICTURE_PRESIGN_EXPIRES)
+            objects = yield OBJECT_STORE.list_objects(self.keyPrefix())
+            stale = [item['key'] for item in objects if item['key'] != committed_key and item['last_modified'] < expired]
+            if stale:
+                Logger.getInstance().info('Delete {} stale picture uploads of user[{}]'.format(len(stale), self.current_user.id))
+                yield OBJECT_STORE.delete_many(stale)
+        except Exception as e:
+            # the picture is committed, the next commit tries again
+            Logger.getInstance().info('Failed to delete stale picture uploads: {}'.format(e))
+
+    @tornado.gen.coroutine
+    def get(self, action):
+        try:
+            if not self.token_passed:
+                Logger.getInstance().info('token auth fail')
+                self.set_status(400)
+                self.finish()
+                return
+
+            if action != 'download':
+                self.set_status(405)
+                self.finish()
+                return
+            if not self.directTransferSupported():
+                return
+
+            img_dao = ImageDAO(connect_pool=MYSQL_CONN_POOL.getPool(), image_cache=IMAGE_CACHE)
+            image = yield img_dao.getUserImage(self.current_user.id)
+            if image is None:
+                self.set_status(404)
+                self.finish()
+                return
+
+            url = yield OBJECT_STORE.presign_get(image.url, expires=PICTURE_PRESIGN_EXPIRES)
+            # the url expires, clients must not keep the redirect longer than that
+            self.set_header("Cache-Control", "private, max-age={}".format(PICTURE_PRESIGN_EXPIRES // 2))
+            self.redirect(url, status=302)
+
+        except Exception as err:
+            Logger.getInstance().exception(err)
+            self.set_status(500)
+            self.write(str(err))
+            return
+
+
+class PictureContentHandler(TokenHandler):
+    """
+    GET /v1/user/self/pic/content, the bytes of the profile picture.
+    Objects are served from PICTURE_CACHE, a bounded LRU of files on local disk in front of the object store,
+    in reads of PICTURE_CONTENT_CHUNK bytes, each one flushed before the next is read.
+    Answers If-None-Match with 304 and a single Range (honouring If-Range) with 206.
+    """
+
+    @tornado.gen.coroutine
+    def get(self):
+        cached = None
+        try:
+            if not self.token_passed:
+                Logger.getInstance().info('token auth fail')
+                self.set_status(400)
+                self.finish()
+                return
+
+            img_dao = ImageDAO(connect_pool=MYSQL_CONN_POOL.getPool(), image_cache=IMAGE_CACHE)
+            image = yield img_dao.getUserImage(self.current_user.id)
+            if image is not None:
+                cached = yield PICTURE_CACHE.open(image.url, OBJECT_STORE.get)
+            if cached is None:
+                if image is not None:
+                    Logger.getInstance().info('Picture object[{}] is missing'.format(image.url))
+                self.set_status(404)
+                self.finish()
+                return
+
+            self.set_header("Content-Type", mimetypes.guess_type(image.file_name)[0] or "application/octet-stream")
+            self.set_header("Accept-Ranges", "bytes")
+            self.set_header("Etag", cached.etag)
+            if self.check_etag_header():
+                self.set_status(304)
+                self.finish()
+                return
+
+            start, end = 0, cached.size
+            if self.request.headers.get("If-Range", cached.etag) == cached.etag:
+                try:
+                    requested = parseRange(self.request.headers.get("Range", ""), cached.size)
+                except ValueError as err:
+                    Logger.getInstance().info('Unsatisfiable picture range: {err}'.format(err=err))
+                    self.set_status(416)
+                    self.set_header("Content-Range", "bytes */{}".format(cached.size))
+                    self.finish()
+                    return
+                if requested is not None:
+                    start, end = requested
+                    self.set_status(206)
+                    self.set_header("Content-Range", "bytes {}-{}/{}".format(start, end - 1, cached.size))
+
+            self.set_header("Content-Length", end - start)
+            offset = start
+            while offset < end:
+                chunk = os.pread(cached.fd, min(PICTURE_CONTENT_CHUNK, end - offset), offset)
+                offset += len(chunk)
+                self.write(chunk)
+                yield self.flush()  # resolves once the chunk is written to the socket
+
+        except tornado.iostream.StreamClosedError:
+            Logger.getInstance().info('picture content client went away')
+
+        except Exception as err:
+            Logger.getInstance().exception(err)
+            if not self._headers_written:
+                self.clear_header("Content-Length")
+                self.set_status(500)
+                self.write(str(err))
+            else:
+                self.request.connection.stream.close()
+
+        finally:
+            if cached is not None:
+                os.close(cached.fd)
+
+
 def make_app():
     return tornado.web.Application([
         (r"/healthz", HealthzHandler),
+        (r"/metrics", MetricsHandler),
         # (r"/health", HealthHandler),
         (r"/v1/user", UserCreateHandler),
+        (r"/v1/users:batch", UserBatchHandler),
+        (r"/v1/export/(user|image)", ExportHandler),
         (r"/v1/verifyUserEmail", UserVerifyHandler),
         (r"/v1/user/self", UserInfoHandler),
-        (r"/v1/user/self/pic", PictureHandler),
+        (r"/v1/user/self/pic", PictureStreamHandler if PICTURE_UPLOAD_STREAMING else PictureHandler),
+        (r"/v1/user/self/pic:(presign|commit|download)", PictureDirectHandler),
+        (r"/v1/user/self/pic/content", PictureContentHandler),
     ])
 
 
-if __name__ == "__main__":
-    MYSQL_CONN_POOL = MysqlConnectPool(loop=asyncio.get_event_loop(), maxsize=10)
-    STATSD_CONN = statsd.StatsClient('localhost', 8125)  # statsd
-    TOKEN_SET = set()
+def initWorker(worker_id: int = 0, num_workers: int = 1):
+    """ Create the per-process globals, called in every worker after the fork """
+    global MYSQL_CONN_POOL, STATSD_CONN, ROUTE_METRICS, CREDENTIAL_CACHE, TOKEN_CACHE, PROFILE_CACHE, IMAGE_CACHE, PICTURE_CACHE, OBJECT_STORE, SNS_OUTBOX, VERIFICATION_STORE, TOKEN_REPLAY_STORE
+    config = Config.getInstance()
+    # never share the parent's event loop, sockets or clients with a forked worker
+    asyncio.set_event_loop(asyncio.new_event_loop())
+
+    STATSD_CONN = StatsdPipeline(statsd.StatsClient('localhost', 8125), max_size=config.get('STATSD_BATCH_SIZE', 50))  # statsd
+    tornado.ioloop.PeriodicCallback(STATSD_CONN.flush, config.get('STATSD_FLUSH_INTERVAL', 1) * 1000).start()
+    MYSQL_CONN_POOL = createMysqlPool(loop=asyncio.get_event_loop(), statsd_conn=STATSD_CONN)
+    tornado.ioloop.PeriodicCallback(MYSQL_CONN_POOL.getPool().tick, config.get('MYSQL_POOL_TUNE_INTERVAL', 5) * 1000).start()
+    ROUTE_METRICS = RouteMetrics(statsd_conn=STATSD_CONN)
+    CREDENTIAL_CACHE = CredentialCache(maxsize=config.get('CREDENTIAL_CACHE_SIZE', 10000),
+                                       ttl=config.get('CREDENTIAL_CACHE_TTL', 300),
+                                       statsd_conn=STATSD_CONN)
+    TOKEN_CACHE = VerifiedTokenCache(maxsize=config.get('TOKEN_CACHE_SIZE', 10000),
+                                     max_ttl=config.get('TOKEN_CACHE_MAX_TTL', 300),
+                                     statsd_conn=STATSD_CONN)
+    PROFILE_CACHE = ProfileCache(maxsize=config.get('PROFILE_CACHE_SIZE', 10000),
+                                 ttl=config.get('PROFILE_CACHE_TTL', 30),
+                                 statsd_conn=STATSD_CONN)
+    IMAGE_CACHE = ImageCache(maxsize=config.get('IMAGE_CACHE_SIZE', 10000),
+                             ttl=config.get('IMAGE_CACHE_TTL', 30),
+                             statsd_conn=STATSD_CONN)
+    # every worker has its own directory, invalidations don't reach other workers
+    PICTURE_CACHE = DiskCache(root_dir=os.path.join(config.get('PICTURE_CACHE_DIR', './picture_cache'),
+                                                    'worker-{}'.format(worker_id)),
+                              max_bytes=config.get('PICTURE_CACHE_MAX_BYTES', 256 * 1024 * 1024),
+                              ttl=config.get('PICTURE_CACHE_TTL', 300),
+                              name='picture_cache', statsd_conn=STATSD_CONN)
+    CACHES.update(credential_cache=CREDENTIAL_CACHE, token_cache=TOKEN_CACHE, profile_cache=PROFILE_CACHE,
+                  image_cache=IMAGE_CACHE, picture_cache=PICTURE_CACHE)
+    OBJECT_STORE = createObjectStore()
+    SNS_OUTBOX = createSnsOutbox(worker_id=worker_id)
+    SNS_OUTBOX.start()
+    VERIFICATION_STORE = createVerificationStore()
+    if config.get('VERIFICATION_EXPIRE_INTERVAL', 0) > 0 and worker_id == 0:
+        tornado.ioloop.PeriodicCallback(lambda: tornado.ioloop.IOLoop.current().spawn_callback(expireStaleRecords, VERIFICATION_STORE),
+                                        config['VERIFICATION_EXPIRE_INTERVAL'] * 1000).start()
+    # split the cpus between the crypt pools of all workers
+    initCryptService(kind=config.get('CRYPT_EXECUTOR', 'process'),
+                     max_workers=config.get('CRYPT_WORKERS', 0) or max(1, (os.cpu_count() or 1) // num_workers),
+                     max_pending=config.get('CRYPT_MAX_PENDING', 64))
+    TOKEN_REPLAY_STORE = createTokenReplayStore()
+    if num_workers > 1 and config.get('TOKEN_REPLAY_STORE', 'memory') == 'memory':
+        Logger.getInstance().info('TOKEN_REPLAY_STORE is memory, used tokens are not shared between {} workers'.format(num_workers))
+
+
+def closeWorker():
+    asyncio.get_event_loop().run_until_complete(SNS_OUTBOX.stop())
+    MYSQL_CONN_POOL.closePool()
+    OBJECT_STORE.close()
+    VERIFICATION_STORE.close()
+    TOKEN_REPLAY_STORE.close()
+    STATSD_CONN.close()
+
+
+async def drainWorker(server, timeout: float):
+    """ Stop accepting connections, wait up to timeout seconds for requests in flight, then stop the IOLoop """
+    Logger.getInstance().info('worker stopping, {} requests in flight'.format(ACTIVE_REQUESTS))
+    server.stop()
+    deadline = time.monotonic() + timeout
+    while ACTIVE_REQUESTS > 0 and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    if ACTIVE_REQUESTS > 0:
+        Logger.getInstance().info('worker stopped with {} requests unfinished'.format(ACTIVE_REQUESTS))
+    tornado.ioloop.IOLoop.current().stop()
+
+
+def runWorker(worker_id: int = 0, num_workers: int = 1, sockets=None):
+    config = Config.getInstance()
+    initWorker(worker_id, num_workers)
     try:
-        Logger.getInstance().info('=====service start======')
+        Logger.getInstance().info('=====service start====== worker[{}]'.format(worker_id))
         app = make_app()
         server = tornado.httpserver.HTTPServer(app)
-        server.listen(Config.getInstance()['PORT'], Config.getInstance()['IP'])
-        server.start(1)
+        if sockets is None:
+            # every worker binds its own socket, the kernel balances connections between them
+            sockets = tornado.netutil.bind_sockets(config['PORT'], config['IP'], reuse_port=num_workers > 1)
+        server.add_sockets(sockets)
+
+        loop = asyncio.get_event_loop()
+        stop = lambda: tornado.ioloop.IOLoop.current().spawn_callback(drainWorker, server, config.get('SHUTDOWN_TIMEOUT', 30))
+        loop.add_signal_handler(signal.SIGTERM, stop)
+        if num_workers == 1:
+            loop.add_signal_handler(signal.SIGINT, stop)
         tornado.ioloop.IOLoop.current().start()
-    except KeyboardInterrupt:
-        Logger.getInstance().info('=====service end======')
-        Logger.getInstance().exception(KeyboardInterrupt)
+        Logger.getInstance().info('=====service end====== worker[{}]'.format(worker_id))
     except Exception as e:
         Logger.getInstance().exception(e)
+        raise
     finally:
-        MYSQL_CONN_POOL.closePool()
-        tornado.ioloop.IOLoop.current().stop()
+        closeWorker()
+
+
+def main():
+    config = Config.getInstance()
+    num_workers = config.get('WORKERS', 0) or os.cpu_count() or 1
+    if num_workers == 1:
+        runWorker()
+        return
+
+    sockets = None
+    if not config.get('PREFORK_REUSE_PORT', False):
+        # bound once before the fork, all workers accept on the shared listening socket
+        sockets = tornado.netutil.bind_sockets(config['PORT'], config['IP'])
+    Logger.getInstance().info('=====prefork {} workers======'.format(num_workers))
+    Supervisor(num_workers, lambda worker_id: runWorker(worker_id, num_workers, sockets),
+               shutdown_timeout=config.get('SHUTDOWN_TIMEOUT', 30) + 5,
+               max_restarts=config.get('WORKER_MAX_RESTARTS', 10)).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import base64
+
+from tornado.testing import AsyncHTTPTestCase
+
+from tool.LocalMysqlPool import LocalMysqlPool
+from tool.cryptTool import initCryptService, getCryptService, encrypt
+from service import service_main
+from dao.UserDAO import UserDAO
+
+USERNAME = 'user@example.com'
+PASSWORD = 'Secret-1'
+
+
+class ServiceTestCase(AsyncHTTPTestCase):
+    """
+    service_main.make_app() on the SQLite stand-in database and a thread crypt service.
+    The service_main globals named in GLOBALS (MYSQL_CONN_POOL always) and the crypt service
+    are restored after every test, set the globals after calling setUp.
+    """
+    GLOBALS = ()
+
+    def setUp(self):
+        super(ServiceTestCase, self).setUp()
+        self.saved = {name: getattr(service_main, name, None) for name in ('MYSQL_CONN_POOL', ) + self.GLOBALS}
+        saved_crypt = getCryptService()
+        self.saved_crypt = (saved_crypt.kind, saved_crypt.max_workers, saved_crypt.max_pending)
+        initCryptService(kind='thread', max_workers=2)
+
+        self.pool = LocalMysqlPool(maxsize=2)
+        service_main.MYSQL_CONN_POOL = self.pool
+
+    def tearDown(self):
+        self.pool.closePool()
+        for name, value in self.saved.items():
+            setattr(service_main, name, value)
+        kind, max_workers, max_pending = self.saved_crypt
+        initCryptService(kind=kind, max_workers=max_workers, max_pending=max_pending)
+        super(ServiceTestCase, self).tearDown()
+
+    def get_app(self):
+        return service_main.make_app()
+
+    def createUser(self):
+        """ :return: UserContext of a verified USERNAME, PASSWORD user """
+        users = UserDAO(connect_pool=self.pool.getPool())
+        _, user = self.io_loop.run_sync(lambda: users.createUser('Jane', 'Doe', USERNAME, encrypt(PASSWORD)))
+        self.io_loop.run_sync(lambda: users.updateVerifiedByUsername(USERNAME))
+        return user
+
+    @staticmethod
+    def authorization() -> dict:
+        return {'Authorization': 'Basic ' + base64.b64encode('{}:{}'.format(USERNAME, PASSWORD).encode()).decode()}
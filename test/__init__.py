@@ -0,0 +1,18 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Add path of cwd to sys
+import atexit
+import shutil
+import tempfile
+
+from tool.Config import Config
+
+# runtime files of the service are written to a temporary directory instead of ./log.
+# the test package is imported by unittest discover and pytest before any test module imports tool.Logger
+LOG_DIR = tempfile.mkdtemp(prefix='test-log-')
+Config.getInstance().update({
+    'LOG_FILENAME': os.path.join(LOG_DIR, 'debug.log'),
+    'SNS_OUTBOX_SPILL_FILE': os.path.join(LOG_DIR, 'sns_outbox.jsonl'),
+    'TOKEN_REPLAY_PATH': os.path.join(LOG_DIR, 'used_token.sqlite3'),
+})
+atexit.register(shutil.rmtree, LOG_DIR, ignore_errors=True)
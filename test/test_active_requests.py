@@ -0,0 +1,71 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Add path of cwd to sys
+import shutil
+import asyncio
+import tempfile
+import unittest
+
+import tornado.web
+from tornado.tcpclient import TCPClient
+from tornado.testing import gen_test
+
+from tool.ObjectStore import LocalObjectStore
+from tool.CredentialCache import CredentialCache
+from tool.ImageCache import ImageCache
+from tool.Metrics import RouteMetrics
+from service import service_main
+from test.ServiceTestCase import ServiceTestCase
+
+
+class AbortedRequestTest(ServiceTestCase):
+    GLOBALS = ('CREDENTIAL_CACHE', 'IMAGE_CACHE', 'OBJECT_STORE', 'ROUTE_METRICS', 'ACTIVE_REQUESTS')
+
+    def setUp(self):
+        super(AbortedRequestTest, self).setUp()
+        self.root_dir = tempfile.mkdtemp()
+        self.store = LocalObjectStore(root_dir=self.root_dir)
+        service_main.CREDENTIAL_CACHE = CredentialCache()
+        service_main.IMAGE_CACHE = ImageCache()
+        service_main.OBJECT_STORE = self.store
+        service_main.ROUTE_METRICS = RouteMetrics()
+        service_main.ACTIVE_REQUESTS = 0
+        self.createUser()
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.root_dir)
+        super(AbortedRequestTest, self).tearDown()
+
+    def get_app(self):
+        return tornado.web.Application([(r"/v1/user/self/pic", service_main.PictureStreamHandler)])
+
+    @gen_test
+    def test_streamed_upload_aborted(self):
+        head = ('POST /v1/user/self/pic HTTP/1.1\r\n'
+                'Host: localhost\r\n'
+                'Authorization: {}\r\n'
+                'Content-Type: multipart/form-data; boundary=XyZ\r\n'
+                'Content-Length: 100000\r\n\r\n').format(self.authorization()['Authorization'])
+        stream = yield TCPClient().connect('127.0.0.1', self.get_http_port())
+        yield stream.write(head.encode())
+        yield stream.write(b'--XyZ\r\nContent-Disposition: form-data; name="profilePic"; filename="a.png"\r\n'
+                           b'Content-Type: image/png\r\n\r\n' + b'x' * 1000)
+        for _ in range(200):
+            if service_main.ACTIVE_REQUESTS == 1 and os.listdir(self.root_dir):
+                break
+            yield asyncio.sleep(0.01)
+        self.assertEqual(service_main.ACTIVE_REQUESTS, 1)
+        stream.close()
+
+        for _ in range(200):
+            if service_main.ACTIVE_REQUESTS == 0:
+                break
+            yield asyncio.sleep(0.01)
+        self.assertEqual(service_main.ACTIVE_REQUESTS, 0)
+        routes = service_main.ROUTE_METRICS.snapshot()['routes']
+        self.assertEqual(routes['[POST] /v1/user/self/pic']['status'], {'499': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Add path of cwd to sys
+import json
+import unittest
+
+from tool.Config import Config
+from tool.SnsOutbox import SnsOutbox, LocalPublisher
+from tool.cryptTool import checkSame
+from service import service_main
+from dao.UserDAO import UserDAO
+from test.ServiceTestCase import ServiceTestCase
+
+
+class UserBatchTest(ServiceTestCase):
+    GLOBALS = ('PROFILE_CACHE', 'SNS_OUTBOX')
+
+    def setUp(self):
+        super(UserBatchTest, self).setUp()
+        self.saved_key = Config.getInstance().get('ADMIN_API_KEY')
+        self.saved_chunk = service_main.BATCH_IMPORT_CHUNK
+        Config.getInstance().update({'ADMIN_API_KEY': 'admin-key'})
+        service_main.BATCH_IMPORT_CHUNK = 2
+
+        self.publisher = LocalPublisher()
+        service_main.PROFILE_CACHE = None
+        service_main.SNS_OUTBOX = SnsOutbox(self.publisher)
+        service_main.SNS_OUTBOX.start()
+
+    def tearDown(self):
+        self.io_loop.run_sync(service_main.SNS_OUTBOX.stop)
+        Config.getInstance().update({'ADMIN_API_KEY': self.saved_key})
+        service_main.BATCH_IMPORT_CHUNK = self.saved_chunk
+        super(UserBatchTest, self).tearDown()
+
+    def post(self, lines, key='admin-key'):
+        body = '\n'.join(line if isinstance(line, str) else json.dumps(line) for line in lines)
+        return self.fetch('/v1/users:batch', method='POST', body=body, headers={'Authorization': 'Bearer ' + key})
+
+    def test_forbidden(self):
+        self.assertEqual(self.post([], key='wrong').code, 403)
+        Config.getInstance().update({'ADMIN_API_KEY': ''})
+        self.assertEqual(self.post([], key='').code, 403)
+
+    def test_import(self):
+        self.io_loop.run_sync(lambda: UserDAO(self.pool.getPool()).createUser('Old', 'User', 'old@example.com', 'hash'))
+        response = self.post([
+            {'first_name': 'Jane', 'last_name': 'Doe', 'username': 'jane@example.com', 'password': 'Secret-1'},
+            'not json',
+            {'first_name': 'Old', 'last_name': 'User', 'username': 'old@example.com', 'password': 'Secret-2'},
+            {'first_name': 'John', 'last_name': 'Doe', 'username': 'john@example.com', 'password': 'Secret-3'},
+            {'first_name': 'Jane', 'last_name': 'Again', 'username': 'jane@example.com', 'password': 'Secret-4'},
+            {'username': 'not an email', 'password': 'Secret-5'},
+        ])
+        self.assertEqual(response.code, 200)
+        results = [json.loads(line) for line in response.body.decode().splitlines()]
+        self.assertEqual([(result['line'], result['status']) for result in results[:-1]],
+                         [(1, 201), (2, 400), (3, 400), (4, 201), (5, 400), (6, 400)])
+        self.assertEqual(results[-1], {'summary': {'rows': 6, 'created': 2, 'failed': 4}})
+        self.assertEqual(results[0]['user']['username'], 'jane@example.com')
+        self.assertNotIn('password', results[0]['user'])
+        self.assertTrue(results[0]['notified'])
+
+        jane = self.io_loop.run_sync(lambda: UserDAO(self.pool.getPool()).getUserContextByUsername('jane@example.com'))
+        self.assertTrue(checkSame('Secret-1', jane.password))
+        self.assertFalse(jane.verified)
+
+        self.io_loop.run_sync(service_main.SNS_OUTBOX.stop)
+        self.assertEqual(sorted(message['email'] for message in self.publisher.messages),
+                         ['jane@example.com', 'john@example.com'])
+
+
+if __name__ == '__main__':
+    unittest.main()
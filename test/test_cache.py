@@ -0,0 +1,68 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Add path of cwd to sys
+import unittest
+
+from tool.LruCache import LruCache
+from tool.CredentialCache import CredentialCache
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeStatsd(object):
+    def __init__(self):
+        self.counters = {}
+
+    def incr(self, stat, count=1, rate=1):
+        self.counters[stat] = self.counters.get(stat, 0) + count
+
+
+class LruCacheTest(unittest.TestCase):
+    def test_ttl(self):
+        clock = FakeClock()
+        cache = LruCache(maxsize=10, ttl=5, clock=clock)
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        clock.now += 5
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+    def test_lru_eviction(self):
+        statsd = FakeStatsd()
+        cache = LruCache(maxsize=2, ttl=60, name='test_cache', statsd_conn=statsd)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')  # 'b' becomes least recently used
+        cache.set('c', 3)
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(statsd.counters, {'test_cache.hit': 1, 'test_cache.eviction': 1})
+
+
+class CredentialCacheTest(unittest.TestCase):
+    def test_check(self):
+        cache = CredentialCache(maxsize=10, ttl=60)
+        self.assertFalse(cache.check('a@b.com', 'pwd', 'hash1'))
+        cache.add('a@b.com', 'pwd', 'hash1')
+        self.assertTrue(cache.check('a@b.com', 'pwd', 'hash1'))
+        self.assertFalse(cache.check('a@b.com', 'other', 'hash1'))
+        # stored hash changed, e.g. password updated by another process
+        self.assertFalse(cache.check('a@b.com', 'pwd', 'hash2'))
+
+    def test_invalidate(self):
+        cache = CredentialCache(maxsize=10, ttl=60)
+        cache.add('a@b.com', 'pwd', 'hash1')
+        cache.invalidate('a@b.com')
+        self.assertFalse(cache.check('a@b.com', 'pwd', 'hash1'))
+        self.assertEqual(cache.stats()['hits'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Add path of cwd to sys
+import datetime
+import unittest
+
+from tornado.httputil import format_timestamp
+
+from tool.Conditional import userEtag, lastModified, parseHttpDate
+from tool.CredentialCache import CredentialCache
+from tool.ProfileCache import ProfileCache
+from tool.ImageCache import ImageCache
+from tool.UserContext import UserContext
+from service import service_main
+from dao.ImageDAO import ImageDAO
+from test.ServiceTestCase import ServiceTestCase
+
+UPDATED = datetime.datetime(2021, 3, 4, 5, 6, 7)
+
+
+class ValidatorTest(unittest.TestCase):
+    def test_etag_follows_the_body(self):
+        user = UserContext('1', 'Jane', 'Doe', 'jane@example.com', 'hash', UPDATED, UPDATED, True)
+        etag = userEtag(user)
+        self.assertTrue(etag.startswith('"') and etag.endswith('"'))
+        user.password = 'hash2'  # not in the body
+        self.assertEqual(userEtag(user), etag)
+        user.first_name = 'Janet'
+        self.assertNotEqual(userEtag(user), etag)
+
+    def test_last_modified_is_the_end_of_the_interval(self):
+        second = datetime.timedelta(seconds=1)
+        self.assertEqual(lastModified(UPDATED, second, now=UPDATED + 10 * second), (UPDATED + second).astimezone())
+        # never in the future
+        self.assertEqual(lastModified(UPDATED, datetime.timedelta(days=1), now=UPDATED), UPDATED.astimezone())
+
+    def test_parse_http_date(self):
+        self.assertEqual(parseHttpDate('Thu, 04 Mar 2021 05:06:07 GMT'),
+                         datetime.datetime(2021, 3, 4, 5, 6, 7, tzinfo=datetime.timezone.utc))
+        self.assertIsNone(parseHttpDate('yesterday'))
+        self.assertIsNone(parseHttpDate(''))
+
+
+class ConditionalGetTest(ServiceTestCase):
+    GLOBALS = ('CREDENTIAL_CACHE', 'PROFILE_CACHE', 'IMAGE_CACHE')
+
+    def setUp(self):
+        super(ConditionalGetTest, self).setUp()
+        service_main.CREDENTIAL_CACHE = CredentialCache()
+        service_main.PROFILE_CACHE = ProfileCache()
+        service_main.IMAGE_CACHE = ImageCache()
+        self.user = self.createUser()
+        self.images = ImageDAO(connect_pool=self.pool.getPool(), image_cache=service_main.IMAGE_CACHE)
+        self.io_loop.run_sync(lambda: self.images.upsertUserImage('a.png', 'bucket/a.png', self.user.id))
+        self.statements = []
+        self.pool.getPool().db.set_trace_callback(self.statements.append)
+
+    def get(self, path, **headers):
+        headers.update(self.authorization())
+        return self.fetch(path, headers=headers)
+
+    def test_if_none_match(self):
+        for path in ('/v1/user/self', '/v1/user/self/pic'):
+            response = self.get(path)
+            self.assertEqual(response.code, 200)
+            etag = response.headers['Etag']
+
+            del self.statements[:]
+            response = self.get(path, **{'If-None-Match': etag})
+            self.assertEqual(response.code, 304)
+            self.assertEqual(response.body, b'')
+            self.assertEqual(response.headers['Etag'], etag)
+            # the user row read by authentication and, for the picture, its row. the bodies are memoized
+            self.assertEqual(len(self.statements), 1 if path == '/v1/user/self' else 2)
+            self.assertTrue(self.statements[0].startswith('SELECT id, first_name'))
+
+            self.assertEqual(self.get(path, **{'If-None-Match': '"stale"'}).code, 200)
+
+    def test_etag_changes_with_the_row(self):
+        etag = self.get('/v1/user/self/pic').headers['Etag']
+        self.io_loop.run_sync(lambda: self.images.upsertUserImage('b.png', 'bucket/b.png', self.user.id))
+        response = self.get('/v1/user/self/pic', **{'If-None-Match': etag})
+        self.assertEqual(response.code, 200)
+        self.assertNotEqual(response.headers['Etag'], etag)
+
+    def test_if_modified_since(self):
+        self.pool.getPool().db.execute("UPDATE user SET account_updated = '2021-03-04 05:06:07'")
+        response = self.get('/v1/user/self')
+        self.assertEqual(response.headers['Last-Modified'],
+                         format_timestamp((UPDATED + datetime.timedelta(seconds=1)).astimezone()))
+        last_modified = response.headers['Last-Modified']
+        self.assertEqual(self.get('/v1/user/self', **{'If-Modified-Since': last_modified}).code, 304)
+        self.assertEqual(self.get('/v1/user/self', **{'If-Modified-Since': 'Thu, 01 Jan 1970 00:00:00 GMT'}).code, 200)
+
+        # uploaded today, a change later in the same second or day is not hidden
+        last_modified = self.get('/v1/user/self/pic').headers['Last-Modified']
+        self.io_loop.run_sync(lambda: self.images.upsertUserImage('b.png', 'bucket/b.png', self.user.id))
+        self.assertEqual(self.get('/v1/user/self/pic', **{'If-Modified-Since': last_modified}).code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Add path of cwd to sys
+import asyncio
+import unittest
+
+from tornado.testing import AsyncTestCase, gen_test
+
+from tool.cryptTool import encrypt, checkSame, CryptService, CryptBusyError
+
+
+class CryptServiceTest(AsyncTestCase):
+    def setUp(self):
+        super(CryptServiceTest, self).setUp()
+        self.service = CryptService(kind='thread', max_workers=2, max_pending=1)
+
+    def tearDown(self):
+        self.service.shutdown()
+        super(CryptServiceTest, self).tearDown()
+
+    @gen_test
+    def test_check_same(self):
+        hashed = encrypt('123456')
+        self.assertTrue((yield self.service.run(checkSame, '123456', hashed)))
+        self.assertFalse((yield self.service.run(checkSame, '123', hashed)))
+
+    @gen_test
+    def test_queue_limit(self):
+        first = self.service.run(encrypt, '123456')
+        task = asyncio.ensure_future(first)
+        yield asyncio.sleep(0)
+        with self.assertRaises(CryptBusyError):
+            yield self.service.run(encrypt, '123456')
+        yield task
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Add path of cwd to sys
+import json
+import datetime
+import unittest
+
+from tornado.testing import AsyncTestCase, gen_test
+
+from dao.DaoCore import STATEMENTS, Statement, statement, execute, FETCH_ONE, FETCH_ALL
+from dao.UserDAO import UserDAO
+from dao.ImageDAO import ImageDAO
+from tool import Serializer
+from tool.LocalMysqlPool import LocalMysqlPool
+from tool.ImageRecord import ImageRecord
+
+
+class DaoCoreTest(AsyncTestCase):
+    def setUp(self):
+        super(DaoCoreTest, self).setUp()
+        self.pool = LocalMysqlPool(maxsize=2)
+
+    def tearDown(self):
+        self.pool.closePool()
+        super(DaoCoreTest, self).tearDown()
+
+    def test_registry(self):
+        self.assertIn('user.insert', STATEMENTS)
+        self.assertEqual(STATEMENTS['image.insert'].sql,
+                         "INSERT INTO image (id, file_name, user_id, url, upload_date) VALUES (%s, %s, %s, %s, %s)")
+        with self.assertRaises(ValueError):
+            statement('user.insert', "SELECT 1")
+
+    @gen_test
+    async def test_execute(self):
+        insert = STATEMENTS['image.insert']
+        for user_id in ('u1', 'u2'):
+            image = ImageRecord('id-' + user_id, 'a.png', user_id, 'bucket/a.png', datetime.date(2020, 1, 31))
+            affectRowNum, _ = await execute(self.pool.getPool(), insert, image.toRow(), commit=True, key=user_id)
+            self.assertEqual(affectRowNum, 1)
+
+        select = Statement('test.select_images', "SELECT " + ImageRecord.COLUMNS + " FROM image ORDER BY user_id")
+        count, images = await execute(self.pool.getPool(), select, fetch=FETCH_ALL, mapper=ImageRecord.fromRow)
+        self.assertEqual(count, 2)
+        self.assertEqual([image.user_id for image in images], ['u1', 'u2'])
+        self.assertEqual(Serializer.formatDate(images[0].upload_date), '2020-01-31')
+
+        # errors are logged and reported as nothing affected
+        self.assertEqual((await execute(self.pool.getPool(), insert, image.toRow(), commit=True)), (0, None))
+        broken = Statement('test.broken', "SELECT nothing FROM nowhere")
+        self.assertEqual((await execute(self.pool.getPool(), broken, fetch=FETCH_ONE)), (0, None))
+
+    @gen_test
+    async def test_user_record(self):
+        dao = UserDAO(connect_pool=self.pool.getPool())
+        _, created = await dao.createUser('Jane', 'Doe', 'jane@example.com', 'hash')
+        loaded = await dao.getUserInfoByUsername('jane@example.com')
+        self.assertEqual(loaded.toRow()[:5], created.toRow()[:5])
+        self.assertEqual(json.loads(Serializer.encodeUser(loaded).decode()), json.loads(Serializer.encodeUser(created).decode()))
+        self.assertFalse(hasattr(loaded, '__dict__'))
+
+
+if __name__ == '__main__':
+    unittest.main()
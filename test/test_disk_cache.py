@@ -0,0 +1,112 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Add path of cwd to sys
+import shutil
+import asyncio
+import tempfile
+import unittest
+
+from tool.DiskCache import DiskCache
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def read(cached):
+    try:
+        return os.pread(cached.fd, cached.size, 0)
+    finally:
+        os.close(cached.fd)
+
+
+class DiskCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.root_dir = tempfile.mkdtemp()
+        self.clock = FakeClock()
+        self.objects = {'a': b'a' * 10, 'b': b'b' * 10, 'c': b'c' * 10}
+        self.loads = []
+        self.cache = DiskCache(os.path.join(self.root_dir, 'cache'), max_bytes=25, ttl=60, clock=self.clock)
+
+    def tearDown(self):
+        shutil.rmtree(self.root_dir)
+
+    async def load(self, key):
+        self.loads.append(key)
+        await asyncio.sleep(0)
+        return self.objects.get(key)
+
+    def open(self, key):
+        return asyncio.run(self.cache.open(key, self.load))
+
+    def files(self):
+        return len(os.listdir(self.cache.root_dir))
+
+    def test_hit_and_miss(self):
+        first = self.open('a')
+        self.assertEqual(first.size, 10)
+        self.assertEqual(read(first), b'a' * 10)
+        second = self.open('a')
+        self.assertEqual(second.etag, first.etag)
+        self.assertEqual(read(second), b'a' * 10)
+        self.assertEqual(self.loads, ['a'])
+        self.assertIsNone(self.open('missing'))
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size'], stats['bytes']), (1, 2, 1, 10))
+
+    def test_concurrent_misses_load_once(self):
+        async def openMany():
+            return await asyncio.gather(*[self.cache.open('a', self.load) for _ in range(5)])
+        for cached in asyncio.run(openMany()):
+            self.assertEqual(read(cached), b'a' * 10)
+        self.assertEqual(self.loads, ['a'])
+
+    def test_eviction_by_bytes(self):
+        read(self.open('a'))
+        read(self.open('b'))
+        read(self.open('a'))  # b is the least recently used now
+        read(self.open('c'))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+        self.assertEqual(self.cache.stats()['bytes'], 20)
+        self.assertEqual(self.files(), 2)
+        read(self.open('a'))
+        read(self.open('b'))
+        self.assertEqual(self.loads, ['a', 'b', 'c', 'b'])
+
+    def test_open_file_outlives_eviction(self):
+        cached = self.open('a')
+        self.cache.invalidate('a')
+        self.assertEqual(self.files(), 0)
+        self.assertEqual(read(cached), b'a' * 10)
+
+    def test_invalidate(self):
+        read(self.open('a'))
+        self.objects['a'] = b'new'
+        self.cache.invalidate('a')
+        self.assertEqual(read(self.open('a')), b'new')
+        self.assertEqual(self.loads, ['a', 'a'])
+
+    def test_invalidated_while_loading(self):
+        async def openAndInvalidate():
+            opening = asyncio.ensure_future(self.cache.open('a', self.load))
+            await asyncio.sleep(0)
+            self.cache.invalidate('a')
+            return await opening
+        self.assertEqual(read(asyncio.run(openAndInvalidate())), b'a' * 10)
+        self.assertEqual(self.cache.stats()['size'], 0)
+        self.assertEqual(self.files(), 0)
+
+    def test_ttl(self):
+        read(self.open('a'))
+        self.clock.now += 61
+        read(self.open('a'))
+        self.assertEqual(self.loads, ['a', 'a'])
+        self.assertEqual(self.files(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Add path of cwd to sys
+import csv
+import json
+import unittest
+
+from tornado.testing import AsyncHTTPTestCase
+from tornado.simple_httpclient import HTTPStreamClosedError
+
+from tool import Serializer
+from tool.Config import Config
+from tool.LocalMysqlPool import LocalMysqlPool
+from service import service_main
+from dao.UserDAO import UserDAO
+from dao.ImageDAO import ImageDAO
+
+USERS = 7
+
+
+class ExportTest(AsyncHTTPTestCase):
+    def setUp(self):
+        super(ExportTest, self).setUp()
+        self.saved = (service_main.MYSQL_CONN_POOL, service_main.EXPORT_PAGE_SIZE, service_main.EXPORT_CHUNK,
+                      Config.getInstance().get('ADMIN_API_KEY'))
+        Config.getInstance().update({'ADMIN_API_KEY': 'admin-key'})
+        service_main.EXPORT_PAGE_SIZE = 3
+        service_main.EXPORT_CHUNK = 2
+
+        self.pool = LocalMysqlPool(maxsize=2)
+        service_main.MYSQL_CONN_POOL = self.pool
+        self.users = self.io_loop.run_sync(lambda: UserDAO(self.pool.getPool()).createUsers(
+            [('User', str(i), 'user{}@example.com'.format(i), 'hash') for i in range(USERS)]))
+        self.io_loop.run_sync(lambda: ImageDAO(self.pool.getPool()).createUserImage('a.png', 'bucket/a.png', 'u1'))
+
+    def tearDown(self):
+        self.pool.closePool()
+        service_main.MYSQL_CONN_POOL, service_main.EXPORT_PAGE_SIZE, service_main.EXPORT_CHUNK, admin_key = self.saved
+        Config.getInstance().update({'ADMIN_API_KEY': admin_key})
+        super(ExportTest, self).tearDown()
+
+    def get_app(self):
+        return service_main.make_app()
+
+    def export(self, path, key='admin-key'):
+        return self.fetch(path, headers={'Authorization': 'Bearer ' + key})
+
+    def test_forbidden(self):
+        self.assertEqual(self.export('/v1/export/user', key='wrong').code, 403)
+        self.assertEqual(self.fetch('/v1/export/user').code, 403)
+        self.assertEqual(self.export('/v1/export/user?format=xml').code, 400)
+        self.assertEqual(self.export('/v1/export/verification').code, 404)
+
+    def test_ndjson(self):
+        response = self.export('/v1/export/user')
+        self.assertEqual(response.code, 200)
+        rows = [json.loads(line) for line in response.body.decode().splitlines()]
+        ids = sorted(user.id for _, user in self.users)
+        self.assertEqual([row['id'] for row in rows], ids)
+        self.assertNotIn('password', rows[0])
+        self.assertEqual(rows[0]['account_created'], Serializer.formatDatetime(self.users[0][1].account_created))
+
+        # resume after the 4th row, across a page boundary
+        response = self.export('/v1/export/user?after=' + ids[3])
+        self.assertEqual([json.loads(line)['id'] for line in response.body.decode().splitlines()], ids[4:])
+
+    def test_csv(self):
+        response = self.export('/v1/export/image?format=csv')
+        self.assertEqual(response.code, 200)
+        self.assertTrue(response.headers['Content-Type'].startswith('text/csv'))
+        rows = list(csv.reader(response.body.decode().splitlines()))
+        self.assertEqual(rows[0], ['id', 'file_name', 'user_id', 'url', 'upload_date'])
+        self.assertEqual([row[1:4] for row in rows[1:]], [['a.png', 'u1', 'bucket/a.png']])
+
+    def test_failure_is_not_a_complete_export(self):
+        pool = self.pool.getPool()
+        acquire = pool._acquire
+        calls = []
+
+        async def failing():
+            calls.append(1)
+            if len(calls) > 1:
+                raise ConnectionError('lost the database')
+            return await acquire()
+        pool._acquire = failing
+
+        with self.assertRaises(HTTPStreamClosedError):
+            self.export('/v1/export/user')
+        self.assertEqual(pool.freesize, pool.size)
+
+
+if __name__ == '__main__':
+    unittest.main()
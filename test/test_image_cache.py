@@ -0,0 +1,79 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Add path of cwd to sys
+import json
+import unittest
+
+from tornado.testing import AsyncTestCase, gen_test
+
+from tool import Serializer
+from tool.ImageCache import ImageCache
+from tool.LocalMysqlPool import LocalMysqlPool
+from dao.ImageDAO import ImageDAO
+
+
+class ImageCacheTest(AsyncTestCase):
+    def setUp(self):
+        super(ImageCacheTest, self).setUp()
+        self.pool = LocalMysqlPool(maxsize=2)
+        self.cache = ImageCache(maxsize=10, ttl=30)
+        self.dao = ImageDAO(connect_pool=self.pool.getPool(), image_cache=self.cache)
+        # a worker process whose writes never reach self.cache
+        self.other_worker = ImageDAO(connect_pool=self.pool.getPool())
+
+    def tearDown(self):
+        self.pool.closePool()
+        super(ImageCacheTest, self).tearDown()
+
+    @gen_test
+    def test_rows_are_read_from_database(self):
+        self.assertIsNone((yield self.dao.getUserImage('u1')))
+        yield self.other_worker.upsertUserImage('a.png', 'bucket/u1/a.png', 'u1')
+        image = yield self.dao.getUserImage('u1')
+        self.cache.etag(image)
+
+        yield self.other_worker.upsertUserImage('b.png', 'bucket/u1/b.png', 'u1')
+        self.assertEqual((yield self.dao.getUserImage('u1')).url, 'bucket/u1/b.png')
+        yield self.other_worker.fetchAndDeleteUserImage('u1')
+        self.assertIsNone((yield self.dao.getUserImage('u1')))
+
+    @gen_test
+    def test_body_is_memoized(self):
+        yield self.dao.upsertUserImage('a.png', 'bucket/u1/a.png', 'u1')
+        image = yield self.dao.getUserImage('u1')
+        etag = self.cache.etag(image)
+        body = self.cache.body(image)
+        self.assertEqual(body, Serializer.encodeImage(image))
+
+        # the same row read by the next request
+        image = yield self.dao.getUserImage('u1')
+        self.assertEqual(self.cache.etag(image), etag)
+        self.assertIs(self.cache.body(image), body)
+        self.assertEqual((self.cache.stats()['hits'], self.cache.stats()['misses']), (1, 1))
+
+    @gen_test
+    def test_changed_row_is_encoded_again(self):
+        yield self.dao.upsertUserImage('a.png', 'bucket/u1/a.png', 'u1')
+        image = yield self.dao.getUserImage('u1')
+        etag = self.cache.etag(image)
+        self.cache.body(image)
+
+        yield self.other_worker.upsertUserImage('b.png', 'bucket/u1/b.png', 'u1')
+        image = yield self.dao.getUserImage('u1')
+        self.assertNotEqual(self.cache.etag(image), etag)
+        self.assertEqual(json.loads(self.cache.body(image).decode())['file_name'], 'b.png')
+
+    @gen_test
+    def test_writes_invalidate(self):
+        for write in (lambda: self.dao.upsertUserImage('b.png', 'bucket/u1/b.png', 'u1'),
+                      lambda: self.dao.updateUserImage('c.png', 'bucket/u1/c.png', 'u1'),
+                      lambda: self.dao.fetchAndDeleteUserImage('u1')):
+            yield self.other_worker.upsertUserImage('a.png', 'bucket/u1/a.png', 'u1')
+            self.cache.etag((yield self.dao.getUserImage('u1')))
+            self.assertEqual(self.cache.stats()['size'], 1)
+
+            yield write()
+            self.assertEqual(self.cache.stats()['size'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Add path of cwd to sys
+import json
+import unittest
+
+from tornado.testing import AsyncTestCase, gen_test
+
+from tool import Serializer
+from tool.LocalMysqlPool import LocalMysqlPool, _LocalConnection, _LocalCursor
+from dao.UserDAO import UserDAO
+from dao.ImageDAO import ImageDAO
+
+
+class _ChangedRowsCursor(_LocalCursor):
+    """ MySQL without CLIENT.FOUND_ROWS: an UPDATE reports the rows it changed, 0 when it writes the same values """
+
+    async def execute(self, query, args=None):
+        rowcount = await super(_ChangedRowsCursor, self).execute(query, args)
+        return 0 if query.startswith('UPDATE') else rowcount
+
+
+class LocalMysqlPoolTest(AsyncTestCase):
+    def setUp(self):
+        super(LocalMysqlPoolTest, self).setUp()
+        self.pool = LocalMysqlPool(maxsize=2)
+
+    def tearDown(self):
+        self.pool.closePool()
+        super(LocalMysqlPoolTest, self).tearDown()
+
+    @gen_test
+    def test_user_dao(self):
+        dao = UserDAO(connect_pool=self.pool.getPool())
+        is_success, user = yield dao.createUser('Jane', 'Doe', 'jane@example.com', 'hash')
+        self.assertTrue(is_success)
+        self.assertNotIn('password', json.loads(Serializer.encodeUser(user).decode()))
+        self.assertTrue((yield dao.usernameExist('jane@example.com')))
+        self.assertFalse((yield dao.usernameVerified('jane@example.com')))
+
+        self.assertTrue((yield dao.updateVerifiedByUsername('jane@example.com')))
+        context = yield dao.getUserContextByUsername('jane@example.com')
+        self.assertEqual(context.id, user.id)
+        self.assertEqual(context.password, 'hash')
+        self.assertEqual(context.account_created, user.account_created)
+        self.assertTrue(context.verified)
+
+        self.assertTrue((yield dao.updateUser('Janet', 'Doe', 'jane@example.com', 'hash2')))
+        info = yield dao.getUserInfoByUsername('jane@example.com')
+        self.assertEqual(info.first_name, 'Janet')
+        self.assertIsNone((yield dao.getUserContextByUsername('john@example.com')))
+
+    @gen_test
+    async def test_bulk_user_dao(self):
+        dao = UserDAO(connect_pool=self.pool.getPool())
+        await dao.createUser('Jane', 'Doe', 'jane@example.com', 'hash')
+        self.assertEqual((await dao.existingUsernames(['jane@example.com', 'john@example.com'])), {'jane@example.com'})
+
+        # the chunk transaction fails on the taken username, the others are inserted one by one
+        results = await dao.createUsers([('John', 'Doe', 'john@example.com', 'hash'), ('Jane', 'Doe', 'jane@example.com', 'hash'),
+                                         ('Joe', 'Doe', 'joe@example.com', 'hash')])
+        self.assertEqual([is_success for is_success, _ in results], [True, False, True])
+        self.assertEqual((await dao.existingUsernames(['john@example.com', 'joe@example.com'])),
+                         {'john@example.com', 'joe@example.com'})
+
+    @gen_test
+    def test_image_dao(self):
+        dao = ImageDAO(connect_pool=self.pool.getPool())
+        is_success, previous_url, image = yield dao.upsertUserImage('a.png', 'bucket/u1/a.png', 'u1')
+        self.assertTrue(is_success)
+        self.assertIsNone(previous_url)
+
+        is_success, previous_url, _ = yield dao.upsertUserImage('b.png', 'bucket/u1/b.png', 'u1')
+        self.assertEqual(previous_url, 'bucket/u1/a.png')
+        current = yield dao.getUserImage('u1')
+        self.assertEqual((current.id, current.url), (image.id, 'bucket/u1/b.png'))
+
+        deleted = yield dao.fetchAndDeleteUserImage('u1')
+        self.assertEqual(deleted.file_name, 'b.png')
+        self.assertIsNone((yield dao.getUserImage('u1')))
+        self.assertIsNone((yield dao.fetchAndDeleteUserImage('u1')))
+
+    @gen_test
+    async def test_upload_same_image_again(self):
+        cursor = _LocalConnection.cursor
+        _LocalConnection.cursor = lambda conn, cursor_class=None: _ChangedRowsCursor(conn)
+        self.addCleanup(setattr, _LocalConnection, 'cursor', cursor)
+
+        dao = ImageDAO(connect_pool=self.pool.getPool())
+        self.assertTrue((await dao.upsertUserImage('a.png', 'bucket/u1/a.png', 'u1'))[0])
+        is_success, previous_url, _ = await dao.upsertUserImage('a.png', 'bucket/u1/a.png', 'u1')
+        self.assertTrue(is_success)
+        self.assertEqual(previous_url, 'bucket/u1/a.png')
+
+    @gen_test
+    async def test_pool_size(self):
+        pool = self.pool.getPool()
+        conn = await pool.acquire()
+        async with pool.acquire():
+            self.assertEqual((pool.size, pool.freesize), (2, 0))
+        pool.release(conn)
+        self.assertEqual(pool.freesize, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
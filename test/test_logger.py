@@ -0,0 +1,90 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Add path of cwd to sys
+import queue
+import shutil
+import logging
+import tempfile
+import unittest
+
+from tool.Logger import _Logger, _RateLimitFilter
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class QueuedLoggerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp_dir, 'debug.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_write_through_writer_thread(self):
+        logger = _Logger(level='INFO', format='%(levelname)s %(message)s', filename=self.filename)
+        for i in range(1000):
+            logger.info('line %s of %s', i, 'x')
+        logger.debug('not written')
+        try:
+            raise ValueError('boom')
+        except ValueError as e:
+            logger.exception(e)
+        logger.stopWriter()
+
+        with open(self.filename, encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[0], 'INFO line 0 of x')
+        self.assertEqual(lines[999], 'INFO line 999 of x')
+        self.assertEqual(lines[1000], 'ERROR boom')
+        self.assertIn('ValueError: boom', lines[-1])
+
+    def test_reopen(self):
+        worker_file = os.path.join(self.tmp_dir, 'debug.1.log')
+        for queued in (True, False):
+            logger = _Logger(level='INFO', format='%(message)s', filename=self.filename, queued=queued)
+            logger.info('parent')
+            logger.reopen(worker_file)
+            logger.info('worker')
+            logger.stopWriter()
+            for handler in logger.handlers:
+                handler.flush()
+
+            for filename, line in ((self.filename, 'parent'), (worker_file, 'worker')):
+                with open(filename, encoding='utf-8') as f:
+                    self.assertEqual(f.read().splitlines()[-1], line)
+
+    def test_full_queue_drops(self):
+        logger = _Logger(level='INFO', format='%(message)s', filename=self.filename)
+        logger.stopWriter()
+        logger.queue_handler.queue = queue.SimpleQueue()  # nothing drains it any more
+        logger.queue_handler.maxsize = 1
+        logger.info('a')
+        logger.info('b')
+        self.assertEqual(logger.queue_handler.dropped, 1)
+
+
+class RateLimitFilterTest(unittest.TestCase):
+    def record(self, level=logging.INFO, lineno=10):
+        return logging.LogRecord('test', level, 'dao/UserDAO.py', lineno, 'execute sql [%s]', ('a', ), None)
+
+    def test_limit_per_site(self):
+        clock = FakeClock()
+        rate_filter = _RateLimitFilter(rate=1, burst=2, clock=clock)
+        self.assertEqual([rate_filter.filter(self.record()) for _ in range(4)], [True, True, False, False])
+        self.assertTrue(rate_filter.filter(self.record(lineno=11)))  # other call site
+        self.assertTrue(rate_filter.filter(self.record(level=logging.ERROR)))
+
+        clock.now += 1
+        record = self.record()
+        self.assertTrue(rate_filter.filter(record))
+        self.assertEqual(record.getMessage(), 'execute sql [a] [2 similar messages suppressed]')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,8 @@
 import os
 import sys
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Add path of cwd to sys
+import json
+
 from tornado.test.util import unittest
 from tornado.testing import AsyncHTTPTestCase
 from service.service_main import make_app
@@ -17,9 +19,21 @@ class HealthzTest(BaseTest):
         return make_app()
 
     def test(self):
-        # response = self.fetch('/healthz', method='GET')
-        # self.assertEqual(response.code, 200)
-        self.assertEqual(200, 200)
+        response = self.fetch('/healthz', method='GET')
+        self.assertEqual(response.code, 200)
+
+
+class MetricsTest(BaseTest):
+    def get_app(self):
+        return make_app()
+
+    def test(self):
+        self.fetch('/healthz', method='GET')
+        response = self.fetch('/metrics', method='GET')
+        self.assertEqual(response.code, 200)
+        healthz = json.loads(response.body)['routes']['[GET] /healthz']
+        self.assertGreaterEqual(healthz['count'], 1)
+        self.assertGreaterEqual(healthz['status']['200'], 1)
 
 
 if __name__ == '__main__':
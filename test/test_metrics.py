@@ -0,0 +1,83 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Add path of cwd to sys
+import unittest
+
+from tool.Metrics import StatsdPipeline, LatencyHistogram, RouteMetrics
+
+
+class FakeStatsClient(object):
+    def __init__(self):
+        self._prefix = None
+        self._maxudpsize = 512
+        self.packets = []
+
+    def _after(self, data):
+        self.packets.append(data)
+
+    def close(self):
+        pass
+
+
+class StatsdPipelineTest(unittest.TestCase):
+    def test_flush_on_size(self):
+        client = FakeStatsClient()
+        pipeline = StatsdPipeline(client, max_size=3)
+        pipeline.incr('a')
+        pipeline.timing('b', 1.5)
+        self.assertEqual(client.packets, [])
+        pipeline.incr('c')
+        self.assertEqual(client.packets, ['a:1|c\nb:1.500000|ms\nc:1|c'])
+
+    def test_flush(self):
+        client = FakeStatsClient()
+        pipeline = StatsdPipeline(client, max_size=100)
+        pipeline.gauge('g', -1)
+        pipeline.flush()
+        self.assertEqual(client.packets, ['g:0|g\ng:-1|g'])
+        pipeline.flush()
+        self.assertEqual(len(client.packets), 1)
+
+
+class LatencyHistogramTest(unittest.TestCase):
+    def test_percentile(self):
+        histogram = LatencyHistogram()
+        for value in range(1, 100001):
+            histogram.record(value)
+        self.assertEqual(histogram.count, 100000)
+        self.assertEqual(histogram.percentile(100), 100000)
+        for percent in (50, 90, 99, 99.9):
+            expected = 100000 * percent / 100
+            self.assertAlmostEqual(histogram.percentile(percent), expected, delta=expected / 64)
+
+    def test_small_values_are_exact(self):
+        histogram = LatencyHistogram()
+        for value in (3, 5, 7):
+            histogram.record(value)
+        self.assertEqual(histogram.percentile(50), 5)
+        self.assertEqual(histogram.min, 3)
+
+    def test_clamp(self):
+        histogram = LatencyHistogram(highest=1000)
+        histogram.record(10 ** 9)
+        self.assertEqual(histogram.max, 1000)
+
+
+class RouteMetricsTest(unittest.TestCase):
+    def test_record(self):
+        client = FakeStatsClient()
+        statsd = StatsdPipeline(client)
+        metrics = RouteMetrics(statsd_conn=statsd)
+        metrics.record('GET', '/v1/user/self', 200, 0.010)
+        metrics.record('GET', '/v1/user/self', 400, 0.002)
+        statsd.flush()
+
+        route = metrics.snapshot()['routes']['[GET] /v1/user/self']
+        self.assertEqual(route['count'], 2)
+        self.assertEqual(route['status'], {'200': 1, '400': 1})
+        self.assertAlmostEqual(route['latency_ms']['max'], 10, delta=0.2)
+        self.assertIn('[GET] /v1/user/self 400:1|c', client.packets[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
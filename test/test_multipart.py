@@ -0,0 +1,55 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Add path of cwd to sys
+import unittest
+
+from tool.MultipartParser import MultipartParser, MultipartError, parseBoundary
+
+BODY = (b'--XyZ\r\n'
+        b'Content-Disposition: form-data; name="note"\r\n\r\n'
+        b'hello\r\n'
+        b'--XyZ\r\n'
+        b'Content-Disposition: form-data; name="profilePic"; filename="a.png"\r\n'
+        b'Content-Type: image/png\r\n\r\n'
+        b'\x89PNG\r\n--Xy not a boundary\r\n'
+        b'\r\n--XyZ--\r\n')
+
+
+def parse(body, chunk_size):
+    parser = MultipartParser(b'XyZ')
+    parts = []
+    for i in range(0, len(body), chunk_size):
+        for event, value in parser.feed(body[i:i + chunk_size]):
+            if event == 'part':
+                parts.append([value, b''])
+            elif event == 'data':
+                parts[-1][1] += value
+    return parser, parts
+
+
+class MultipartParserTest(unittest.TestCase):
+    def test_boundary(self):
+        self.assertEqual(parseBoundary('multipart/form-data; boundary="XyZ"'), b'XyZ')
+        self.assertIsNone(parseBoundary('application/json'))
+
+    def test_any_chunk_size(self):
+        for chunk_size in range(1, len(BODY) + 1):
+            parser, parts = parse(BODY, chunk_size)
+            self.assertTrue(parser.finished)
+            self.assertEqual(len(parts), 2)
+            self.assertEqual(parts[0][0]['name'], 'note')
+            self.assertEqual(parts[0][1], b'hello')
+            self.assertEqual(parts[1][0], {'name': 'profilePic', 'filename': 'a.png', 'content_type': 'image/png'})
+            self.assertEqual(parts[1][1], b'\x89PNG\r\n--Xy not a boundary\r\n')
+
+    def test_truncated(self):
+        parser, parts = parse(BODY[:-12], 7)
+        self.assertFalse(parser.finished)
+
+    def test_malformed(self):
+        with self.assertRaises(MultipartError):
+            MultipartParser(b'XyZ').feed(b'--XyZ\r\nno header separator line\r\n\r\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Add path of cwd to sys
+import shutil
+import tempfile
+import unittest
+
+from tornado.testing import AsyncTestCase, gen_test
+
+from tool.ObjectStore import LocalObjectStore
+
+
+class LocalObjectStoreTest(AsyncTestCase):
+    def setUp(self):
+        super(LocalObjectStoreTest, self).setUp()
+        self.root_dir = tempfile.mkdtemp()
+        self.store = LocalObjectStore(root_dir=self.root_dir, bucket='bucket', max_concurrency=2)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.root_dir)
+        super(LocalObjectStoreTest, self).tearDown()
+
+    @gen_test
+    def test_put_get_delete(self):
+        yield self.store.put('bucket/user/a.png', b'png data', content_type='image/png')
+        self.assertEqual((yield self.store.get('bucket/user/a.png')), b'png data')
+
+        meta = yield self.store.head('bucket/user/a.png')
+        self.assertEqual(meta['size'], 8)
+        self.assertEqual(meta['content_type'], 'image/png')
+
+        yield self.store.put('bucket/user/b.png', b'b')
+        yield self.store.delete_many(['bucket/user/a.png', 'bucket/user/b.png'])
+        self.assertIsNone((yield self.store.get('bucket/user/a.png')))
+        self.assertIsNone((yield self.store.head('bucket/user/b.png')))
+
+    @gen_test
+    def test_list_objects(self):
+        yield self.store.put('bucket/user/x/a.png', b'png data')
+        yield self.store.put('bucket/user/b.png', b'b')
+        yield self.store.put('bucket/user2/c.png', b'c')
+        upload = self.store.openUpload('bucket/user/d.png')
+        yield upload.write(b'in progress')
+
+        objects = yield self.store.list_objects('bucket/user/')
+        self.assertEqual(sorted((item['key'], item['size']) for item in objects),
+                         [('bucket/user/b.png', 1), ('bucket/user/x/a.png', 8)])
+        self.assertIsNotNone(objects[0]['last_modified'].tzinfo)
+        self.assertEqual((yield self.store.list_objects('bucket/nobody/')), [])
+        yield upload.abort()
+
+    @gen_test
+    def test_key_outside_store(self):
+        with self.assertRaises(ValueError):
+            yield self.store.put('../escape.png', b'data')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Add path of cwd to sys
+import asyncio
+import unittest
+
+from tornado.testing import AsyncTestCase, gen_test
+
+from tool.ObservedPool import ObservedPool
+from tool.LocalMysqlPool import LocalPool
+
+
+class FakeConnection(object):
+    def __init__(self, dead=False):
+        self.dead = dead
+        self.closed = False
+
+    async def ping(self, reconnect=True):
+        if self.dead:
+            raise ConnectionResetError('connection reset by peer')
+
+    def close(self):
+        self.closed = True
+
+
+class FakePool(object):
+    """ Hands out the given idle connections first, then new ones """
+
+    def __init__(self, idle):
+        self.free = list(idle)
+        self.used = set()
+
+    @property
+    def size(self):
+        return len(self.free) + len(self.used)
+
+    @property
+    def freesize(self):
+        return len(self.free)
+
+    async def acquire(self):
+        conn = self.free.pop(0) if self.free else FakeConnection()
+        self.used.add(conn)
+        return conn
+
+    def release(self, conn):
+        self.used.remove(conn)
+        if not conn.closed:
+            self.free.append(conn)
+
+
+class ObservedPoolTest(AsyncTestCase):
+
+    @gen_test
+    async def test_limit_and_stats(self):
+        pool = ObservedPool(LocalPool(maxsize=5), minsize=1, maxsize=2)
+        first = await pool.acquire()
+        async with pool.acquire() as second:
+            third = asyncio.ensure_future(pool.acquire())
+            await asyncio.sleep(0.01)
+            self.assertFalse(third.done())
+            self.assertEqual(pool.stats()['waiting'], 1)
+            self.assertIsNotNone(second)
+        third = await third
+        pool.release(first)
+        pool.release(third)
+
+        stats = pool.stats()
+        self.assertEqual((stats['acquires'], stats['in_use'], stats['waiting']), (3, 0, 0))
+        self.assertGreaterEqual(stats['acquire_wait_ms']['max'], 5)
+        pool.pool.close()
+
+    @gen_test
+    async def test_cancelled_waiter_keeps_no_slot(self):
+        pool = ObservedPool(FakePool([]), minsize=1, maxsize=1)
+        conn = await pool.acquire()
+        waiter = asyncio.ensure_future(pool.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        pool.release(conn)
+        self.assertEqual(pool.in_use, 0)
+        pool.release(await pool.acquire())
+
+    @gen_test
+    async def test_pre_ping_replaces_dead_connections(self):
+        fake = FakePool([])
+        pool = ObservedPool(fake, maxsize=4, pre_ping_idle=0)
+        conns = [await pool.acquire(), await pool.acquire()]
+        for conn in conns:
+            pool.release(conn)
+        conns[0].dead = True
+
+        conn = await pool.acquire()
+        self.assertIs(conn, conns[1])
+        self.assertTrue(conns[0].closed)
+        self.assertEqual((pool.stats()['pings'], pool.stats()['stale']), (2, 1))
+        pool.release(conn)
+
+    @gen_test
+    async def test_adaptive_resize(self):
+        pool = ObservedPool(FakePool([]), minsize=1, maxsize=8, adaptive=True, wait_target=0.001)
+        self.assertEqual(pool.limit, 1)
+
+        conn = await pool.acquire()
+        waiter = asyncio.ensure_future(pool.acquire())
+        await asyncio.sleep(0.01)
+        pool.release(conn)
+        pool.release(await waiter)
+        pool.tick()
+        self.assertEqual(pool.limit, 2)
+
+        # no waits and at most one connection in use, shrink back one step per tick
+        pool.limit = 4
+        pool.release(await pool.acquire())
+        pool.tick()
+        self.assertEqual(pool.limit, 3)
+        pool.tick()
+        pool.tick()
+        self.assertEqual(pool.limit, 1)
+
+    @gen_test
+    async def test_shrink_closes_surplus_connections(self):
+        fake = FakePool([])
+        pool = ObservedPool(fake, minsize=1, maxsize=3)
+        conns = [await pool.acquire() for _ in range(3)]
+        pool.limit = 1
+        for conn in conns:
+            pool.release(conn)
+        self.assertEqual([conn.closed for conn in conns], [True, True, False])
+        self.assertEqual(fake.size, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
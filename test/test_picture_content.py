@@ -0,0 +1,112 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Add path of cwd to sys
+import shutil
+import tempfile
+import unittest
+
+from tool.ObjectStore import LocalObjectStore
+from tool.DiskCache import DiskCache
+from tool.CredentialCache import CredentialCache
+from tool.ProfileCache import ProfileCache
+from tool.ImageCache import ImageCache
+from service import service_main
+from test.ServiceTestCase import ServiceTestCase
+
+PICTURE = bytes(range(256)) * 4
+
+
+class PictureContentTest(ServiceTestCase):
+    GLOBALS = ('CREDENTIAL_CACHE', 'PROFILE_CACHE', 'IMAGE_CACHE', 'OBJECT_STORE', 'PICTURE_CACHE', 'PICTURE_CONTENT_CHUNK')
+
+    def setUp(self):
+        super(PictureContentTest, self).setUp()
+        self.root_dir = tempfile.mkdtemp()
+
+        self.store = LocalObjectStore(root_dir=os.path.join(self.root_dir, 'objects'))
+        service_main.CREDENTIAL_CACHE = CredentialCache()
+        service_main.PROFILE_CACHE = ProfileCache()
+        service_main.IMAGE_CACHE = ImageCache()
+        service_main.OBJECT_STORE = self.store
+        service_main.PICTURE_CACHE = DiskCache(os.path.join(self.root_dir, 'cache'), max_bytes=4096)
+        service_main.PICTURE_CONTENT_CHUNK = 100  # several chunks per response
+        self.createUser()
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.root_dir)
+        super(PictureContentTest, self).tearDown()
+
+    def upload(self, file_name, data):
+        body = (b'--XyZ\r\n'
+                b'Content-Disposition: form-data; name="profilePic"; filename="' + file_name.encode() + b'"\r\n'
+                b'Content-Type: image/png\r\n\r\n' + data + b'\r\n--XyZ--\r\n')
+        headers = dict(self.authorization(), **{'Content-Type': 'multipart/form-data; boundary=XyZ'})
+        response = self.fetch('/v1/user/self/pic', method='POST', headers=headers, body=body)
+        self.assertEqual(response.code, 201)
+
+    def content(self, **headers):
+        return self.fetch('/v1/user/self/pic/content', headers=dict(self.authorization(), **headers))
+
+    def test_without_picture(self):
+        self.assertEqual(self.content().code, 404)
+
+    def test_whole_picture(self):
+        self.upload('a.png', PICTURE)
+        for _ in range(2):
+            response = self.content()
+            self.assertEqual(response.code, 200)
+            self.assertEqual(response.body, PICTURE)
+            self.assertEqual(response.headers['Content-Type'], 'image/png')
+            self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+        stats = service_main.PICTURE_CACHE.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_if_none_match(self):
+        self.upload('a.png', PICTURE)
+        etag = self.content().headers['Etag']
+        response = self.content(**{'If-None-Match': etag})
+        self.assertEqual(response.code, 304)
+        self.assertEqual(response.body, b'')
+        self.assertEqual(self.content(**{'If-None-Match': '"stale"'}).code, 200)
+
+    def test_range(self):
+        self.upload('a.png', PICTURE)
+        response = self.content(Range='bytes=100-349')
+        self.assertEqual(response.code, 206)
+        self.assertEqual(response.body, PICTURE[100:350])
+        self.assertEqual(response.headers['Content-Range'], 'bytes 100-349/1024')
+
+        response = self.content(Range='bytes=-10')
+        self.assertEqual(response.code, 206)
+        self.assertEqual(response.body, PICTURE[-10:])
+
+        response = self.content(Range='bytes=2000-')
+        self.assertEqual(response.code, 416)
+        self.assertEqual(response.headers['Content-Range'], 'bytes */1024')
+
+        self.assertEqual(self.content(Range='bytes=0-1,5-9').body, PICTURE)  # multiple ranges are ignored
+
+    def test_if_range(self):
+        self.upload('a.png', PICTURE)
+        etag = self.content().headers['Etag']
+        self.assertEqual(self.content(Range='bytes=0-9', **{'If-Range': etag}).code, 206)
+        response = self.content(Range='bytes=0-9', **{'If-Range': '"stale"'})
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, PICTURE)
+
+    def test_reupload_invalidates(self):
+        self.upload('a.png', PICTURE)
+        etag = self.content().headers['Etag']
+        self.upload('a.png', b'new picture')  # same object key
+        response = self.content(**{'If-None-Match': etag})
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, b'new picture')
+
+        self.assertEqual(self.fetch('/v1/user/self/pic', method='DELETE', headers=self.authorization()).code, 204)
+        self.assertEqual(self.content().code, 404)
+        self.assertEqual(service_main.PICTURE_CACHE.stats()['size'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Add path of cwd to sys
+import time
+import signal
+import shutil
+import tempfile
+import unittest
+
+from tool.Prefork import Supervisor
+
+
+class SupervisorTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.handlers = signal.getsignal(signal.SIGTERM), signal.getsignal(signal.SIGINT)
+
+    def tearDown(self):
+        signal.signal(signal.SIGTERM, self.handlers[0])
+        signal.signal(signal.SIGINT, self.handlers[1])
+        shutil.rmtree(self.tmp_dir)
+
+    def runs(self, worker_id):
+        path = os.path.join(self.tmp_dir, str(worker_id))
+        return len(open(path).read()) if os.path.exists(path) else 0
+
+    def test_restart_on_crash(self):
+        def worker_main(worker_id):
+            runs = self.runs(worker_id)
+            with open(os.path.join(self.tmp_dir, str(worker_id)), 'a') as f:
+                f.write('x')
+            if worker_id == 1 and runs == 0:
+                raise RuntimeError('crash')
+
+        Supervisor(2, worker_main, max_restarts=3).run()
+        self.assertEqual(self.runs(0), 1)
+        self.assertEqual(self.runs(1), 2)
+
+    def test_give_up_after_max_restarts(self):
+        def worker_main(worker_id):
+            with open(os.path.join(self.tmp_dir, str(worker_id)), 'a') as f:
+                f.write('x')
+            os._exit(1)
+
+        Supervisor(1, worker_main, max_restarts=2).run()
+        self.assertEqual(self.runs(0), 3)
+
+    def test_graceful_shutdown(self):
+        def worker_main(worker_id):
+            if worker_id == 0:
+                os.kill(os.getppid(), signal.SIGTERM)
+            time.sleep(60)  # killed by the forwarded SIGTERM
+
+        start = time.monotonic()
+        Supervisor(2, worker_main, shutdown_timeout=10).run()
+        self.assertLess(time.monotonic() - start, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
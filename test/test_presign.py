@@ -0,0 +1,168 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Add path of cwd to sys
+import json
+import shutil
+import datetime
+import tempfile
+import unittest
+import urllib.parse
+
+from tool.ObjectStore import S3ObjectStore, LocalObjectStore
+from tool.CredentialCache import CredentialCache
+from tool.ProfileCache import ProfileCache
+from tool.ImageCache import ImageCache
+from service import service_main
+from test.ServiceTestCase import ServiceTestCase
+
+# presigning is local, fake credentials are enough
+CREDENTIALS = {'AWS_ACCESS_KEY_ID': 'AKIDEXAMPLE', 'AWS_SECRET_ACCESS_KEY': 'secret', 'AWS_DEFAULT_REGION': 'us-east-1'}
+
+
+class OfflineS3Store(S3ObjectStore):
+    """ Real presigned urls, objects kept in memory instead of the bucket """
+
+    def __init__(self, bucket):
+        super().__init__(bucket=bucket, region_name='us-east-1', max_concurrency=2)
+        self.objects = {}
+        self.modified = {}  # key -> last modified time, now if not set
+
+    def _put(self, key, body, content_type):
+        self.objects[key] = (body, content_type)
+
+    def _delete(self, key):
+        self.objects.pop(key, None)
+
+    def _deleteMany(self, keys):
+        for key in keys:
+            self._delete(key)
+
+    def _head(self, key):
+        if key not in self.objects:
+            return None
+        body, content_type = self.objects[key]
+        return {'size': len(body), 'content_type': content_type, 'etag': None, 'last_modified': None}
+
+    def _listObjects(self, prefix):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return [{'key': key, 'size': len(body), 'last_modified': self.modified.get(key, now)}
+                for key, (body, _) in self.objects.items() if key.startswith(prefix)]
+
+
+class PresignTest(ServiceTestCase):
+    GLOBALS = ('CREDENTIAL_CACHE', 'PROFILE_CACHE', 'IMAGE_CACHE', 'OBJECT_STORE')
+
+    def setUp(self):
+        super(PresignTest, self).setUp()
+        self.saved_env = {name: os.environ.get(name) for name in CREDENTIALS}
+        os.environ.update(CREDENTIALS)
+
+        self.store = OfflineS3Store(bucket='bucket')
+        service_main.CREDENTIAL_CACHE = CredentialCache()
+        service_main.PROFILE_CACHE = ProfileCache()
+        service_main.IMAGE_CACHE = ImageCache()
+        service_main.OBJECT_STORE = self.store
+        self.user = self.createUser()
+
+    def tearDown(self):
+        self.store.close()
+        for name, value in self.saved_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        super(PresignTest, self).tearDown()
+
+    def request(self, path, body=None):
+        headers = self.authorization()
+        if body is None:
+            return self.fetch(path, headers=headers, follow_redirects=False)
+        return self.fetch(path, method='POST', headers=headers, body=json.dumps(body))
+
+    def upload(self, file_name, data):
+        response = self.request('/v1/user/self/pic:presign', {'file_name': file_name, 'content_type': 'image/png',
+                                                               'size': len(data)})
+        self.assertEqual(response.code, 200)
+        upload = json.loads(response.body)
+        # stands in for the client's PUT to S3
+        self.store.objects[upload['key']] = (data, upload['headers']['Content-Type'])
+        return upload
+
+    def test_presigned_put(self):
+        upload = self.upload('a.png', b'png data')
+        self.assertEqual(upload['method'], 'PUT')
+        self.assertTrue(upload['key'].startswith('bucket/{}/'.format(self.user.id)))
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(upload['url']).query)
+        self.assertEqual(query['X-Amz-SignedHeaders'], ['content-length;content-type;host'])
+        self.assertEqual(query['X-Amz-Expires'], [str(service_main.PICTURE_PRESIGN_EXPIRES)])
+        self.assertEqual(upload['headers'], {'Content-Type': 'image/png', 'Content-Length': '8'})
+
+    def test_presign_is_validated(self):
+        self.assertEqual(self.request('/v1/user/self/pic:presign',
+                                      {'file_name': '../a.png', 'content_type': 'image/png', 'size': 8}).code, 400)
+        self.assertEqual(self.request('/v1/user/self/pic:presign',
+                                      {'file_name': 'a.png', 'content_type': 'image/png'}).code, 400)
+        self.assertEqual(self.request('/v1/user/self/pic:presign',
+                                      {'file_name': 'a.png', 'content_type': 'image/png',
+                                       'size': service_main.PICTURE_MAX_SIZE + 1}).code, 413)
+
+    def test_commit_and_download(self):
+        self.assertEqual(self.request('/v1/user/self/pic:download').code, 404)
+        first = self.upload('a.png', b'png data')
+        second = self.upload('b.png', b'other png')
+
+        # not uploaded, not under the user's prefix
+        self.assertEqual(self.request('/v1/user/self/pic:commit', {'key': first['key'] + '.missing'}).code, 400)
+        self.assertEqual(self.request('/v1/user/self/pic:commit', {'key': 'bucket/other/x/a.png'}).code, 400)
+
+        response = self.request('/v1/user/self/pic:commit', {'key': first['key']})
+        self.assertEqual(response.code, 201)
+        self.assertEqual(json.loads(response.body)['file_name'], 'a.png')
+        self.assertEqual(self.request('/v1/user/self/pic:commit', {'key': second['key']}).code, 201)
+        self.assertNotIn(first['key'], self.store.objects)  # the replaced picture is deleted
+
+        response = self.request('/v1/user/self/pic:download')
+        self.assertEqual(response.code, 302)
+        location = urllib.parse.urlparse(response.headers['Location'])
+        self.assertTrue(location.path.endswith(second['key']))
+        self.assertIn('X-Amz-Signature', urllib.parse.parse_qs(location.query))
+
+    def test_commit_deletes_stale_uploads(self):
+        stale = self.upload('a.png', b'png data')
+        pending = self.upload('b.png', b'other png')
+        committed = self.upload('c.png', b'third png')
+        other_user = 'bucket/other/x/a.png'
+        self.store.objects[other_user] = (b'png data', 'image/png')
+        # the url of a.png expired long ago, b.png may still be on its way
+        long_ago = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+        self.store.modified.update({stale['key']: long_ago, other_user: long_ago})
+
+        self.assertEqual(self.request('/v1/user/self/pic:commit', {'key': committed['key']}).code, 201)
+        self.assertEqual(sorted(self.store.objects), sorted([pending['key'], committed['key'], other_user]))
+
+        # a commit of an old upload keeps the committed object
+        self.store.modified[pending['key']] = long_ago
+        self.assertEqual(self.request('/v1/user/self/pic:commit', {'key': pending['key']}).code, 201)
+        self.assertEqual(sorted(self.store.objects), sorted([pending['key'], other_user]))
+
+    def test_other_not_implemented_is_an_error(self):
+        def failing(*args):
+            raise NotImplementedError('not a missing capability')
+        self.store._presignPut = failing
+        self.assertEqual(self.request('/v1/user/self/pic:presign',
+                                      {'file_name': 'a.png', 'content_type': 'image/png', 'size': 8}).code, 500)
+
+    def test_store_without_presigned_urls(self):
+        root_dir = tempfile.mkdtemp()
+        service_main.OBJECT_STORE = LocalObjectStore(root_dir=root_dir)
+        try:
+            self.assertEqual(self.request('/v1/user/self/pic:presign',
+                                          {'file_name': 'a.png', 'content_type': 'image/png', 'size': 8}).code, 501)
+            self.assertEqual(self.request('/v1/user/self/pic:download').code, 501)
+        finally:
+            service_main.OBJECT_STORE.close()
+            shutil.rmtree(root_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
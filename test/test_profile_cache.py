@@ -0,0 +1,80 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Add path of cwd to sys
+import json
+import unittest
+
+from tornado.testing import AsyncTestCase, gen_test
+
+from tool import Serializer
+from tool.ProfileCache import ProfileCache
+from tool.LocalMysqlPool import LocalMysqlPool
+from dao.UserDAO import UserDAO
+
+
+class ProfileCacheTest(AsyncTestCase):
+    def setUp(self):
+        super(ProfileCacheTest, self).setUp()
+        self.pool = LocalMysqlPool(maxsize=2)
+        self.cache = ProfileCache(maxsize=10, ttl=30)
+        self.dao = UserDAO(connect_pool=self.pool.getPool(), profile_cache=self.cache)
+        # a worker process whose writes never reach self.cache
+        self.other_worker = UserDAO(connect_pool=self.pool.getPool())
+
+    def tearDown(self):
+        self.pool.closePool()
+        super(ProfileCacheTest, self).tearDown()
+
+    @gen_test
+    def test_rows_are_read_from_database(self):
+        yield self.dao.createUser('Jane', 'Doe', 'jane@example.com', 'hash')
+        user = yield self.dao.getUserContextByUsername('jane@example.com')
+        self.cache.etag(user)
+
+        yield self.other_worker.updateUser('Jane', 'Doe', 'jane@example.com', 'hash2')
+        yield self.other_worker.updateVerifiedByUsername('jane@example.com')
+        user = yield self.dao.getUserContextByUsername('jane@example.com')
+        self.assertEqual(user.password, 'hash2')
+        self.assertTrue(user.verified)
+        self.assertIsNone((yield self.dao.getUserContextByUsername('john@example.com')))
+
+    @gen_test
+    def test_body_is_memoized(self):
+        yield self.dao.createUser('Jane', 'Doe', 'jane@example.com', 'hash')
+        user = yield self.dao.getUserContextByUsername('jane@example.com')
+        etag = self.cache.etag(user)
+        body = self.cache.body(user)
+        self.assertEqual(body, Serializer.encodeUser(user))
+        self.assertNotIn('password', json.loads(body.decode()))
+
+        # the same row read by the next request
+        user = yield self.dao.getUserContextByUsername('jane@example.com')
+        self.assertEqual(self.cache.etag(user), etag)
+        self.assertIs(self.cache.body(user), body)
+        self.assertEqual((self.cache.stats()['hits'], self.cache.stats()['misses']), (1, 1))
+
+    @gen_test
+    def test_changed_row_is_encoded_again(self):
+        yield self.dao.createUser('Jane', 'Doe', 'jane@example.com', 'hash')
+        user = yield self.dao.getUserContextByUsername('jane@example.com')
+        etag = self.cache.etag(user)
+        self.cache.body(user)
+
+        yield self.other_worker.updateUser('Janet', 'Doe', 'jane@example.com', 'hash')
+        user = yield self.dao.getUserContextByUsername('jane@example.com')
+        self.assertNotEqual(self.cache.etag(user), etag)
+        self.assertEqual(json.loads(self.cache.body(user).decode())['first_name'], 'Janet')
+
+    @gen_test
+    def test_writes_invalidate(self):
+        yield self.dao.createUser('Jane', 'Doe', 'jane@example.com', 'hash')
+        user = yield self.dao.getUserContextByUsername('jane@example.com')
+        self.cache.etag(user)
+        self.assertEqual(self.cache.stats()['size'], 1)
+
+        yield self.dao.updateVerifiedByUsername('jane@example.com')
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
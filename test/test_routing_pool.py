@@ -0,0 +1,183 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Add path of cwd to sys
+import json
+import asyncio
+import unittest
+
+from tornado.testing import AsyncTestCase, gen_test
+
+from tool.RoutingPool import RoutingPool, reads
+from tool.ObservedPool import ObservedPool
+from tool.LocalMysqlPool import LocalMysqlPool
+from dao.UserDAO import UserDAO
+from dao.ExportDAO import ExportDAO
+from tool.CredentialCache import CredentialCache
+from tool.ProfileCache import ProfileCache
+from service import service_main
+from test.ServiceTestCase import ServiceTestCase, USERNAME
+
+
+class DownPool(object):
+    name = 'down_replica'
+
+    def __init__(self):
+        self.attempts = 0
+
+    async def acquire(self):
+        self.attempts += 1
+        raise ConnectionRefusedError('replica is down')
+
+
+class RoutingPoolTest(AsyncTestCase):
+    def setUp(self):
+        super(RoutingPoolTest, self).setUp()
+        # two independent databases, nothing is replicated from the primary to the replica
+        self.local = LocalMysqlPool(maxsize=2, replica_paths=[':memory:'])
+        self.primary = ObservedPool(self.local.getPool(), name='primary')
+        self.replica = ObservedPool(self.local.replica_pools[0], name='replica')
+
+    def tearDown(self):
+        self.local.closePool()
+        super(RoutingPoolTest, self).tearDown()
+
+    @gen_test
+    async def test_reads_go_to_the_replica(self):
+        pool = RoutingPool(self.primary, [self.replica])
+        self.local.getPool().db.execute("INSERT INTO user (id, username, verified) VALUES ('1', 'jane@example.com', 1)")
+        dao = UserDAO(connect_pool=pool)
+
+        self.assertFalse((await dao.usernameExist('jane@example.com')))
+        self.assertEqual(pool.routes['replica'], 1)
+
+    @gen_test
+    async def test_streaming_reads(self):
+        pool = RoutingPool(self.primary, [self.replica])
+        self.local.replica_pools[0].db.execute("INSERT INTO user (id, username) VALUES ('1', 'jane@example.com')")
+        dao = UserDAO(connect_pool=pool)
+
+        pages = ExportDAO(connect_pool=pool).streamTable('user', page_size=1)
+        self.assertEqual([row[0] for row in (await pages.__anext__())], ['1'])
+        # the consumer runs outside the route of the export, its own writes go to the primary
+        self.assertTrue((await dao.createUser('John', 'Doe', 'john@example.com', 'hash'))[0])
+        self.assertEqual([rows async for rows in pages], [])
+        self.assertEqual((pool.routes['replica'], pool.routes['primary']), (2, 1))
+
+    @gen_test
+    async def test_read_your_writes(self):
+        pool = RoutingPool(self.primary, [self.replica], sticky_window=0.05)
+        dao = UserDAO(connect_pool=pool)
+
+        is_success, _ = await dao.createUser('Jane', 'Doe', 'jane@example.com', 'hash')
+        self.assertTrue(is_success)
+        self.assertTrue((await dao.usernameExist('jane@example.com')))
+        self.assertFalse((await dao.usernameExist('john@example.com')))
+        self.assertEqual((pool.routes['sticky'], pool.routes['replica']), (1, 1))
+
+        await asyncio.sleep(0.06)
+        self.assertFalse((await dao.usernameExist('jane@example.com')))
+
+    @gen_test
+    async def test_writes_of_another_worker(self):
+        clock = [0]
+        worker_a = RoutingPool(self.primary, [self.replica], sticky_window=5, clock=lambda: clock[0])
+        worker_b = RoutingPool(self.primary, [self.replica], sticky_window=5, clock=lambda: clock[0])
+        await UserDAO(connect_pool=worker_a).createUser('Jane', 'Doe', 'jane@example.com', 'hash')
+        dao = UserDAO(connect_pool=worker_b)
+        self.assertFalse((await dao.usernameExist('jane@example.com')))
+
+        worker_b.markWritten(['jane@example.com'], ttl=60)  # never longer than the window
+        self.assertTrue((await dao.usernameExist('jane@example.com')))
+        clock[0] = 5
+        self.assertFalse((await dao.usernameExist('jane@example.com')))
+
+    @gen_test
+    async def test_bulk_writes_are_sticky(self):
+        pool = RoutingPool(self.primary, [self.replica])
+        dao = UserDAO(connect_pool=pool)
+
+        results = await dao.createUsers([('Jane', 'Doe', 'jane@example.com', 'hash'), ('John', 'Doe', 'john@example.com', 'hash')])
+        self.assertEqual([is_success for is_success, _ in results], [True, True])
+        self.assertTrue((await dao.usernameExist('jane@example.com')))
+        self.assertTrue((await dao.usernameExist('john@example.com')))
+        self.assertEqual(pool.routes['sticky'], 2)
+
+    @gen_test
+    async def test_fallback_to_primary(self):
+        clock = [0]
+        down = DownPool()
+        pool = RoutingPool(self.primary, [down], retry_interval=10, clock=lambda: clock[0])
+        self.local.getPool().db.execute("INSERT INTO user (id, username, verified) VALUES ('1', 'jane@example.com', 1)")
+        dao = UserDAO(connect_pool=pool)
+
+        self.assertTrue((await dao.usernameExist('jane@example.com')))
+        self.assertTrue((await dao.usernameExist('jane@example.com')))
+        self.assertEqual((down.attempts, pool.routes['fallback']), (1, 2))
+
+        # tried again after retry_interval
+        clock[0] = 11
+        self.assertTrue((await dao.usernameExist('jane@example.com')))
+        self.assertEqual((down.attempts, pool.routes['fallback']), (2, 3))
+
+    @gen_test
+    async def test_undeclared_methods_use_the_primary(self):
+        pool = RoutingPool(self.primary, [self.replica])
+
+        async def query():
+            async with pool.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute("SELECT 1")
+
+        await query()
+        await reads()(query)()
+        self.assertEqual((pool.routes['primary'], pool.routes['replica']), (1, 1))
+        self.assertEqual((self.primary.acquires, self.replica.acquires), (1, 1))
+
+
+class WorkerPool(object):
+    """ MYSQL_CONN_POOL of one worker process, its own RoutingPool over the shared databases """
+
+    def __init__(self, local):
+        self.pool = RoutingPool(ObservedPool(local.getPool(), name='primary'),
+                                [ObservedPool(local.replica_pools[0], name='replica')])
+
+    def getPool(self):
+        return self.pool
+
+
+class StickyCookieTest(ServiceTestCase):
+    GLOBALS = ('CREDENTIAL_CACHE', 'PROFILE_CACHE')
+
+    def setUp(self):
+        super(StickyCookieTest, self).setUp()
+        self.pool.closePool()
+        # the replica lags: it has the user, but none of the following writes
+        self.pool = LocalMysqlPool(maxsize=2, replica_paths=[':memory:'])
+        user = self.createUser()
+        user.verified = True
+        self.pool.replica_pools[0].db.execute("INSERT INTO user VALUES (?, ?, ?, ?, ?, ?, ?, ?)", user.toRow())
+        service_main.CREDENTIAL_CACHE = CredentialCache()
+        service_main.PROFILE_CACHE = ProfileCache()
+        service_main.MYSQL_CONN_POOL = WorkerPool(self.pool)
+
+    def firstName(self, **headers):
+        response = self.fetch('/v1/user/self', headers=dict(self.authorization(), **headers))
+        return json.loads(response.body)['first_name']
+
+    def test_read_your_writes_on_another_worker(self):
+        response = self.fetch('/v1/user/self', method='PUT', headers=self.authorization(),
+                              body=json.dumps({'first_name': 'Janet', 'username': USERNAME}))
+        self.assertEqual(response.code, 204)
+        cookie = response.headers['Set-Cookie'].split(';')[0]
+        self.assertTrue(cookie.startswith('read_primary_until='))
+
+        service_main.MYSQL_CONN_POOL = WorkerPool(self.pool)  # the next request reaches another worker
+        self.assertEqual(self.firstName(), 'Jane')  # from the replica
+        self.assertEqual(self.firstName(Cookie=cookie), 'Janet')
+
+        service_main.MYSQL_CONN_POOL = WorkerPool(self.pool)
+        self.assertEqual(self.firstName(Cookie='read_primary_until=1'), 'Jane')  # window is over
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Add path of cwd to sys
+import json
+import datetime
+import unittest
+
+from tool import Serializer
+from tool.Config import Config
+from tool.UserContext import UserContext
+from tool.ImageRecord import ImageRecord
+
+CREATED = datetime.datetime(2021, 3, 4, 5, 6, 7, 891011)
+
+
+class SerializerTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = Config.getInstance().get('JSON_BACKEND')
+        self.user = UserContext('1', 'Zoë', 'Doe', 'zoe@example.com', 'hash', CREATED, CREATED, True)
+        self.image = ImageRecord('2', 'a.png', '1', 'bucket/1/a.png', CREATED.date())
+
+    def tearDown(self):
+        Config.getInstance().update({'JSON_BACKEND': self.saved})
+
+    def test_dates_are_formatted_at_encode_time(self):
+        body = json.loads(Serializer.encodeUser(self.user).decode())
+        self.assertEqual(body['account_created'], CREATED.strftime(Serializer.DATETIME_FORMAT))
+        self.assertEqual(body, {'id': '1', 'first_name': 'Zoë', 'last_name': 'Doe', 'username': 'zoe@example.com',
+                                'account_created': CREATED.strftime(Serializer.DATETIME_FORMAT),
+                                'account_updated': CREATED.strftime(Serializer.DATETIME_FORMAT), 'verified': True})
+        self.assertNotIn('password', body)
+        self.assertEqual(json.loads(Serializer.encodeImage(self.image).decode())['upload_date'], '2021-03-04')
+
+    @unittest.skipIf(Serializer.orjson is None, 'orjson is not installed')
+    def test_backends_give_the_same_bytes(self):
+        for fields in (Serializer.userFields(self.user), Serializer.imageFields(self.image), {'line': 1, 'user': None}):
+            self.assertEqual(Serializer._orjsonDumps(fields), Serializer._stdlibDumps(fields))
+
+    def test_backend_choice(self):
+        Config.getInstance().update({'JSON_BACKEND': 'json'})
+        self.assertEqual(Serializer.backendName(), 'json')
+        Config.getInstance().update({'JSON_BACKEND': 'auto'})
+        self.assertEqual(Serializer.backendName(), 'orjson' if Serializer.orjson is not None else 'json')
+
+    def test_unknown_types_are_rejected(self):
+        with self.assertRaises(TypeError):
+            Serializer._stdlibDumps({'user': self.user})
+
+
+if __name__ == '__main__':
+    unittest.main()
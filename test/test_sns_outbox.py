@@ -0,0 +1,81 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Add path of cwd to sys
+import shutil
+import tempfile
+import unittest
+
+from tornado.testing import AsyncTestCase, gen_test
+
+from tool.SnsOutbox import SnsOutbox, LocalPublisher
+
+
+class SnsOutboxTest(AsyncTestCase):
+    def setUp(self):
+        super(SnsOutboxTest, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.spill_path = os.path.join(self.tmp_dir, 'outbox.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        super(SnsOutboxTest, self).tearDown()
+
+    @gen_test
+    def test_batching(self):
+        publisher = LocalPublisher()
+        outbox = SnsOutbox(publisher)
+        outbox.start()
+        for i in range(25):
+            self.assertTrue(outbox.enqueue({'email': '{}@gmail.com'.format(i)}))
+        yield outbox.stop()
+
+        self.assertEqual([len(batch) for batch in publisher.batches], [10, 10, 5])
+        self.assertEqual(publisher.messages[24], {'email': '24@gmail.com'})
+
+    @gen_test
+    def test_retry(self):
+        publisher = LocalPublisher(fail_times=2)
+        outbox = SnsOutbox(publisher, backoff=0.01)
+        outbox.start()
+        outbox.enqueue({'email': 'a@gmail.com'})
+        yield outbox.stop()
+
+        self.assertEqual(publisher.messages, [{'email': 'a@gmail.com'}])
+
+    @gen_test
+    def test_spill_recovery(self):
+        # publisher keeps failing, the message stays in the spill file
+        outbox = SnsOutbox(LocalPublisher(fail_times=100), max_retries=0, spill_path=self.spill_path)
+        outbox.start()
+        outbox.enqueue({'email': 'a@gmail.com'})
+        outbox.enqueue({'email': 'b@gmail.com'})
+        yield outbox.stop()
+
+        publisher = LocalPublisher()
+        outbox = SnsOutbox(publisher, spill_path=self.spill_path)
+        outbox.start()
+        yield outbox.stop()
+        self.assertEqual(publisher.messages, [{'email': 'a@gmail.com'}, {'email': 'b@gmail.com'}])
+
+        # everything was acked, nothing is replayed again
+        publisher = LocalPublisher()
+        outbox = SnsOutbox(publisher, spill_path=self.spill_path)
+        outbox.start()
+        yield outbox.stop()
+        self.assertEqual(publisher.batches, [])
+
+
+    @gen_test
+    def test_enqueue_many(self):
+        publisher = LocalPublisher()
+        outbox = SnsOutbox(publisher, maxsize=20, spill_path=self.spill_path)
+        outbox.start()
+        self.assertEqual(outbox.enqueueMany([{'email': '{}@gmail.com'.format(i)} for i in range(25)]), 20)
+        with open(self.spill_path, encoding='utf-8') as f:
+            self.assertEqual(len(f.readlines()), 20)
+        yield outbox.stop()
+        self.assertEqual(len(publisher.messages), 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
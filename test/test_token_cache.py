@@ -0,0 +1,84 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Add path of cwd to sys
+import time
+import unittest
+
+import jwt
+
+from tool.TokenCache import VerifiedTokenCache
+from tool.JwtAuth import createToken, parsePayload
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class VerifiedTokenCacheTest(unittest.TestCase):
+    def test_expires_at_exp(self):
+        clock = FakeClock()
+        cache = VerifiedTokenCache(maxsize=10, max_ttl=300, clock=clock)
+        payload = {'username': 'jane@example.com', 'exp': 1010}
+        cache.add('token-a', payload)
+        self.assertIs(cache.get('token-a'), payload)
+        self.assertIsNone(cache.get('token-b'))
+        clock.now = 1010
+        self.assertIsNone(cache.get('token-a'))
+
+    def test_max_ttl_and_expired_tokens(self):
+        clock = FakeClock()
+        cache = VerifiedTokenCache(maxsize=10, max_ttl=5, clock=clock)
+        cache.add('token-a', {'exp': 2000})
+        cache.add('token-b', {})  # no exp claim, max_ttl only
+        cache.add('token-c', {'exp': 1000})
+        self.assertIsNotNone(cache.get('token-a'))
+        self.assertIsNotNone(cache.get('token-b'))
+        self.assertIsNone(cache.get('token-c'))
+        clock.now = 1005
+        self.assertIsNone(cache.get('token-a'))
+        self.assertIsNone(cache.get('token-b'))
+
+    def test_maxsize(self):
+        cache = VerifiedTokenCache(maxsize=2, max_ttl=300)
+        for token in ('token-a', 'token-b', 'token-c'):
+            cache.add(token, {'username': token})
+        self.assertIsNone(cache.get('token-a'))
+        self.assertEqual(cache.stats()['size'], 2)
+
+
+class ParsePayloadTest(unittest.TestCase):
+    def test_repeated_token_skips_decode(self):
+        cache = VerifiedTokenCache(maxsize=10)
+        token = createToken(payload={'username': 'jane@example.com', 'password': 'hash'})
+        first = parsePayload(token, cache=cache)
+        self.assertTrue(first['status'])
+        second = parsePayload(token, cache=cache)
+        self.assertTrue(second['status'])
+        self.assertIs(second['data'], first['data'])
+
+        # a tampered token is still verified, and rejected
+        self.assertFalse(parsePayload(token[:-2] + 'xx', cache=cache)['status'])
+
+    def test_rejected_after_expiry(self):
+        clock = FakeClock()
+        cache = VerifiedTokenCache(maxsize=10, clock=clock)
+        exp = int(time.time()) - 1
+        token = jwt.encode({'username': 'jane@example.com', 'exp': exp}, key="laiweifeng233", algorithm='HS256')
+        self.assertFalse(parsePayload(token, cache=cache)['status'])
+
+        # verified while it was valid, then its exp passes
+        clock.now = exp - 10
+        cache.add(token, {'username': 'jane@example.com', 'exp': exp})
+        self.assertTrue(parsePayload(token, cache=cache)['status'])
+        clock.now = exp
+        result = parsePayload(token, cache=cache)
+        self.assertFalse(result['status'])
+        self.assertEqual(result['error'], 'token已失效')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Add path of cwd to sys
+import shutil
+import tempfile
+import unittest
+
+from tool.TokenReplayStore import MemoryReplayStore, SqliteReplayStore, ReplayStoreFullError
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class MemoryReplayStoreTest(unittest.TestCase):
+    def test_replay_until_exp(self):
+        clock = FakeClock()
+        store = MemoryReplayStore(maxsize=10, clock=clock)
+        self.assertTrue(store.markUsed('token-a', 1010))
+        self.assertFalse(store.markUsed('token-a', 1010))
+        clock.now = 1010
+        self.assertTrue(store.markUsed('token-b', 1020))
+        self.assertEqual(len(store), 1)
+
+    def test_maxsize(self):
+        clock = FakeClock()
+        store = MemoryReplayStore(maxsize=2, clock=clock)
+        store.markUsed('token-a', 1100)
+        store.markUsed('token-b', 1050)
+        with self.assertRaises(ReplayStoreFullError):
+            store.markUsed('token-c', 1200)  # no used token is forgotten to make room
+        self.assertEqual(len(store), 2)
+        self.assertFalse(store.markUsed('token-a', 1100))
+        self.assertFalse(store.markUsed('token-b', 1050))
+
+        clock.now = 1050  # token-b expired
+        self.assertTrue(store.markUsed('token-c', 1200))
+        self.assertFalse(store.markUsed('token-c', 1200))
+
+    def test_retention_is_capped(self):
+        clock = FakeClock()
+        store = MemoryReplayStore(maxsize=10, max_ttl=60, clock=clock)
+        self.assertTrue(store.markUsed('token-a', 1000 + 10 ** 12))  # exp claims of minted tokens are far away
+        clock.now = 1059
+        self.assertFalse(store.markUsed('token-a', 1000 + 10 ** 12))
+        clock.now = 1060
+        store.markUsed('token-b', 1100)
+        self.assertEqual(len(store), 1)
+
+
+class SqliteReplayStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'used_token.sqlite3')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_shared_between_stores(self):
+        clock = FakeClock()
+        worker_a = SqliteReplayStore(self.path, clock=clock)
+        worker_b = SqliteReplayStore(self.path, clock=clock)
+        self.assertTrue(worker_a.markUsed('token-a', 1010))
+        self.assertFalse(worker_b.markUsed('token-a', 1010))
+        worker_a.close()
+        worker_b.close()
+
+    def test_retention_is_capped(self):
+        clock = FakeClock()
+        store = SqliteReplayStore(self.path, prune_interval=0, max_ttl=60, clock=clock)
+        self.assertTrue(store.markUsed('token-a', 1000 + 10 ** 12))
+        clock.now = 1060
+        store.markUsed('token-b', 1100)  # prunes token-a
+        self.assertEqual(store._conn().execute("SELECT COUNT(*) FROM used_token").fetchone()[0], 1)
+        store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Add path of cwd to sys
+import unittest
+
+from tornado.testing import AsyncTestCase, gen_test
+
+from tool.VerificationStore import LocalVerificationStore
+
+
+class LocalVerificationStoreTest(AsyncTestCase):
+    def setUp(self):
+        super(LocalVerificationStoreTest, self).setUp()
+        self.store = LocalVerificationStore()
+
+    def tearDown(self):
+        self.store.close()
+        super(LocalVerificationStoreTest, self).tearDown()
+
+    @gen_test
+    def test_ttl(self):
+        yield self.store.putRecord('a@gmail.com', 'token-a', ttl_seconds=60)
+        yield self.store.putRecord('b@gmail.com', 'token-b', ttl_seconds=-1)
+
+        record = yield self.store.getRecord('a@gmail.com')
+        self.assertEqual(record['token'], 'token-a')
+        self.assertIsNone((yield self.store.getRecord('b@gmail.com')))
+        self.assertIsNone((yield self.store.getRecord('c@gmail.com')))
+
+    @gen_test
+    def test_expire_stale(self):
+        for i in range(7):
+            yield self.store.putRecord('{}@gmail.com'.format(i), 'token', ttl_seconds=-1)
+        yield self.store.putRecord('live@gmail.com', 'token', ttl_seconds=60)
+
+        self.assertEqual((yield self.store.expireStale(batch_size=3)), 7)
+        self.assertIsNotNone((yield self.store.getRecord('live@gmail.com')))
+
+
+if __name__ == '__main__':
+    unittest.main()
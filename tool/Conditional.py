@@ -0,0 +1,77 @@
+import hashlib
+import datetime
+import email.utils
+
+from tool.Serializer import userFields, imageFields
+
+
+def _versionTag(fields: dict) -> str:
+    # strong validator: digest of every field of the body, computed without encoding the body
+    digest = hashlib.blake2b('\x1f'.join(str(value) for value in fields.values()).encode(), digest_size=12)
+    return '"{}"'.format(digest.hexdigest())
+
+
+def userEtag(user) -> str:
+    return _versionTag(userFields(user))
+
+
+def imageEtag(image) -> str:
+    return _versionTag(imageFields(image))
+
+
+def lastModified(stamp: datetime.datetime, resolution: datetime.timedelta, now: datetime.datetime = None):
+    """
+    Last-Modified of a row whose version stamp only has the given resolution (account_updated: a second,
+    upload_date: a day). Another change within the same interval would keep the stamp, so the row counts as
+    modified until its interval is over, but never later than now.
+    :param stamp: naive local time, as the DAOs store it
+    :return: aware datetime
+    """
+    now = now or datetime.datetime.now()
+    return min(stamp + resolution, now).astimezone()
+
+
+def userLastModified(user, now: datetime.datetime = None):
+    return lastModified(user.account_updated, datetime.timedelta(seconds=1), now)
+
+
+def imageLastModified(image, now: datetime.datetime = None):
+    return lastModified(datetime.datetime.combine(image.upload_date, datetime.time()), datetime.timedelta(days=1), now)
+
+
+def parseHttpDate(value: str):
+    """ :return: aware datetime, None if value is not an HTTP date """
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if parsed is None or parsed.tzinfo is None:
+        return None
+    return parsed
+
+
+def parseRange(header: str, size: int):
+    """
+    Single byte range of a Range header (RFC 7233), multiple and malformed ranges are ignored,
+    the whole object is served then
+    :return: (start, end) with end exclusive, None to serve the whole object
+    :raise ValueError: the range is not satisfiable, answer 416
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    first, dash, last = header[len('bytes='):].strip().partition('-')
+    if not dash or not (first.isdigit() or first == '') or not (last.isdigit() or last == '') or first == last == '':
+        return None
+
+    if first == '':
+        # suffix range, the last bytes
+        if int(last) == 0 or size == 0:
+            raise ValueError('range {} of {} bytes is empty'.format(header, size))
+        return max(0, size - int(last)), size
+
+    start = int(first)
+    if last != '' and int(last) < start:
+        return None
+    if start >= size:
+        raise ValueError('range {} starts after {} bytes'.format(header, size))
+    return start, min(int(last) + 1 if last != '' else size, size)
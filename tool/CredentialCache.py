@@ -0,0 +1,46 @@
+import os
+import hmac
+import hashlib
+
+from tool.LruCache import LruCache
+
+
+class CredentialCache(object):
+    """
+    Remember Basic auth credentials that already passed bcrypt verification,
+    so repeated requests from the same client skip checkSame().
+
+    An entry is keyed by username and holds a keyed digest (HMAC-SHA256 with a per-process
+    random key) of the presented password together with the stored bcrypt hash it was
+    verified against. Plain passwords are never kept in memory.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 300, statsd_conn=None):
+        self.__key = os.urandom(32)
+        self.__cache = LruCache(maxsize=maxsize, ttl=ttl, name='credential_cache', statsd_conn=statsd_conn)
+
+    def __digest(self, username: str, password: str) -> bytes:
+        msg = username.encode() + b'\x00' + password.encode()
+        return hmac.new(self.__key, msg, hashlib.sha256).digest()
+
+    def check(self, username: str, password: str, hashed: str) -> bool:
+        # hit only if the same password was verified against the same stored hash
+        entry = self.__cache.peek(username)
+        if entry is not None:
+            digest, verified_hash = entry
+            if verified_hash == hashed and hmac.compare_digest(digest, self.__digest(username, password)):
+                self.__cache.recordHit()
+                return True
+
+        self.__cache.recordMiss()
+        return False
+
+    def add(self, username: str, password: str, hashed: str):
+        self.__cache.set(username, (self.__digest(username, password), hashed))
+
+    def invalidate(self, username: str):
+        if username is not None:
+            self.__cache.invalidate(username)
+
+    def stats(self) -> dict:
+        return self.__cache.stats()
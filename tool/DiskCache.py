@@ -0,0 +1,147 @@
+import os
+import time
+import uuid
+import shutil
+import asyncio
+import hashlib
+from collections import OrderedDict, namedtuple
+
+from tool.Logger import Logger
+
+# fd is opened for the caller, the file stays readable through it even if the entry is evicted meanwhile
+CachedFile = namedtuple('CachedFile', ('fd', 'size', 'etag'))
+
+_Entry = namedtuple('_Entry', ('path', 'size', 'etag', 'expire_at'))
+
+
+class DiskCache(object):
+    """
+    Bounded LRU cache of objects (e.g. profile pictures) as files in root_dir, for this process only.
+    At most max_bytes of objects are kept, the least recently used are deleted first.
+    Concurrent misses of one key load it once.
+
+    Like the in-memory caches, invalidate() only reaches this process, other worker processes
+    may serve the old object for up to ttl seconds.
+    root_dir is emptied on start, entries of a previous run are not trusted.
+    """
+
+    def __init__(self, root_dir: str, max_bytes: int = 256 * 1024 * 1024, ttl: float = 300, name: str = 'disk_cache',
+                 statsd_conn=None, clock=time.monotonic):
+        self.root_dir = os.path.abspath(root_dir)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.name = name
+        self.statsd_conn = statsd_conn
+        self.clock = clock
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.__entries = OrderedDict()  # key -> _Entry
+        self.__bytes = 0
+        self.__loading = {}  # key -> future resolved when the load is done
+        self.__generation = 0  # bumped by every invalidation
+
+        shutil.rmtree(self.root_dir, ignore_errors=True)
+        os.makedirs(self.root_dir)
+
+    def __incr(self, stat: str):
+        if self.statsd_conn is not None:
+            self.statsd_conn.incr('{name}.{stat}'.format(name=self.name, stat=stat))
+
+    def __lookup(self, key):
+        entry = self.__entries.get(key)
+        if entry is None:
+            return None
+        if entry.expire_at <= self.clock():
+            self.__remove(key)
+            return None
+        try:
+            fd = os.open(entry.path, os.O_RDONLY)
+        except FileNotFoundError:
+            self.__remove(key)
+            return None
+        self.__entries.move_to_end(key)
+        return CachedFile(fd, entry.size, entry.etag)
+
+    def __remove(self, key):
+        entry = self.__entries.pop(key, None)
+        if entry is not None:
+            self.__bytes -= entry.size
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def __write(self, data: bytes):
+        # on the executor: write a new file and digest the content
+        path = os.path.join(self.root_dir, uuid.uuid4().hex)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path, '"{}"'.format(hashlib.blake2b(data, digest_size=16).hexdigest())
+
+    async def open(self, key: str, load):
+        """
+        :param load: coroutine function loading the object bytes of key on a miss, None if there is no such object
+        :return: CachedFile, the caller closes its fd. None if there is no such object
+        """
+        while True:
+            cached = self.__lookup(key)
+            if cached is not None:
+                self.hits += 1
+                self.__incr('hit')
+                return cached
+            loading = self.__loading.get(key)
+            if loading is None:
+                break
+            await loading  # then look it up again
+
+        self.misses += 1
+        self.__incr('miss')
+        loading = self.__loading[key] = asyncio.get_event_loop().create_future()
+        generation = self.__generation
+        try:
+            data = await load(key)
+            if data is None:
+                return None
+            path, etag = await asyncio.get_event_loop().run_in_executor(None, self.__write, data)
+            fd = os.open(path, os.O_RDONLY)
+            if generation != self.__generation:
+                # invalidated while loading, serve this request but don't keep the file
+                os.remove(path)
+            else:
+                self.__remove(key)
+                self.__entries[key] = _Entry(path, len(data), etag, self.clock() + self.ttl)
+                self.__bytes += len(data)
+                self.__evict()
+            return CachedFile(fd, len(data), etag)
+        finally:
+            del self.__loading[key]
+            loading.set_result(None)
+
+    def __evict(self):
+        # the newest entry stays even if it is larger than max_bytes on its own
+        while self.__bytes > self.max_bytes and len(self.__entries) > 1:
+            key = next(iter(self.__entries))
+            self.__remove(key)
+            self.evictions += 1
+            self.__incr('eviction')
+            Logger.getInstance().debug('{}: evicted [{}]'.format(self.name, key))
+
+    def invalidate(self, key: str):
+        self.__generation += 1
+        if key is not None:
+            self.__remove(key)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.__entries),
+            'bytes': self.__bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': (self.hits / lookups) if lookups else 0.0,
+        }
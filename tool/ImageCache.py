@@ -0,0 +1,52 @@
+from tool.LruCache import LruCache
+from tool.Serializer import encodeImage
+from tool.Conditional import imageEtag
+
+
+class ImageCache(object):
+    """
+    Serialized GET /v1/user/self/pic bodies and their ETags, keyed by user id, so a hit skips the JSON encoding
+    and the digest.
+
+    The image row itself is not cached: the content, download and commit routes need the current url,
+    and invalidation only reaches this process. The row is read on every request, an entry is used only
+    if it was built from an identical row, so an upload or delete handled by another worker never gets an old body.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 30, statsd_conn=None):
+        self.__cache = LruCache(maxsize=maxsize, ttl=ttl, name='image_cache', statsd_conn=statsd_conn)
+
+    def __entry(self, image, count: bool):
+        row = image.toRow()
+        entry = self.__cache.peek(image.user_id)
+        if entry is not None and entry[0] == row:
+            if count:
+                self.__cache.recordHit()
+            return entry
+        if count:
+            self.__cache.recordMiss()
+        entry = [row, None, None]
+        self.__cache.set(image.user_id, entry)
+        return entry
+
+    def etag(self, image) -> str:
+        """ ETag of the body of image, every GET asks for it first, so hits and misses are counted here """
+        entry = self.__entry(image, count=True)
+        if entry[2] is None:
+            entry[2] = imageEtag(image)
+        return entry[2]
+
+    def body(self, image) -> bytes:
+        """ Serialized response body of image """
+        entry = self.__entry(image, count=False)
+        if entry[1] is None:
+            entry[1] = encodeImage(image)
+        return entry[1]
+
+    def invalidate(self, user_id: str):
+        # not needed for correctness, entries of an old row are never used, frees them early
+        if user_id is not None:
+            self.__cache.invalidate(user_id)
+
+    def stats(self) -> dict:
+        return self.__cache.stats()
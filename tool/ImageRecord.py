@@ -0,0 +1,23 @@
+import datetime
+
+
+class ImageRecord(object):
+    """ Image metadata row of a user, upload_date is formatted only when the response is encoded, see tool.Serializer.encodeImage """
+    __slots__ = ('id', 'file_name', 'user_id', 'url', 'upload_date')
+
+    # column order of the image row, see ImageDAO
+    COLUMNS = "id, file_name, user_id, url, upload_date"
+
+    def __init__(self, id: str, file_name: str, user_id: str, url: str, upload_date: datetime.date):
+        self.id = id
+        self.file_name = file_name
+        self.user_id = user_id
+        self.url = url
+        self.upload_date = upload_date
+
+    @classmethod
+    def fromRow(cls, row):
+        return cls(*row)
+
+    def toRow(self) -> tuple:
+        return self.id, self.file_name, self.user_id, self.url, self.upload_date
@@ -21,19 +21,29 @@ def createToken(payload, timeout=20) -> str:
     return result
 
 
-def parsePayload(token) -> dict:
+def parsePayload(token, cache=None) -> dict:
     """
     对token进行和发行校验并获取payload
     :param token:
+    :param cache: tool.TokenCache.VerifiedTokenCache, a token verified before skips jwt.decode until its exp
     :return:
     """
     result = {'status': False, 'data': None, 'error': None}
+    if cache is not None:
+        cached_payload = cache.get(token)
+        if cached_payload is not None:
+            result['status'] = True
+            result['data'] = cached_payload
+            return result
+
     key = "laiweifeng233"
     algorithms = ['HS256']
     try:
         verified_payload = jwt.decode(jwt=token, key=key, algorithms=algorithms)
         result['status'] = True
         result['data'] = verified_payload
+        if cache is not None:
+            cache.add(token, verified_payload)
     except exceptions.ExpiredSignatureError:
         result['error'] = 'token已失效'
     except jwt.DecodeError:
@@ -0,0 +1,221 @@
+import re
+import asyncio
+import sqlite3
+import datetime
+
+import aiomysql
+
+# schema of the csye6225 database, as far as the DAOs use it
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS user ("
+    "id TEXT PRIMARY KEY, first_name TEXT, last_name TEXT, username TEXT UNIQUE NOT NULL, password TEXT, "
+    "account_created MYSQL_DATETIME, account_updated MYSQL_DATETIME, verified INTEGER DEFAULT 0)",
+    "CREATE TABLE IF NOT EXISTS image ("
+    "id TEXT PRIMARY KEY, file_name TEXT, url TEXT, user_id TEXT UNIQUE NOT NULL, upload_date MYSQL_DATE)",
+)
+
+sqlite3.register_converter('MYSQL_DATETIME', lambda b: datetime.datetime.strptime(b.decode(), "%Y-%m-%d %H:%M:%S"))
+sqlite3.register_converter('MYSQL_DATE', lambda b: datetime.datetime.strptime(b.decode(), "%Y-%m-%d").date())
+# bind dates the way MySQL stores them, without microseconds
+sqlite3.register_adapter(datetime.datetime, lambda d: d.strftime("%Y-%m-%d %H:%M:%S"))
+sqlite3.register_adapter(datetime.date, lambda d: d.strftime("%Y-%m-%d"))
+
+_FOR_UPDATE = re.compile(r'\s+FOR\s+UPDATE\s*$', re.IGNORECASE)
+
+
+def translateSql(query: str) -> str:
+    """ MySQL statement of the DAOs -> SQLite statement """
+    return _FOR_UPDATE.sub('', query).replace('%s', '?')
+
+
+class _LocalCursor(object):
+    """ The subset of aiomysql.Cursor the DAOs use, an unbuffered one (SSCursor) fetches rows as they are read """
+
+    def __init__(self, connection, unbuffered: bool = False):
+        self.connection = connection
+        self.unbuffered = unbuffered
+        self.rowcount = -1
+        self.__rows = []
+        self.__position = 0
+        self.__stream = None  # sqlite cursor of an unbuffered SELECT
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def execute(self, query, args=None):
+        pool = self.connection.pool
+        if pool.query_latency > 0:
+            await asyncio.sleep(pool.query_latency)  # network round trip to the database
+
+        cursor = pool.db.execute(translateSql(query), tuple(args or ()))
+        if self.unbuffered and cursor.description is not None:
+            self.__rows = []
+            self.__position = 0
+            self.__stream = cursor
+            self.rowcount = -1  # unknown until every row is read, like MySQL
+            return 0
+        self.__stream = None
+        self.__rows = cursor.fetchall() if cursor.description is not None else []
+        self.__position = 0
+        self.rowcount = cursor.rowcount if cursor.description is None else len(self.__rows)
+        return self.rowcount
+
+    async def executemany(self, query, args):
+        pool = self.connection.pool
+        if pool.query_latency > 0:
+            await asyncio.sleep(pool.query_latency)
+
+        # one transaction like MySQL's multi-row INSERT, all rows or none
+        pool.db.execute('BEGIN')
+        try:
+            cursor = pool.db.executemany(translateSql(query), [tuple(row) for row in args])
+        except Exception:
+            pool.db.execute('ROLLBACK')
+            raise
+        pool.db.execute('COMMIT')
+        self.__rows = []
+        self.__position = 0
+        self.rowcount = cursor.rowcount
+        return self.rowcount
+
+    async def fetchone(self):
+        if self.__stream is not None:
+            return self.__stream.fetchone()
+        if self.__position >= len(self.__rows):
+            return None
+        self.__position += 1
+        return self.__rows[self.__position - 1]
+
+    async def fetchmany(self, size=1):
+        if self.__stream is not None:
+            return self.__stream.fetchmany(size)
+        rows = self.__rows[self.__position:self.__position + size]
+        self.__position += len(rows)
+        return rows
+
+    async def fetchall(self):
+        if self.__stream is not None:
+            return self.__stream.fetchall()
+        rows = self.__rows[self.__position:]
+        self.__position = len(self.__rows)
+        return rows
+
+    async def close(self):
+        self.__rows = []
+        if self.__stream is not None:
+            self.__stream.close()
+            self.__stream = None
+
+
+class _LocalConnection(object):
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def cursor(self, cursor_class=None):
+        return _LocalCursor(self, unbuffered=cursor_class is not None and issubclass(cursor_class, aiomysql.SSCursor))
+
+    async def ping(self, reconnect=True):
+        pass
+
+    def close(self):
+        pass
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+
+class _AcquireContext(object):
+    """ Like aiomysql, acquire() can be awaited or used with async with """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.conn = None
+
+    def __await__(self):
+        return self.pool._acquire().__await__()
+
+    async def __aenter__(self):
+        self.conn = await self.pool._acquire()
+        return self.conn
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.pool.release(self.conn)
+        self.conn = None
+
+
+class LocalPool(object):
+    """
+    aiomysql compatible pool on one SQLite database, stands in for MySQL in tests and benchmarks.
+    Every statement is committed on its own, commit() and rollback() do nothing.
+    query_latency seconds are awaited before every statement to mimic the network round trip.
+    """
+
+    def __init__(self, path: str = ':memory:', maxsize: int = 10, query_latency: float = 0):
+        self.maxsize = maxsize
+        self.query_latency = query_latency
+        self.db = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES, isolation_level=None,
+                                  check_same_thread=False)
+        for statement in SCHEMA:
+            self.db.execute(statement)
+        self.__semaphore = None  # created on first acquire, in the loop that uses it
+        self.__used = 0
+        self.__created = 0
+
+    @property
+    def size(self):
+        return self.__created
+
+    @property
+    def freesize(self):
+        return self.__created - self.__used
+
+    def acquire(self):
+        return _AcquireContext(self)
+
+    async def _acquire(self):
+        if self.__semaphore is None:
+            self.__semaphore = asyncio.Semaphore(self.maxsize)
+        await self.__semaphore.acquire()
+        self.__used += 1
+        self.__created = max(self.__created, self.__used)
+        return _LocalConnection(self)
+
+    def release(self, conn):
+        self.__used -= 1
+        self.__semaphore.release()
+
+    def close(self):
+        self.db.close()
+
+    async def wait_closed(self):
+        pass
+
+
+class LocalMysqlPool(object):
+    """ Drop-in for MysqlConnectPool backed by LocalPool, every replica path is another, independent database """
+
+    def __init__(self, loop=None, maxsize: int = 10, path: str = ':memory:', query_latency: float = 0,
+                 replica_paths=()):
+        self.loop = loop
+        self.maxsize = maxsize
+        self.connect_pool = LocalPool(path=path, maxsize=maxsize, query_latency=query_latency)
+        self.replica_pools = [LocalPool(path=replica_path, maxsize=maxsize, query_latency=query_latency)
+                              for replica_path in replica_paths]
+
+    def getPool(self):
+        return self.connect_pool
+
+    async def waitClosePool(self):
+        self.closePool()
+
+    def closePool(self):
+        self.connect_pool.close()
+        for replica in self.replica_pools:
+            replica.close()
@@ -1,12 +1,117 @@
+import os
+import time
+import queue
+import atexit
 import logging
-from logging.handlers import TimedRotatingFileHandler, RotatingFileHandler
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
 
 from tool.Config import Config
 
 
+class _BatchFileHandler(TimedRotatingFileHandler):
+    """ Leaves flushing to the log writer thread, one flush per batch instead of one per record """
+
+    def flush(self):
+        pass
+
+    def flushBatch(self):
+        self.acquire()
+        try:
+            super().flush()
+        finally:
+            self.release()
+
+    def close(self):
+        self.flushBatch()
+        super().close()
+
+
+class _LazyQueueHandler(QueueHandler):
+    """ Put records on the queue as they are, message and traceback are formatted by the writer thread """
+
+    def __init__(self, log_queue, maxsize: int):
+        super().__init__(log_queue)
+        self.maxsize = maxsize
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        if self.queue.qsize() >= self.maxsize:
+            self.dropped += 1  # never block the event loop on a slow disk
+            return
+        self.queue.put_nowait(record)
+
+
+class _BatchQueueListener(QueueListener):
+    """ Writer thread, drains up to batch_size records per wakeup and flushes once """
+
+    def __init__(self, log_queue, handler, batch_size: int = 256):
+        super().__init__(log_queue, handler, respect_handler_level=True)
+        self.batch_size = batch_size
+
+    def _monitor(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = False
+            for record in batch:
+                if record is self._sentinel:
+                    stop = True
+                else:
+                    self.handle(record)
+            for handler in self.handlers:
+                if isinstance(handler, _BatchFileHandler):
+                    handler.flushBatch()
+                else:
+                    handler.flush()
+            if stop:
+                return
+
+
+class _RateLimitFilter(logging.Filter):
+    """
+    Token bucket per message site (file and line), at most rate records per second with bursts of burst.
+    Warnings and errors always pass, the number of suppressed records is appended to the next record of the site.
+    """
+
+    def __init__(self, rate: float, burst: int, clock=time.monotonic):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.sites = {}  # (pathname, lineno) -> [tokens, last time, suppressed]
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+
+        now = self.clock()
+        site = self.sites.get((record.pathname, record.lineno))
+        if site is None:
+            site = self.sites[(record.pathname, record.lineno)] = [self.burst, now, 0]
+        site[0] = min(self.burst, site[0] + (now - site[1]) * self.rate)
+        site[1] = now
+        if site[0] < 1:
+            site[2] += 1
+            return False
+
+        site[0] -= 1
+        if site[2]:
+            record.msg = '{} [{} similar messages suppressed]'.format(record.msg, site[2])
+            site[2] = 0
+        return True
+
+
 class _Logger(logging.Logger):
 
-    def __init__(self, level, format, filename=None):
+    def __init__(self, level, format, filename=None, queued=True, queue_size=10000, rate=0, burst=10):
 
         super().__init__(__name__)
 
@@ -14,32 +119,113 @@ class _Logger(logging.Logger):
         self.setLevel(level)
 
         # 初始化format，设置格式
-        fmt = logging.Formatter(format)
+        self.fmt = logging.Formatter(format)
+        self.queued = queued
 
         # 初始化处理器
+        handler = self.__createHandler(filename)
+
+        # 限流
+        if rate > 0:
+            self.addFilter(_RateLimitFilter(rate, burst))
+
+        self.writer = None
+        self.queue_handler = None
+        if queued:
+            # 日志由单独的写线程写入, 事件循环只负责入队
+            self.queue_handler = _LazyQueueHandler(queue.SimpleQueue(), maxsize=queue_size)
+            self.addHandler(self.queue_handler)
+            self.writer = _BatchQueueListener(self.queue_handler.queue, handler)
+            self.writer.start()
+            atexit.register(self.stopWriter)
+            os.register_at_fork(before=self.__beforeFork, after_in_parent=self.__afterForkInParent,
+                                after_in_child=self.__afterForkInChild)
+        else:
+            # 添加handler
+            self.addHandler(handler)
+
+    def __createHandler(self, filename):
         if filename is not None:
             # file_handler = logging.FileHandler(filename)
             # handler = RotatingFileHandler(filename, maxBytes=1024000, backupCount=10)
-            file_handler = TimedRotatingFileHandler(filename, when="D", interval=1, backupCount=15, encoding="UTF-8",
-                                                    delay=False, utc=True)
-            # 设置handler级别
-            file_handler.setLevel(level)
-            # 添加handler
-            self.addHandler(file_handler)
-            # 添加日志处理器
-            file_handler.setFormatter(fmt)
+            handler_class = _BatchFileHandler if self.queued else TimedRotatingFileHandler
+            handler = handler_class(filename, when="D", interval=1, backupCount=15, encoding="UTF-8",
+                                    delay=False, utc=True)
+        else:
+            handler = logging.StreamHandler()
+        # 设置handler级别
+        handler.setLevel(self.level)
+        handler.setFormatter(self.fmt)
+        return handler
+
+    def reopen(self, filename: str):
+        """
+        Write to filename from now on, records queued before are still written to the old file.
+        With a file of its own per process, a rollover of one process never removes the logs of another
+        """
+        handler = self.__createHandler(filename)
+        if self.writer is not None:
+            self.writer.stop()
+            old = self.writer.handlers[0]
+            self.writer = _BatchQueueListener(self.queue_handler.queue, handler)
+            self.writer.start()
         else:
-            stream_handler = logging.StreamHandler()
-            stream_handler.setLevel(level)
-            self.addHandler(stream_handler)
-            stream_handler.setFormatter(fmt)
+            old = self.handlers[0]
+            self.removeHandler(old)
+            self.addHandler(handler)
+        old.close()
+
+    def stopWriter(self):
+        """ Write out queued records and stop the writer thread, records logged afterwards are dropped """
+        if self.writer is not None and self.writer._thread is not None:
+            self.writer.stop()
+            if self.queue_handler.dropped:
+                self.writer.handlers[0].handle(self.makeRecord(
+                    self.name, logging.WARNING, __file__, 0,
+                    '{} log records were dropped, the log queue was full'.format(self.queue_handler.dropped), None, None))
+                self.queue_handler.dropped = 0
+            self.writer.handlers[0].flush()
+
+    def __beforeFork(self):
+        # nothing half written may sit in the file buffer while it is copied to the child
+        self.writer.handlers[0].acquire()
+        if isinstance(self.writer.handlers[0], _BatchFileHandler):
+            self.writer.handlers[0].flushBatch()
+
+    def __afterForkInParent(self):
+        self.writer.handlers[0].release()
+
+    def __afterForkInChild(self):
+        # the writer thread doesn't survive fork, records queued in the parent are written by the parent.
+        # handler locks are already reset by logging's own fork hook
+        self.queue_handler.queue = queue.SimpleQueue()
+        self.queue_handler.dropped = 0
+        self.writer = _BatchQueueListener(self.queue_handler.queue, self.writer.handlers[0])
+        self.writer.start()
 
 
 class Logger(object):
     __config = Config.getInstance()
 
-    __logger = _Logger(level=__config['LOG_LEVEL'], format=__config['LOG_FORMAT'], filename=__config['LOG_FILENAME'])
+    __logger = _Logger(level=__config['LOG_LEVEL'], format=__config['LOG_FORMAT'], filename=__config['LOG_FILENAME'],
+                       queued=__config.get('LOG_QUEUED', True),
+                       queue_size=__config.get('LOG_QUEUE_SIZE', 10000),
+                       rate=__config.get('LOG_RATE_LIMIT', 0),
+                       burst=__config.get('LOG_RATE_BURST', 10))
 
     @staticmethod
     def getInstance():
         return Logger.__logger
+
+    @staticmethod
+    def useWorkerFile(worker_id: int):
+        """ Called in a prefork worker: log to LOG_FILENAME with the worker id, e.g. debug.1.log, stable across restarts """
+        filename = Logger.__config['LOG_FILENAME']
+        if filename is not None:
+            root, ext = os.path.splitext(filename)
+            Logger.__logger.reopen('{}.{}{}'.format(root, worker_id, ext))
+
+    @staticmethod
+    def shutdown():
+        """ Write out queued records and stop the writer thread, call before os._exit """
+        Logger.__logger.stopWriter()
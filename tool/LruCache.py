@@ -0,0 +1,97 @@
+import time
+from collections import OrderedDict
+
+
+class LruCache(object):
+    """
+    Size-bounded in-process cache with per-entry TTL and LRU eviction.
+    Not thread safe, it is meant to be used from the IOLoop thread only.
+    Hit, miss and eviction counters are kept locally and, if a statsd client is given,
+    sent as '<name>.hit', '<name>.miss' and '<name>.eviction'.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, name: str = None, statsd_conn=None, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self.statsd_conn = statsd_conn
+        self.clock = clock
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.__entries = OrderedDict()  # key -> (expire_at, value)
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __contains__(self, key):
+        return self.peek(key) is not None
+
+    def __incr(self, stat: str):
+        if self.statsd_conn is not None and self.name is not None:
+            self.statsd_conn.incr('{name}.{stat}'.format(name=self.name, stat=stat))
+
+    def recordHit(self):
+        self.hits += 1
+        self.__incr('hit')
+
+    def recordMiss(self):
+        self.misses += 1
+        self.__incr('miss')
+
+    def peek(self, key, default=None):
+        # lookup without touching hit/miss counters, still refreshes LRU position
+        entry = self.__entries.get(key)
+        if entry is None:
+            return default
+
+        expire_at, value = entry
+        if expire_at <= self.clock():
+            del self.__entries[key]
+            return default
+
+        self.__entries.move_to_end(key)
+        return value
+
+    def get(self, key, default=None):
+        value = self.peek(key, self)
+        if value is self:
+            self.recordMiss()
+            return default
+
+        self.recordHit()
+        return value
+
+    def set(self, key, value, ttl: float = None):
+        if ttl is None:
+            ttl = self.ttl
+        if ttl <= 0 or self.maxsize <= 0:
+            self.__entries.pop(key, None)
+            return
+
+        self.__entries[key] = (self.clock() + ttl, value)
+        self.__entries.move_to_end(key)
+
+        while len(self.__entries) > self.maxsize:
+            self.__entries.popitem(last=False)
+            self.evictions += 1
+            self.__incr('eviction')
+
+    def invalidate(self, key):
+        return self.__entries.pop(key, None) is not None
+
+    def clear(self):
+        self.__entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.__entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': (self.hits / lookups) if lookups else 0.0,
+        }
@@ -0,0 +1,126 @@
+import os
+
+from statsd.client.udp import Pipeline
+
+
+class StatsdPipeline(Pipeline):
+    """
+    Long-lived statsd pipeline, a drop-in for StatsClient.
+    Stats are buffered and sent packed into as few UDP packets as possible,
+    once max_size stats are buffered or when flush() is called by the flush timer.
+    """
+
+    def __init__(self, client, max_size: int = 50):
+        super().__init__(client)
+        self.max_size = max_size
+
+    def _after(self, data):
+        super()._after(data)
+        if len(self._stats) >= self.max_size:
+            self.send()
+
+    def flush(self):
+        self.send()
+
+    def pipeline(self):
+        # short pipelines (e.g. negative gauges) end up in this buffer
+        return Pipeline(self)
+
+    def close(self):
+        self.send()
+        self._client.close()
+
+
+class LatencyHistogram(object):
+    """
+    HDR style histogram of latencies in microseconds.
+    Values below 2^sub_bucket_bits are counted exactly, above that every power of two range is split
+    into 2^(sub_bucket_bits-1) linear buckets, so any recorded value is off by at most 1/64 with the default 7 bits.
+    Values above highest are clamped to highest.
+    """
+
+    def __init__(self, highest: int = 60 * 1000 * 1000, sub_bucket_bits: int = 7):
+        self.highest = highest
+        self.sub_bucket_bits = sub_bucket_bits
+        self.sub_bucket_count = 1 << sub_bucket_bits
+        self.half_count = self.sub_bucket_count >> 1
+        self.counts = [0] * (self.__index(highest) + 1)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def __index(self, value: int) -> int:
+        if value < self.sub_bucket_count:
+            return value
+        shift = value.bit_length() - self.sub_bucket_bits
+        return self.sub_bucket_count + (shift - 1) * self.half_count + (value >> shift) - self.half_count
+
+    def __highestEquivalent(self, index: int) -> int:
+        if index < self.sub_bucket_count:
+            return index
+        shift = (index - self.sub_bucket_count) // self.half_count + 1
+        sub_bucket = (index - self.sub_bucket_count) % self.half_count + self.half_count
+        return ((sub_bucket + 1) << shift) - 1
+
+    def record(self, value: int):
+        value = min(max(int(value), 0), self.highest)
+        self.counts[self.__index(value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, percent: float) -> int:
+        """ :return: the value at or below which percent of the recorded values fall, 0 if empty """
+        if self.count == 0:
+            return 0
+        target = max(1, int(round(self.count * percent / 100.0)))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self.__highestEquivalent(index), self.max)
+        return self.max
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class RouteMetrics(object):
+    """
+    Request count, status codes and latency of every route in this process.
+    Each request is also sent to statsd as '[METHOD] route', '[METHOD] route STATUS' and 'timing [METHOD] route'.
+    """
+
+    PERCENTILES = (50, 90, 95, 99, 99.9)
+
+    def __init__(self, statsd_conn=None):
+        self.statsd_conn = statsd_conn
+        self.routes = {}  # '[METHOD] route' -> {'count', 'status', 'latency'}
+
+    def record(self, method: str, route: str, status: int, seconds: float):
+        name = '[{method}] {route}'.format(method=method, route=route)
+        metrics = self.routes.get(name)
+        if metrics is None:
+            metrics = self.routes[name] = {'count': 0, 'status': {}, 'latency': LatencyHistogram()}
+        metrics['count'] += 1
+        metrics['status'][status] = metrics['status'].get(status, 0) + 1
+        metrics['latency'].record(seconds * 1000000)
+
+        if self.statsd_conn is not None:
+            self.statsd_conn.incr(name)
+            self.statsd_conn.incr('{name} {status}'.format(name=name, status=status))
+            self.statsd_conn.timing('timing ' + name, seconds * 1000)
+
+    def snapshot(self) -> dict:
+        routes = {}
+        for name, metrics in self.routes.items():
+            latency = metrics['latency']
+            routes[name] = {
+                'count': metrics['count'],
+                'status': {str(status): count for status, count in sorted(metrics['status'].items())},
+                'latency_ms': dict([('p{}'.format(p), latency.percentile(p) / 1000.0) for p in self.PERCENTILES] +
+                                   [('mean', round(latency.mean() / 1000.0, 3)), ('max', (latency.max or 0) / 1000.0)]),
+            }
+        return {'pid': os.getpid(), 'routes': routes}
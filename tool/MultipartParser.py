@@ -0,0 +1,117 @@
+import re
+from email.message import Message
+
+
+class MultipartError(Exception):
+    pass
+
+
+def parseBoundary(content_type: str):
+    """ :return: boundary bytes of a multipart/form-data Content-Type, None if it is not multipart """
+    msg = Message()
+    msg['content-type'] = content_type or ''
+    if msg.get_content_type() != 'multipart/form-data':
+        return None
+    boundary = msg.get_param('boundary')
+    if not boundary or not isinstance(boundary, str):
+        return None
+    return boundary.encode('latin-1')
+
+
+class MultipartParser(object):
+    """
+    Incremental multipart/form-data parser, body is fed chunk by chunk as it arrives.
+    feed() returns a list of events:
+        ('part', {'name', 'filename', 'content_type'})  headers of a new part
+        ('data', bytes)                                  a piece of the current part body
+        ('end', None)                                    current part is complete
+    Memory held between calls is bounded by the boundary length, or max_header_size while reading part headers.
+    """
+    PREAMBLE, HEADERS, BODY, AFTER_BOUNDARY, DONE = range(5)
+
+    def __init__(self, boundary: bytes, max_header_size: int = 16 * 1024):
+        self.delimiter = b'--' + boundary
+        self.body_delimiter = b'\r\n--' + boundary
+        self.max_header_size = max_header_size
+        self.state = MultipartParser.PREAMBLE
+        self.__buffer = bytearray()
+
+    @property
+    def finished(self) -> bool:
+        return self.state == MultipartParser.DONE
+
+    def feed(self, data: bytes) -> list:
+        events = []
+        if self.state == MultipartParser.DONE:
+            return events  # epilogue is ignored
+        self.__buffer += data
+
+        while True:
+            buf = self.__buffer
+            if self.state == MultipartParser.PREAMBLE:
+                index = buf.find(self.delimiter)
+                if index < 0:
+                    # keep a tail that may hold the beginning of the delimiter
+                    del buf[:max(0, len(buf) - len(self.delimiter) + 1)]
+                    return events
+                del buf[:index + len(self.delimiter)]
+                self.state = MultipartParser.AFTER_BOUNDARY
+
+            elif self.state == MultipartParser.AFTER_BOUNDARY:
+                if len(buf) < 2:
+                    return events
+                if buf[:2] == b'--':
+                    self.state = MultipartParser.DONE
+                    buf.clear()
+                    return events
+                if buf[:2] != b'\r\n':
+                    raise MultipartError('Malformed multipart boundary')
+                del buf[:2]
+                self.state = MultipartParser.HEADERS
+
+            elif self.state == MultipartParser.HEADERS:
+                index = buf.find(b'\r\n\r\n')
+                if index < 0:
+                    if len(buf) > self.max_header_size:
+                        raise MultipartError('Multipart part headers too large')
+                    return events
+                events.append(('part', self.__parseHeaders(bytes(buf[:index]))))
+                del buf[:index + 4]
+                self.state = MultipartParser.BODY
+
+            elif self.state == MultipartParser.BODY:
+                index = buf.find(self.body_delimiter)
+                if index < 0:
+                    keep = len(self.body_delimiter) - 1
+                    if len(buf) > keep:
+                        events.append(('data', bytes(buf[:len(buf) - keep])))
+                        del buf[:len(buf) - keep]
+                    return events
+                if index > 0:
+                    events.append(('data', bytes(buf[:index])))
+                events.append(('end', None))
+                del buf[:index + len(self.body_delimiter)]
+                self.state = MultipartParser.AFTER_BOUNDARY
+
+            else:
+                return events
+
+    @staticmethod
+    def __parseHeaders(raw: bytes) -> dict:
+        msg = Message()
+        for line in raw.decode('utf-8', errors='replace').split('\r\n'):
+            if not line:
+                continue
+            if ':' not in line:
+                raise MultipartError('Malformed multipart part header')
+            name, value = line.split(':', 1)
+            msg[name.strip()] = value.strip()
+
+        if msg.get('content-disposition') is None:
+            raise MultipartError('Multipart part without Content-Disposition')
+        filename = msg.get_param('filename', header='content-disposition')
+        return {
+            'name': msg.get_param('name', header='content-disposition'),
+            'filename': re.split(r'[\\/]', filename)[-1] if isinstance(filename, str) else None,
+            'content_type': msg.get('content-type'),
+        }
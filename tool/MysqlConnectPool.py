@@ -1,8 +1,12 @@
 import ssl
 import aiomysql
+from pymysql.constants import CLIENT
 
 from tool.Config import Config
 from tool.Logger import Logger
+from tool.LocalMysqlPool import LocalMysqlPool
+from tool.ObservedPool import ObservedPool
+from tool.RoutingPool import RoutingPool
 
 
 async def getCursor(pool):
@@ -14,37 +18,91 @@ async def getCursor(pool):
 
 class MysqlConnectPool(object):
 
-    def __init__(self, loop, maxsize):
+    def __init__(self, loop, maxsize=None, minsize=None, replica_hosts=None):
         self.connect_pool = None
+        self.replica_pools = []
         self.loop = loop
-        self.maxsize = maxsize
 
         # read db config
-        self.host = Config.getInstance()['MYSQL_IP']
-        self.port = Config.getInstance()['MYSQL_PORT']
-        self.user = Config.getInstance()['MYSQL_USERNAME']
-        self.password = Config.getInstance()['MYSQL_PASSWORD']
+        config = Config.getInstance()
+        self.host = config['MYSQL_IP']
+        self.port = config['MYSQL_PORT']
+        self.user = config['MYSQL_USERNAME']
+        self.password = config['MYSQL_PASSWORD']
         self.database = "csye6225"
+        self.maxsize = maxsize or config.get('MYSQL_POOL_MAXSIZE', 10)
+        self.minsize = min(self.maxsize, minsize if minsize is not None else config.get('MYSQL_POOL_MINSIZE', 1))
+        self.recycle = config.get('MYSQL_POOL_RECYCLE', 3600)
+        self.cafile = config.get('MYSQL_SSL_CA', '/home/ec2-user/webservice/config/us-east-1-bundle.cer')
+        self.replica_hosts = list(replica_hosts if replica_hosts is not None else config.get('MYSQL_REPLICA_IPS') or [])
 
         self.loop.run_until_complete(self.createPool())
 
     async def createPool(self):
+        self.connect_pool = await self.createHostPool(self.host, self.minsize)
+        for host in self.replica_hosts:
+            try:
+                self.replica_pools.append(await self.createHostPool(host, self.minsize))
+            except Exception as e:
+                # a replica that is down at startup must not keep the worker from serving, connect on first use
+                Logger.getInstance().warning('cannot connect to replica[%s]: %r', host, e)
+                self.replica_pools.append(await self.createHostPool(host, 0))
+
+    async def createHostPool(self, host, minsize):
         ssl_ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
-        ssl_ctx.load_verify_locations(cafile='/home/ec2-user/webservice/config/us-east-1-bundle.cer')
-        self.connect_pool = await aiomysql.create_pool(loop=self.loop,
-                                                       host=self.host, port=self.port,
-                                                       user=self.user, password=self.password,
-                                                       db=self.database, charset="utf8",
-                                                       maxsize=self.maxsize, minsize=1, 
-                                                       ssl=ssl_ctx)
+        ssl_ctx.load_verify_locations(cafile=self.cafile)
+        # minsize connections are opened here, before the worker takes traffic.
+        # FOUND_ROWS: an UPDATE reports the rows it matched, not only the changed ones, like the SQLite stand-in
+        pool = await aiomysql.create_pool(loop=self.loop,
+                                          host=host, port=self.port,
+                                          user=self.user, password=self.password,
+                                          db=self.database, charset="utf8",
+                                          maxsize=self.maxsize, minsize=minsize,
+                                          pool_recycle=self.recycle,
+                                          client_flag=CLIENT.FOUND_ROWS,
+                                          ssl=ssl_ctx)
+        Logger.getInstance().info('mysql pool created, host[%s] minsize[%s] maxsize[%s] recycle[%s]',
+                                  host, minsize, self.maxsize, self.recycle)
+        return pool
 
     def getPool(self):
         return self.connect_pool
 
     async def waitClosePool(self):
-        self.connect_pool.close()
-        await self.connect_pool.wait_closed()
+        for pool in [self.connect_pool] + self.replica_pools:
+            pool.close()
+            await pool.wait_closed()
 
     def closePool(self):
         self.loop.run_until_complete(self.waitClosePool())
 
+
+
+def createMysqlPool(loop, maxsize=None, statsd_conn=None):
+    """
+    MYSQL_POOL selects MySQL or the local SQLite stand-in. Either way getPool() returns a RoutingPool
+    over an ObservedPool for the primary and one for every replica (MYSQL_REPLICA_IPS, MYSQL_LOCAL_REPLICA_PATHS)
+    """
+    config = Config.getInstance()
+    maxsize = maxsize or config.get('MYSQL_POOL_MAXSIZE', 10)
+    minsize = min(maxsize, config.get('MYSQL_POOL_MINSIZE', 1))
+    if config.get('MYSQL_POOL', 'mysql') == 'local':
+        pool = LocalMysqlPool(loop=loop, maxsize=maxsize, path=config.get('MYSQL_LOCAL_PATH', ':memory:'),
+                              query_latency=config.get('MYSQL_LOCAL_LATENCY', 0),
+                              replica_paths=config.get('MYSQL_LOCAL_REPLICA_PATHS') or [])
+    else:
+        pool = MysqlConnectPool(loop=loop, maxsize=maxsize, minsize=minsize)
+
+    def observe(raw_pool, name):
+        return ObservedPool(raw_pool, minsize=minsize, maxsize=maxsize, name=name,
+                            pre_ping=config.get('MYSQL_POOL_PRE_PING', True),
+                            pre_ping_idle=config.get('MYSQL_POOL_PRE_PING_IDLE', 30),
+                            adaptive=config.get('MYSQL_POOL_ADAPTIVE', False),
+                            wait_target=config.get('MYSQL_POOL_WAIT_TARGET_MS', 5) / 1000.0,
+                            statsd_conn=statsd_conn)
+
+    pool.connect_pool = RoutingPool(observe(pool.connect_pool, 'mysql_pool'),
+                                    [observe(replica, 'mysql_replica_{}'.format(i)) for i, replica in enumerate(pool.replica_pools)],
+                                    sticky_window=config.get('MYSQL_READ_STICKY_SECONDS', 5),
+                                    retry_interval=config.get('MYSQL_REPLICA_RETRY_INTERVAL', 10))
+    return pool
@@ -0,0 +1,410 @@
+import os
+import asyncio
+import mimetypes
+import datetime
+import concurrent.futures
+
+import boto3
+import botocore.config
+import botocore.exceptions
+
+from tool.Config import Config
+from tool.Logger import Logger
+
+
+class ObjectStore(object):
+    """
+    Async object storage used for profile pictures.
+    Blocking backend calls run on a dedicated executor, and at most max_concurrency calls are in flight at once.
+    Subclasses implement the blocking _put/_get/_delete/_deleteMany/_head/_listObjects methods,
+    and _presignPut/_presignGet if clients can transfer objects without going through the service.
+    """
+    supports_presign = False  # True if presign_put and presign_get are implemented
+
+    def __init__(self, bucket: str, max_concurrency: int = 16):
+        self.bucket = bucket
+        self.max_concurrency = max_concurrency
+        self.__semaphore = None
+        self.__executor = None
+
+    def __getExecutor(self):
+        # created lazily, so the store can be built before worker processes are forked
+        if self.__executor is None:
+            self.__executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                                                    thread_name_prefix=self.__class__.__name__)
+        return self.__executor
+
+    async def _run(self, fn, *args):
+        if self.__semaphore is None:
+            self.__semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async with self.__semaphore:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(self.__getExecutor(), fn, *args)
+
+    async def put(self, key: str, body: bytes, content_type: str = None):
+        return await self._run(self._put, key, body, content_type)
+
+    async def get(self, key: str):
+        """ :return: object bytes, None if the object doesn't exist """
+        return await self._run(self._get, key)
+
+    async def delete(self, key: str):
+        return await self._run(self._delete, key)
+
+    async def delete_many(self, keys: list):
+        if not keys:
+            return
+        return await self._run(self._deleteMany, list(keys))
+
+    async def head(self, key: str):
+        """ :return: dict with size, content_type, etag and last_modified, None if the object doesn't exist """
+        return await self._run(self._head, key)
+
+    async def list_objects(self, prefix: str) -> list:
+        """ :return: dicts with key, size and last_modified of every object whose key starts with prefix """
+        return await self._run(self._listObjects, prefix)
+
+    async def presign_put(self, key: str, content_type: str, size: int, expires: int = 300) -> dict:
+        """
+        Let a client upload an object directly, the URL only accepts exactly size bytes of content_type.
+        Signing is local, but resolving credentials the first time may not be, so it runs on the executor too.
+        :return: dict with url, method and the headers the client has to send
+        :raise NotImplementedError: the store has no presigned URLs (supports_presign is False), e.g. LocalObjectStore
+        """
+        return await self._run(self._presignPut, key, content_type, size, expires)
+
+    async def presign_get(self, key: str, expires: int = 300) -> str:
+        """ :return: URL a client downloads the object from directly """
+        return await self._run(self._presignGet, key, expires)
+
+    def openUpload(self, key: str, content_type: str = None):
+        """ :return: ObjectUpload streaming an object chunk by chunk """
+        return BufferedUpload(self, key, content_type)
+
+    def close(self):
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=True)
+            self.__executor = None
+
+    def _put(self, key, body, content_type):
+        raise NotImplementedError
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def _delete(self, key):
+        raise NotImplementedError
+
+    def _deleteMany(self, keys):
+        for key in keys:
+            self._delete(key)
+
+    def _head(self, key):
+        raise NotImplementedError
+
+    def _listObjects(self, prefix):
+        raise NotImplementedError
+
+    def _presignPut(self, key, content_type, size, expires):
+        raise NotImplementedError('{} has no presigned URLs'.format(self.__class__.__name__))
+
+    def _presignGet(self, key, expires):
+        raise NotImplementedError('{} has no presigned URLs'.format(self.__class__.__name__))
+
+
+class ObjectUpload(object):
+    """ Streaming upload of one object, write() chunks then complete() or abort() """
+
+    def __init__(self, store: ObjectStore, key: str, content_type: str = None):
+        self.store = store
+        self.key = key
+        self.content_type = content_type
+        self.size = 0
+
+    async def write(self, chunk: bytes):
+        raise NotImplementedError
+
+    async def complete(self):
+        raise NotImplementedError
+
+    async def abort(self):
+        raise NotImplementedError
+
+
+class BufferedUpload(ObjectUpload):
+    """ Fallback for stores without streaming support, the object is buffered and put on complete """
+
+    def __init__(self, store: ObjectStore, key: str, content_type: str = None):
+        super().__init__(store, key, content_type)
+        self.__chunks = []
+
+    async def write(self, chunk: bytes):
+        self.size += len(chunk)
+        self.__chunks.append(chunk)
+
+    async def complete(self):
+        body, self.__chunks = b''.join(self.__chunks), []
+        await self.store.put(self.key, body, content_type=self.content_type)
+
+    async def abort(self):
+        self.__chunks = []
+
+
+class S3MultipartUpload(ObjectUpload):
+    """
+    S3 multipart upload. Chunks are buffered up to part_size (S3 requires at least 5MB for every part but the last),
+    so memory per upload is bounded by part_size. Objects smaller than one part are sent with a single put_object.
+    """
+
+    def __init__(self, store: 'S3ObjectStore', key: str, content_type: str = None, part_size: int = 5 * 1024 * 1024):
+        super().__init__(store, key, content_type)
+        self.part_size = part_size
+        self.upload_id = None
+        self.parts = []
+        self.__buffer = bytearray()
+
+    def _create(self):
+        params = {'Bucket': self.store.bucket, 'Key': self.key}
+        if self.content_type is not None:
+            params['ContentType'] = self.content_type
+        self.upload_id = self.store._client().create_multipart_upload(**params)['UploadId']
+
+    def _uploadPart(self, body):
+        if self.upload_id is None:
+            self._create()
+        part_number = len(self.parts) + 1
+        response = self.store._client().upload_part(Bucket=self.store.bucket, Key=self.key, UploadId=self.upload_id,
+                                                     PartNumber=part_number, Body=body)
+        self.parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+
+    def _complete(self):
+        self.store._client().complete_multipart_upload(Bucket=self.store.bucket, Key=self.key,
+                                                       UploadId=self.upload_id, MultipartUpload={'Parts': self.parts})
+
+    def _abort(self):
+        self.store._client().abort_multipart_upload(Bucket=self.store.bucket, Key=self.key, UploadId=self.upload_id)
+
+    async def write(self, chunk: bytes):
+        self.size += len(chunk)
+        self.__buffer += chunk
+        if len(self.__buffer) >= self.part_size:
+            body, self.__buffer = bytes(self.__buffer), bytearray()
+            await self.store._run(self._uploadPart, body)
+
+    async def complete(self):
+        body, self.__buffer = bytes(self.__buffer), bytearray()
+        if self.upload_id is None:
+            await self.store.put(self.key, body, content_type=self.content_type)
+            return
+        if body:
+            await self.store._run(self._uploadPart, body)
+        await self.store._run(self._complete)
+
+    async def abort(self):
+        self.__buffer = bytearray()
+        if self.upload_id is not None:
+            upload_id, self.upload_id = self.upload_id, None
+            try:
+                await self.store._run(self._abort)
+            except Exception as e:
+                Logger.getInstance().info('Failed to abort s3 multipart upload[{}] of [{}]: {}'.format(upload_id, self.key, e))
+
+
+class LocalUpload(ObjectUpload):
+    """ Streams chunks into a temporary file, renamed to the object path on complete """
+
+    def __init__(self, store: 'LocalObjectStore', key: str, content_type: str = None):
+        super().__init__(store, key, content_type)
+        self.path = store._path(key)
+        self.tmp_path = '{}.{}.{}.tmp'.format(self.path, os.getpid(), id(self))
+        self.__file = None
+
+    def _write(self, chunk):
+        if self.__file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.__file = open(self.tmp_path, 'wb')
+        self.__file.write(chunk)
+
+    def _complete(self):
+        self._write(b'')
+        self.__file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def _abort(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+        try:
+            os.remove(self.tmp_path)
+        except FileNotFoundError:
+            pass
+
+    async def write(self, chunk: bytes):
+        self.size += len(chunk)
+        await self.store._run(self._write, chunk)
+
+    async def complete(self):
+        await self.store._run(self._complete)
+
+    async def abort(self):
+        await self.store._run(self._abort)
+
+
+class S3ObjectStore(ObjectStore):
+    supports_presign = True
+
+    def __init__(self, bucket: str, region_name: str = None, max_concurrency: int = 16):
+        super().__init__(bucket=bucket, max_concurrency=max_concurrency)
+        self.region_name = region_name
+        self.__client = None
+
+    def _client(self):
+        # boto3 clients are thread safe, one client per process is shared by all executor threads
+        if self.__client is None:
+            # SigV4, presigned PUT URLs sign the content-type and content-length headers
+            self.__client = boto3.session.Session().client('s3', region_name=self.region_name,
+                                                            config=botocore.config.Config(signature_version='s3v4'))
+        return self.__client
+
+    def openUpload(self, key: str, content_type: str = None):
+        return S3MultipartUpload(self, key, content_type)
+
+    def _put(self, key, body, content_type):
+        params = {'Bucket': self.bucket, 'Key': key, 'Body': body}
+        if content_type is not None:
+            params['ContentType'] = content_type
+        self._client().put_object(**params)
+
+    def _get(self, key):
+        try:
+            response = self._client().get_object(Bucket=self.bucket, Key=key)
+        except self._client().exceptions.NoSuchKey:
+            return None
+        return response['Body'].read()
+
+    def _delete(self, key):
+        self._client().delete_object(Bucket=self.bucket, Key=key)
+
+    def _deleteMany(self, keys):
+        # delete_objects accepts at most 1000 keys per call
+        for i in range(0, len(keys), 1000):
+            objects = [{'Key': key} for key in keys[i:i + 1000]]
+            response = self._client().delete_objects(Bucket=self.bucket, Delete={'Objects': objects, 'Quiet': True})
+            for error in response.get('Errors', []):
+                Logger.getInstance().info('Failed to delete s3 object[{}]: {}'.format(error.get('Key'), error.get('Message')))
+
+    def _head(self, key):
+        try:
+            response = self._client().head_object(Bucket=self.bucket, Key=key)
+        except botocore.exceptions.ClientError as err:
+            if err.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        return {
+            'size': response['ContentLength'],
+            'content_type': response.get('ContentType'),
+            'etag': response.get('ETag', '').strip('"'),
+            'last_modified': response.get('LastModified'),
+        }
+
+    def _listObjects(self, prefix):
+        objects = []
+        for page in self._client().get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=prefix):
+            objects += [{'key': item['Key'], 'size': item['Size'], 'last_modified': item['LastModified']}
+                        for item in page.get('Contents', [])]
+        return objects
+
+    def _presignPut(self, key, content_type, size, expires):
+        url = self._client().generate_presigned_url(
+            'put_object', Params={'Bucket': self.bucket, 'Key': key, 'ContentType': content_type, 'ContentLength': size},
+            ExpiresIn=expires)
+        return {'url': url, 'method': 'PUT', 'headers': {'Content-Type': content_type, 'Content-Length': str(size)}}
+
+    def _presignGet(self, key, expires):
+        return self._client().generate_presigned_url('get_object', Params={'Bucket': self.bucket, 'Key': key},
+                                                     ExpiresIn=expires)
+
+
+class LocalObjectStore(ObjectStore):
+    """ Object store backed by a local directory, stands in for S3 in tests and benchmarks """
+
+    def __init__(self, root_dir: str, bucket: str = 'local', max_concurrency: int = 16):
+        super().__init__(bucket=bucket, max_concurrency=max_concurrency)
+        self.root_dir = os.path.abspath(root_dir)
+        os.makedirs(self.root_dir, exist_ok=True)
+
+    def _path(self, key):
+        path = os.path.abspath(os.path.join(self.root_dir, key))
+        if not path.startswith(self.root_dir + os.sep):
+            raise ValueError('object key[{}] is outside of the store'.format(key))
+        return path
+
+    def openUpload(self, key: str, content_type: str = None):
+        return LocalUpload(self, key, content_type)
+
+    def _put(self, key, body, content_type):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+
+    def _get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _head(self, key):
+        try:
+            stat = os.stat(self._path(key))
+        except FileNotFoundError:
+            return None
+        return {
+            'size': stat.st_size,
+            'content_type': mimetypes.guess_type(key)[0],
+            'etag': '{:x}-{:x}'.format(stat.st_mtime_ns, stat.st_size),
+            'last_modified': datetime.datetime.fromtimestamp(stat.st_mtime, tz=datetime.timezone.utc),
+        }
+
+    def _listObjects(self, prefix):
+        # keys are paths below root_dir, only the directory the prefix ends in is walked
+        directory = self._path(os.path.dirname(prefix)) if os.path.dirname(prefix) else self.root_dir
+        objects = []
+        for dir_path, _, file_names in os.walk(directory):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                key = os.path.relpath(path, self.root_dir).replace(os.sep, '/')
+                if not key.startswith(prefix) or file_name.endswith('.tmp'):
+                    continue  # another prefix in the same directory, or an upload in progress
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                objects.append({'key': key, 'size': stat.st_size,
+                                'last_modified': datetime.datetime.fromtimestamp(stat.st_mtime, tz=datetime.timezone.utc)})
+        return objects
+
+
+def createObjectStore() -> ObjectStore:
+    config = Config.getInstance()
+    backend = config.get('OBJECT_STORE', 's3')
+    max_concurrency = config.get('OBJECT_STORE_CONCURRENCY', 16)
+    if backend == 'local':
+        return LocalObjectStore(root_dir=config.get('OBJECT_STORE_DIR', './objects'),
+                                bucket=config.get('S3BUCKETNAME', 'local'),
+                                max_concurrency=max_concurrency)
+    elif backend == 's3':
+        return S3ObjectStore(bucket=config['S3BUCKETNAME'], region_name=config.get('AWS_REGION'),
+                             max_concurrency=max_concurrency)
+    else:
+        raise ValueError('unknown object store backend [{}]'.format(backend))
@@ -0,0 +1,196 @@
+import time
+import weakref
+import asyncio
+from collections import deque
+
+from tool.Logger import Logger
+from tool.Metrics import LatencyHistogram
+from tool.LocalMysqlPool import _AcquireContext
+
+
+class ObservedPool(object):
+    """
+    Wraps an aiomysql (or LocalPool) pool, the DAOs use it like the pool itself.
+
+    - acquire wait time (gate + connection checkout) and hold time of every connection go into histograms,
+      so pool waits can be told apart from slow queries
+    - connections idle for pre_ping_idle seconds or longer are pinged on checkout, a dead one
+      (e.g. a TLS session dropped by a NAT or the server) is closed and replaced before the DAO sees it
+    - at most limit connections are handed out at once. limit is maxsize, or in adaptive mode it moves
+      between minsize and maxsize: it doubles when the 95th percentile acquire wait of the last tick was
+      above wait_target, and shrinks by one when the peak of connections in use stayed two below it.
+      Connections above the limit are closed when they come back.
+    """
+
+    def __init__(self, pool, minsize: int = 1, maxsize: int = 10, pre_ping: bool = True, pre_ping_idle: float = 30,
+                 adaptive: bool = False, wait_target: float = 0.005, name: str = 'mysql_pool', statsd_conn=None):
+        self.pool = pool
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.pre_ping = pre_ping
+        self.pre_ping_idle = pre_ping_idle
+        self.adaptive = adaptive
+        self.wait_target = wait_target
+        self.name = name
+        self.statsd_conn = statsd_conn
+        self.limit = minsize if adaptive else maxsize
+
+        self.acquire_wait = LatencyHistogram()  # microseconds
+        self.hold = LatencyHistogram()
+        self.acquires = 0
+        self.pings = 0
+        self.stale = 0  # connections that failed the pre-ping
+        self.resizes = 0
+
+        self.__in_use = 0
+        self.__peak_in_use = 0
+        self.__window = LatencyHistogram()  # acquire waits since the last tick
+        self.__waiters = deque()
+        self.__checked_out = {}  # connection -> checkout time
+        self.__released_at = weakref.WeakKeyDictionary()  # connection -> last release time
+
+    def __getattr__(self, name):
+        # anything else (size, freesize, close, wait_closed, db...) is the wrapped pool's
+        if name == 'pool':
+            raise AttributeError(name)
+        return getattr(self.pool, name)
+
+    @property
+    def in_use(self):
+        return self.__in_use
+
+    def acquire(self):
+        return _AcquireContext(self)
+
+    async def _acquire(self):
+        start = time.monotonic()
+        await self.__enter()
+        try:
+            conn = await self.__checkout()
+        except BaseException:
+            self.__leave()
+            raise
+
+        now = time.monotonic()
+        self.__checked_out[conn] = now
+        self.acquires += 1
+        wait = int((now - start) * 1000000)
+        self.acquire_wait.record(wait)
+        self.__window.record(wait)
+        if self.statsd_conn is not None:
+            self.statsd_conn.timing('{}.acquire_wait'.format(self.name), wait / 1000.0)
+        return conn
+
+    def release(self, conn):
+        now = time.monotonic()
+        checked_out = self.__checked_out.pop(conn, None)
+        if checked_out is not None:
+            self.hold.record(int((now - checked_out) * 1000000))
+
+        closed = getattr(conn, 'closed', False)
+        if not closed and self.pool.size > self.limit:
+            conn.close()  # shrink, the pool drops closed connections on release
+            closed = True
+        if not closed:
+            self.__released_at[conn] = now
+        self.pool.release(conn)
+        self.__leave()
+
+    async def __enter(self):
+        if self.__in_use < self.limit and not self.__waiters:
+            self.__take()
+            return
+
+        waiter = asyncio.get_event_loop().create_future()
+        self.__waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.cancelled():
+                self.__waiters.remove(waiter)
+            else:
+                self.__leave()  # got the slot just before being cancelled, pass it on
+            raise
+
+    def __take(self):
+        self.__in_use += 1
+        self.__peak_in_use = max(self.__peak_in_use, self.__in_use)
+
+    def __leave(self):
+        self.__in_use -= 1
+        self.__wakeup()
+
+    def __wakeup(self):
+        while self.__waiters and self.__in_use < self.limit:
+            waiter = self.__waiters.popleft()
+            if not waiter.done():
+                self.__take()
+                waiter.set_result(None)
+
+    async def __checkout(self):
+        # every pooled connection may be dead, after that a new one is connected
+        for _ in range(self.maxsize):
+            conn = await self.pool.acquire()
+            released_at = self.__released_at.pop(conn, None)
+            if not self.pre_ping or released_at is None or time.monotonic() - released_at < self.pre_ping_idle:
+                return conn
+
+            try:
+                self.pings += 1
+                await conn.ping(reconnect=False)
+                return conn
+            except Exception as e:
+                self.stale += 1
+                Logger.getInstance().warning('%s: pre-ping failed, replacing connection: %r', self.name, e)
+                conn.close()
+                self.pool.release(conn)
+        return await self.pool.acquire()
+
+    def tick(self):
+        """ Called periodically, sends the gauges and in adaptive mode resizes the pool """
+        window, self.__window = self.__window, LatencyHistogram()
+        peak, self.__peak_in_use = self.__peak_in_use, self.__in_use
+
+        if self.adaptive:
+            limit = self.limit
+            if window.count and window.percentile(95) > self.wait_target * 1000000:
+                limit = min(self.maxsize, self.limit * 2)
+            elif peak < self.limit - 1:
+                limit = max(self.minsize, self.limit - 1)
+            if limit != self.limit:
+                Logger.getInstance().info('%s: limit %s -> %s, p95 acquire wait %sus, peak in use %s',
+                                          self.name, self.limit, limit, window.percentile(95), peak)
+                self.limit = limit
+                self.resizes += 1
+                self.__wakeup()
+
+        if self.statsd_conn is not None:
+            self.statsd_conn.gauge('{}.in_use'.format(self.name), self.__in_use)
+            self.statsd_conn.gauge('{}.idle'.format(self.name), self.pool.freesize)
+            self.statsd_conn.gauge('{}.limit'.format(self.name), self.limit)
+            self.statsd_conn.gauge('{}.waiting'.format(self.name), len(self.__waiters))
+
+    def stats(self) -> dict:
+        def summary(histogram):
+            return {
+                'p50': histogram.percentile(50) / 1000.0,
+                'p95': histogram.percentile(95) / 1000.0,
+                'p99': histogram.percentile(99) / 1000.0,
+                'max': (histogram.max or 0) / 1000.0,
+            }
+
+        return {
+            'minsize': self.minsize,
+            'maxsize': self.maxsize,
+            'limit': self.limit,
+            'size': self.pool.size,
+            'in_use': self.__in_use,
+            'idle': self.pool.freesize,
+            'waiting': len(self.__waiters),
+            'acquires': self.acquires,
+            'pings': self.pings,
+            'stale': self.stale,
+            'resizes': self.resizes,
+            'acquire_wait_ms': summary(self.acquire_wait),
+            'hold_ms': summary(self.hold),
+        }
@@ -0,0 +1,115 @@
+import os
+import time
+import signal
+
+from tool.Logger import Logger
+
+
+class Supervisor(object):
+    """
+    Prefork supervisor running in the parent process.
+    Forks num_workers children running worker_main(worker_id), restarts a worker that exits abnormally,
+    and on SIGTERM/SIGINT forwards SIGTERM to every worker, waits up to shutdown_timeout
+    for them to drain, then SIGKILLs the rest.
+    Worker ids are stable across restarts, so per-worker files (e.g. outbox spill files, log files) are picked up again.
+    """
+
+    def __init__(self, num_workers: int, worker_main, shutdown_timeout: float = 30,
+                 max_restarts: int = 10, restart_window: float = 60):
+        self.num_workers = num_workers
+        self.worker_main = worker_main
+        self.shutdown_timeout = shutdown_timeout
+        self.max_restarts = max_restarts
+        self.restart_window = restart_window
+
+        self.workers = {}  # pid -> worker id
+        self.restarts = []  # timestamps of recent restarts
+        self.stopping = False
+
+    def __spawn(self, worker_id: int):
+        # block stop signals until the pid is recorded, so a signal in between still reaches the new worker
+        signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTERM, signal.SIGINT})
+        pid = os.fork()
+        if pid == 0:
+            # child
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)  # parent forwards SIGTERM on Ctrl-C
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGTERM, signal.SIGINT})
+            code = 0
+            try:
+                # only this worker rotates its log file, see Logger.reopen
+                Logger.useWorkerFile(worker_id)
+                self.worker_main(worker_id)
+            except BaseException as e:
+                Logger.getInstance().exception(e)
+                code = 1
+            finally:
+                Logger.shutdown()
+                os._exit(code)
+
+        self.workers[pid] = worker_id
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGTERM, signal.SIGINT})
+        if self.stopping:
+            # the python handler of a signal caught before the block may have run after the fork, and missed this worker
+            os.kill(pid, signal.SIGTERM)
+        Logger.getInstance().info('started worker[{}] pid[{}]'.format(worker_id, pid))
+
+    def __onSignal(self, signum, frame):
+        if not self.stopping:
+            Logger.getInstance().info('supervisor got signal[{}], stopping {} workers'.format(signum, len(self.workers)))
+            self.stopping = True
+            self.__signalAll(signal.SIGTERM)
+
+    def __signalAll(self, signum):
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def __canRestart(self) -> bool:
+        now = time.monotonic()
+        self.restarts = [t for t in self.restarts if now - t < self.restart_window]
+        if len(self.restarts) >= self.max_restarts:
+            return False
+        self.restarts.append(now)
+        return True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.__onSignal)
+        signal.signal(signal.SIGINT, self.__onSignal)
+
+        for worker_id in range(self.num_workers):
+            if not self.stopping:
+                self.__spawn(worker_id)
+
+        deadline = None
+        while self.workers:
+            if self.stopping and deadline is None:
+                deadline = time.monotonic() + self.shutdown_timeout
+            if deadline is not None and time.monotonic() > deadline:
+                Logger.getInstance().info('workers did not stop in {}s, kill them'.format(self.shutdown_timeout))
+                self.__signalAll(signal.SIGKILL)
+                deadline = float('inf')
+
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                time.sleep(0.1)
+                continue
+            worker_id = self.workers.pop(pid, None)
+            if worker_id is None:
+                continue
+
+            code = os.waitstatus_to_exitcode(status)
+            if self.stopping:
+                Logger.getInstance().info('worker[{}] pid[{}] stopped, exit code[{}]'.format(worker_id, pid, code))
+            elif code == 0:
+                Logger.getInstance().info('worker[{}] pid[{}] exited normally'.format(worker_id, pid))
+            elif self.__canRestart():
+                Logger.getInstance().error('worker[{}] pid[{}] died with exit code[{}], restart it'.format(worker_id, pid, code))
+                self.__spawn(worker_id)
+            else:
+                Logger.getInstance().error('too many worker restarts in {}s, stop the service'.format(self.restart_window))
+                self.__onSignal(signal.SIGTERM, None)
+
+        Logger.getInstance().info('all workers stopped')
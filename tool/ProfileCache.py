@@ -0,0 +1,53 @@
+from tool.LruCache import LruCache
+from tool.Serializer import encodeUser
+from tool.Conditional import userEtag
+
+
+class ProfileCache(object):
+    """
+    Serialized GET /v1/user/self bodies and their ETags, keyed by username, so a hit skips the JSON encoding
+    and the digest.
+
+    The user row itself is not cached: authentication and writes need the current password hash and verified flag,
+    and invalidation only reaches this process. The row is read on every request (TokenHandler.prepare does),
+    an entry is used only if it was built from an identical row, so a change made on another worker
+    never gets an old body.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 30, statsd_conn=None):
+        self.__cache = LruCache(maxsize=maxsize, ttl=ttl, name='profile_cache', statsd_conn=statsd_conn)
+
+    def __entry(self, user, count: bool):
+        row = user.toRow()
+        entry = self.__cache.peek(user.username)
+        if entry is not None and entry[0] == row:
+            if count:
+                self.__cache.recordHit()
+            return entry
+        if count:
+            self.__cache.recordMiss()
+        entry = [row, None, None]
+        self.__cache.set(user.username, entry)
+        return entry
+
+    def etag(self, user) -> str:
+        """ ETag of the body of user, every GET asks for it first, so hits and misses are counted here """
+        entry = self.__entry(user, count=True)
+        if entry[2] is None:
+            entry[2] = userEtag(user)
+        return entry[2]
+
+    def body(self, user) -> bytes:
+        """ Serialized response body of user """
+        entry = self.__entry(user, count=False)
+        if entry[1] is None:
+            entry[1] = encodeUser(user)
+        return entry[1]
+
+    def invalidate(self, username: str):
+        # not needed for correctness, entries of an old row are never used, frees them early
+        if username is not None:
+            self.__cache.invalidate(username)
+
+    def stats(self) -> dict:
+        return self.__cache.stats()
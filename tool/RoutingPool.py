@@ -0,0 +1,175 @@
+import time
+import inspect
+import functools
+import itertools
+import contextvars
+
+from tool.Logger import Logger
+from tool.LruCache import LruCache
+from tool.LocalMysqlPool import _AcquireContext
+
+# ('read' or 'write', routing key) of the DAO method running in this task, set by @reads / @writes
+_ROUTE = contextvars.ContextVar('mysql_route', default=(None, None))
+
+
+def _route(kind: str, key=None):
+    def decorator(method):
+        signature = inspect.signature(method)
+
+        def routeKey(args, kwargs):
+            if key is None:
+                return None
+            arguments = signature.bind(*args, **kwargs).arguments
+            return key(arguments) if callable(key) else arguments.get(key)
+
+        if inspect.isasyncgenfunction(method):
+            # streaming DAO methods, the route is set while the generator runs, not while its consumer does
+            @functools.wraps(method)
+            async def generator(*args, **kwargs):
+                route = (kind, routeKey(args, kwargs))
+                items = method(*args, **kwargs)
+                try:
+                    while True:
+                        token = _ROUTE.set(route)
+                        try:
+                            item = await items.__anext__()
+                        except StopAsyncIteration:
+                            return
+                        finally:
+                            _ROUTE.reset(token)
+                        yield item
+                finally:
+                    await items.aclose()
+            return generator
+
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            token = _ROUTE.set((kind, routeKey(args, kwargs)))
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                _ROUTE.reset(token)
+        return wrapper
+    return decorator
+
+
+def reads(key=None):
+    """
+    DAO method only reads, its connections may come from a replica.
+    key names the argument (e.g. 'username') that identifies the rows, or is a function of the bound
+    arguments returning the key (a list of keys for bulk writes). Reads of a key written by this process
+    moments ago go to the primary.
+    """
+    return _route('read', key)
+
+
+def writes(key=None):
+    """ DAO method writes, its connections come from the primary and key is read from the primary for a while """
+    return _route('write', key)
+
+
+class RoutingPool(object):
+    """
+    Pool the DAOs use when there are read replicas, routes every acquire() by the method's @reads / @writes:
+
+    - writes and undeclared methods go to the primary
+    - reads go round robin to the replicas, except for keys written by this process in the
+      last sticky_window seconds (read-your-writes), those are read from the primary.
+      Other worker processes don't see these writes, a request whose client wrote through another worker
+      names its keys with markWritten (service_main carries the window in a cookie)
+    - a replica that fails to hand out a connection is skipped for retry_interval seconds,
+      reads fall back to the primary while no replica is up
+    """
+
+    def __init__(self, primary, replicas=(), sticky_window: float = 5, retry_interval: float = 10,
+                 sticky_size: int = 10000, clock=time.monotonic):
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.sticky_window = sticky_window
+        self.retry_interval = retry_interval
+        self.clock = clock
+        self.routes = {'primary': 0, 'replica': 0, 'sticky': 0, 'fallback': 0}
+
+        self.__written = LruCache(maxsize=sticky_size, ttl=sticky_window, clock=clock)  # key -> True
+        self.__down_until = {}  # replica -> time it is tried again
+        self.__next = itertools.count()
+        self.__owners = {}  # connection -> pool it came from
+
+    def __getattr__(self, name):
+        # size, freesize, db... are the primary's
+        if name == 'primary':
+            raise AttributeError(name)
+        return getattr(self.primary, name)
+
+    def acquire(self):
+        return _AcquireContext(self)
+
+    def __replica(self):
+        kind, key = _ROUTE.get()
+        if kind != 'read' or not self.replicas:
+            self.routes['primary'] += 1
+            return None
+        if key is not None and self.__written.peek(key) is not None:
+            self.routes['sticky'] += 1
+            return None
+
+        now = self.clock()
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[next(self.__next) % len(self.replicas)]
+            if self.__down_until.get(replica, 0) <= now:
+                return replica
+        self.routes['fallback'] += 1
+        return None
+
+    async def _acquire(self):
+        pool = self.__replica()
+        if pool is not None:
+            try:
+                conn = await pool.acquire()
+                self.routes['replica'] += 1
+            except Exception as e:
+                Logger.getInstance().warning('%s is down, reading from the primary for %ss: %r',
+                                             pool.name, self.retry_interval, e)
+                self.__down_until[pool] = self.clock() + self.retry_interval
+                self.routes['fallback'] += 1
+                pool = None
+        if pool is None:
+            pool = self.primary
+            conn = await pool.acquire()
+
+        self.__owners[conn] = pool
+        return conn
+
+    def markWritten(self, keys, ttl: float = None):
+        """ Read keys from the primary for ttl seconds, at most sticky_window """
+        ttl = self.sticky_window if ttl is None else min(ttl, self.sticky_window)
+        for key in keys:
+            self.__written.set(key, True, ttl=ttl)
+
+    def release(self, conn):
+        kind, key = _ROUTE.get()
+        if kind == 'write' and key is not None:
+            # after the commit, the window starts now. bulk writes name a list of keys
+            self.markWritten(key if isinstance(key, (list, tuple, set, frozenset)) else (key, ))
+        self.__owners.pop(conn, self.primary).release(conn)
+
+    def close(self):
+        for pool in [self.primary] + self.replicas:
+            pool.close()
+
+    async def wait_closed(self):
+        for pool in [self.primary] + self.replicas:
+            await pool.wait_closed()
+
+    def tick(self):
+        for pool in [self.primary] + self.replicas:
+            pool.tick()
+
+    def stats(self) -> dict:
+        now = self.clock()
+        return {
+            'primary': self.primary.stats(),
+            'replicas': {replica.name: dict(replica.stats(), down=self.__down_until.get(replica, 0) > now)
+                         for replica in self.replicas},
+            'routes': dict(self.routes),
+        }
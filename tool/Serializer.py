@@ -0,0 +1,90 @@
+import json
+import datetime
+
+from tool.Config import Config
+
+try:
+    import orjson  # optional, pip install orjson
+except ImportError:
+    orjson = None
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"  # how the API has always shown dates, see formatDatetime
+
+
+def formatDatetime(value: datetime.datetime) -> str:
+    # same text as strftime(DATETIME_FORMAT), isoformat is a few times cheaper
+    return value.isoformat(' ', 'seconds')
+
+
+def formatDate(value: datetime.date) -> str:
+    return value.isoformat()
+
+
+def _default(value):
+    # datetimes stay native until encoded, both backends format them here
+    if isinstance(value, datetime.datetime):
+        return formatDatetime(value)
+    if isinstance(value, datetime.date):
+        return formatDate(value)
+    raise TypeError('{} is not JSON serializable'.format(type(value).__name__))
+
+
+def _orjsonDumps(value) -> bytes:
+    return orjson.dumps(value, default=_default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+
+
+_stdlibEncoder = json.JSONEncoder(default=_default, ensure_ascii=False, separators=(',', ':'))
+
+
+def _stdlibDumps(value) -> bytes:
+    return _stdlibEncoder.encode(value).encode()
+
+
+def backendName() -> str:
+    """ JSON_BACKEND 'auto' uses orjson when it is installed, 'json' always uses the stdlib """
+    backend = Config.getInstance().get('JSON_BACKEND', 'auto')
+    if backend == 'orjson' or (backend == 'auto' and orjson is not None):
+        if orjson is None:
+            raise ImportError('JSON_BACKEND is orjson, but orjson is not installed')
+        return 'orjson'
+    return 'json'
+
+
+def _backend():
+    return _orjsonDumps if backendName() == 'orjson' else _stdlibDumps
+
+
+# both backends give the same bytes: compact separators, utf-8 without \u escapes, datetimes as DATETIME_FORMAT
+dumps = _backend()
+
+
+def userFields(user) -> dict:
+    # response representation of a UserContext, never contains the password hash
+    return {
+        'id': user.id,
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+        'username': user.username,
+        'account_created': user.account_created,
+        'account_updated': user.account_updated,
+        'verified': user.verified
+    }
+
+
+def imageFields(image) -> dict:
+    # response representation of an ImageRecord
+    return {
+        'id': image.id,
+        'file_name': image.file_name,
+        'user_id': image.user_id,
+        'url': image.url,
+        'upload_date': image.upload_date
+    }
+
+
+def encodeUser(user) -> bytes:
+    return dumps(userFields(user))
+
+
+def encodeImage(image) -> bytes:
+    return dumps(imageFields(image))
@@ -0,0 +1,263 @@
+import os
+import json
+import uuid
+import random
+import asyncio
+import concurrent.futures
+
+import boto3
+
+from tool.Config import Config
+from tool.Logger import Logger
+
+SPILL_COMPACT_RECORDS = 1000
+
+
+class SnsPublisher(object):
+    """ Publish batches to an SNS topic, one boto3 client per process """
+
+    def __init__(self, topic_arn: str, region_name: str = 'us-east-1'):
+        self.topic_arn = topic_arn
+        self.region_name = region_name
+        self.__client = None
+
+    def publishBatch(self, entries: list) -> list:
+        """
+        :param entries: list of (id, message str), at most 10
+        :return: ids of entries that failed and may succeed on retry
+        """
+        if self.__client is None:
+            self.__client = boto3.session.Session().client('sns', region_name=self.region_name)
+
+        response = self.__client.publish_batch(
+            TopicArn=self.topic_arn,
+            PublishBatchRequestEntries=[{'Id': entry_id, 'Message': message} for entry_id, message in entries])
+
+        retry_ids = []
+        for failed in response.get('Failed', []):
+            if failed.get('SenderFault'):
+                # malformed entry, retrying won't help
+                Logger.getInstance().error('SNS rejected message[{}]: {}'.format(failed.get('Id'), failed.get('Message')))
+            else:
+                retry_ids.append(failed.get('Id'))
+        return retry_ids
+
+
+class LocalPublisher(object):
+    """ Stand-in publisher for tests and benchmarks, keeps published batches in memory """
+
+    def __init__(self, fail_times: int = 0):
+        self.batches = []
+        self.fail_times = fail_times
+
+    @property
+    def messages(self) -> list:
+        return [json.loads(message) for batch in self.batches for _, message in batch]
+
+    def publishBatch(self, entries: list) -> list:
+        if self.fail_times > 0:
+            self.fail_times -= 1
+            raise ConnectionError('local publisher failure')
+        self.batches.append(list(entries))
+        return []
+
+
+class SnsOutbox(object):
+    """
+    In-process outbox for SNS notifications. Handlers only enqueue(), a background worker publishes
+    messages in batches of up to batch_size with exponential backoff retries.
+
+    If spill_path is set, every message is journaled before enqueue() returns and acked once published,
+    messages not acked when the process dies are published again on the next start().
+    """
+
+    def __init__(self, publisher, maxsize: int = 10000, batch_size: int = 10, max_retries: int = 5,
+                 backoff: float = 0.2, max_backoff: float = 30, spill_path: str = None):
+        self.publisher = publisher
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.spill_path = spill_path
+
+        self.__queue = None
+        self.__task = None
+        self.__executor = None
+        self.__spill = None
+        self.__spill_records = 0
+        self.__unacked = {}  # journaled messages not published yet
+
+    def __journal(self, record: dict):
+        if self.__spill is not None:
+            if 'ack' in record:
+                self.__unacked.pop(record['ack'], None)
+            else:
+                self.__unacked[record['id']] = record['message']
+            self.__spill.write(json.dumps(record) + '\n')
+            self.__spill.flush()
+            self.__spill_records += 1
+
+    def __compact(self):
+        # rewrite the spill file with unacked messages only, so it doesn't grow for the process lifetime
+        self.__spill.close()
+        self.__writeSpill(self.__unacked.items())
+        self.__spill = open(self.spill_path, 'a', encoding='utf-8')
+        self.__spill_records = len(self.__unacked)
+
+    def __writeSpill(self, items):
+        tmp_path = self.spill_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for message_id, message in items:
+                f.write(json.dumps({'id': message_id, 'message': message}) + '\n')
+        os.replace(tmp_path, self.spill_path)
+
+    def __recover(self) -> list:
+        # replay messages not acked in the spill file, then rewrite it with only those
+        pending = {}
+        if os.path.exists(self.spill_path):
+            with open(self.spill_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # torn write of the last line
+                    if 'ack' in record:
+                        pending.pop(record['ack'], None)
+                    else:
+                        pending[record['id']] = record['message']
+
+        self.__writeSpill(pending.items())
+        self.__unacked = dict(pending)
+        self.__spill_records = len(pending)
+        return list(pending.items())
+
+    def start(self):
+        self.__queue = asyncio.Queue(maxsize=self.maxsize)
+        self.__executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='sns-outbox')
+        if self.spill_path:
+            recovered = self.__recover()
+            self.__spill = open(self.spill_path, 'a', encoding='utf-8')
+            for item in recovered:
+                self.__queue.put_nowait(item)
+            if recovered:
+                Logger.getInstance().info('Recovered {} unpublished sns messages from spill file'.format(len(recovered)))
+        self.__task = asyncio.ensure_future(self.__run())
+
+    def enqueue(self, message: dict) -> bool:
+        """ :return: False if the outbox is full and the message is dropped """
+        item = (uuid.uuid4().hex, json.dumps(message))
+        try:
+            self.__queue.put_nowait(item)
+        except asyncio.QueueFull:
+            Logger.getInstance().error('SNS outbox is full, drop message {}'.format(item[1]))
+            return False
+        self.__journal({'id': item[0], 'message': item[1]})
+        return True
+
+    def enqueueMany(self, messages: list) -> int:
+        """
+        Enqueue messages with one journal write and flush for all of them
+        :return: number of messages enqueued, the rest is dropped because the outbox is full
+        """
+        items = []
+        for message in messages:
+            item = (uuid.uuid4().hex, json.dumps(message))
+            try:
+                self.__queue.put_nowait(item)
+            except asyncio.QueueFull:
+                Logger.getInstance().error('SNS outbox is full, drop {} messages'.format(len(messages) - len(items)))
+                break
+            items.append(item)
+
+        if self.__spill is not None and items:
+            for message_id, message in items:
+                self.__unacked[message_id] = message
+            self.__spill.write(''.join(json.dumps({'id': message_id, 'message': message}) + '\n'
+                                       for message_id, message in items))
+            self.__spill.flush()
+            self.__spill_records += len(items)
+        return len(items)
+
+    def qsize(self) -> int:
+        return self.__queue.qsize() if self.__queue is not None else 0
+
+    async def __run(self):
+        while True:
+            batch = [await self.__queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.__queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+
+            try:
+                await self.__publish(batch)
+            except Exception as e:
+                Logger.getInstance().exception(e)
+            finally:
+                for _ in batch:
+                    self.__queue.task_done()
+
+            if self.__spill is not None and self.__queue.empty() and self.__spill_records > SPILL_COMPACT_RECORDS:
+                self.__compact()
+
+    async def __publish(self, batch: list):
+        loop = asyncio.get_event_loop()
+        pending = batch
+        attempt = 0
+        while pending:
+            try:
+                retry_ids = set(await loop.run_in_executor(self.__executor, self.publisher.publishBatch, pending))
+            except Exception as e:
+                Logger.getInstance().info('Failed to publish sns batch, attempt[{}]: {}'.format(attempt, e))
+                retry_ids = set(message_id for message_id, _ in pending)
+
+            for message_id, _ in pending:
+                if message_id not in retry_ids:
+                    self.__journal({'ack': message_id})
+            pending = [item for item in pending if item[0] in retry_ids]
+
+            if pending:
+                attempt += 1
+                if attempt > self.max_retries:
+                    # left unacked in the spill file, so they are published again after restart
+                    Logger.getInstance().error('Give up publishing {} sns messages after {} retries'.format(len(pending), self.max_retries))
+                    return
+                delay = min(self.max_backoff, self.backoff * (2 ** (attempt - 1)))
+                await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+
+    async def stop(self, timeout: float = 5):
+        """ Wait up to timeout seconds for queued messages to be published, then stop the worker """
+        if self.__task is None:
+            return
+        try:
+            await asyncio.wait_for(self.__queue.join(), timeout)
+        except asyncio.TimeoutError:
+            Logger.getInstance().info('SNS outbox stopped with {} messages unpublished'.format(self.__queue.qsize()))
+
+        self.__task.cancel()
+        self.__task = None
+        self.__executor.shutdown(wait=False)
+        if self.__spill is not None:
+            self.__spill.close()
+            self.__spill = None
+
+
+def createSnsOutbox(worker_id: int = None) -> SnsOutbox:
+    config = Config.getInstance()
+    if config.get('SNS_PUBLISHER', 'sns') == 'local':
+        publisher = LocalPublisher()
+    else:
+        publisher = SnsPublisher(topic_arn=config['SNSTopic'], region_name=config.get('AWS_REGION') or 'us-east-1')
+
+    spill_path = config.get('SNS_OUTBOX_SPILL_FILE') or None
+    if spill_path and worker_id is not None:
+        # one journal per prefork worker, the worker id is stable across restarts
+        root, ext = os.path.splitext(spill_path)
+        spill_path = '{}.{}{}'.format(root, worker_id, ext)
+
+    return SnsOutbox(publisher,
+                     maxsize=config.get('SNS_OUTBOX_SIZE', 10000),
+                     max_retries=config.get('SNS_MAX_RETRIES', 5),
+                     spill_path=spill_path)
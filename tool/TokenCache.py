@@ -0,0 +1,48 @@
+import os
+import time
+import hashlib
+
+from tool.LruCache import LruCache
+
+
+class VerifiedTokenCache(object):
+    """
+    JWT payloads that already passed signature verification, so a client reusing its token
+    skips jwt.decode (HMAC check and payload parsing) on the following requests.
+
+    Entries are keyed by a keyed digest (BLAKE2b with a per-process random key) of the token,
+    the token string itself is not kept. Every entry expires at the token's own exp claim,
+    at the latest max_ttl seconds after it was verified. Invalid and expired tokens are never cached.
+    Payloads are shared between requests, treat them as read-only.
+    """
+
+    def __init__(self, maxsize: int = 10000, max_ttl: float = 300, statsd_conn=None, clock=time.time):
+        self.max_ttl = max_ttl
+        self.clock = clock  # wall clock, exp claims are unix timestamps
+        self.__key = os.urandom(32)
+        self.__cache = LruCache(maxsize=maxsize, ttl=max_ttl, name='token_cache', statsd_conn=statsd_conn, clock=clock)
+
+    def __digest(self, token: str) -> bytes:
+        return hashlib.blake2b(token.encode(), digest_size=16, key=self.__key).digest()
+
+    def get(self, token: str):
+        """ :return: verified payload, None if the token has to be verified """
+        entry = self.__cache.get(self.__digest(token))
+        if entry is None:
+            return None
+        payload, expire_at = entry
+        if expire_at <= self.clock():
+            return None  # expired just now, jwt.decode rejects it
+        return payload
+
+    def add(self, token: str, payload: dict):
+        expire_at = payload.get('exp')
+        now = self.clock()
+        if not isinstance(expire_at, (int, float)):
+            expire_at = now + self.max_ttl
+        if expire_at <= now:
+            return
+        self.__cache.set(self.__digest(token), (payload, expire_at), ttl=min(expire_at - now, self.max_ttl))
+
+    def stats(self) -> dict:
+        return self.__cache.stats()
@@ -0,0 +1,121 @@
+import time
+import heapq
+import hashlib
+import sqlite3
+
+from tool.Config import Config
+from tool.Logger import Logger
+
+DEFAULT_TOKEN_TTL = 30 * 24 * 3600  # seconds a used token is remembered at most, also for tokens without exp claim
+
+
+class ReplayStoreFullError(Exception):
+    """ Raised when the store can't remember another token, the token is rejected instead of forgetting a used one """
+    pass
+
+
+def tokenDigest(token: str) -> bytes:
+    # 16 byte digest instead of the whole token string
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+
+class MemoryReplayStore(object):
+    """
+    Used one-time tokens of this process. Each entry lives until the token's own exp, at most max_ttl seconds,
+    expired entries are popped from a min-heap so pruning costs O(expired).
+    Entries are never evicted early, an evicted token could be replayed: while maxsize entries are alive
+    new tokens are rejected with ReplayStoreFullError.
+    """
+
+    def __init__(self, maxsize: int = 100000, max_ttl: float = DEFAULT_TOKEN_TTL, clock=time.time):
+        self.maxsize = maxsize
+        self.max_ttl = max_ttl
+        self.clock = clock
+        self.__expires = {}  # digest -> exp
+        self.__heap = []  # (exp, digest)
+
+    def __len__(self):
+        return len(self.__expires)
+
+    def __prune(self, now):
+        while self.__heap and self.__heap[0][0] <= now:
+            _, digest = heapq.heappop(self.__heap)
+            del self.__expires[digest]
+
+    def markUsed(self, token: str, expire_at: float) -> bool:
+        """
+        :return: True if the token is used for the first time, False if it is a replay
+        :raise ReplayStoreFullError: maxsize used tokens are remembered already
+        """
+        now = self.clock()
+        self.__prune(now)
+
+        digest = tokenDigest(token)
+        if digest in self.__expires:
+            return False
+        if expire_at <= now:
+            return True  # already expired, JWT verification rejects it anyway
+        expire_at = min(expire_at, now + self.max_ttl)
+
+        if len(self.__expires) >= self.maxsize:
+            Logger.getInstance().info('Token replay store is full, reject the token')
+            raise ReplayStoreFullError('{} used tokens are remembered already'.format(len(self.__expires)))
+
+        self.__expires[digest] = expire_at
+        heapq.heappush(self.__heap, (expire_at, digest))
+        return True
+
+    def close(self):
+        pass
+
+
+class SqliteReplayStore(object):
+    """
+    Used one-time tokens shared by all worker processes through a SQLite file in WAL mode.
+    Insert-or-ignore on the digest makes check-and-mark atomic across processes.
+    Each row lives until the token's own exp, at most max_ttl seconds, so pruning bounds the file.
+    """
+
+    def __init__(self, path: str, prune_interval: float = 60, max_ttl: float = DEFAULT_TOKEN_TTL, clock=time.time):
+        self.path = path
+        self.prune_interval = prune_interval
+        self.max_ttl = max_ttl
+        self.clock = clock
+        self.__next_prune = 0
+        self.__conn = None
+
+    def _conn(self):
+        # opened lazily, so every forked worker gets its own connection
+        if self.__conn is None:
+            self.__conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self.__conn.execute("PRAGMA journal_mode=WAL")
+            self.__conn.execute("PRAGMA synchronous=NORMAL")
+            self.__conn.execute("CREATE TABLE IF NOT EXISTS used_token (digest BLOB PRIMARY KEY, exp INTEGER NOT NULL)")
+            self.__conn.execute("CREATE INDEX IF NOT EXISTS used_token_exp ON used_token (exp)")
+        return self.__conn
+
+    def markUsed(self, token: str, expire_at: float) -> bool:
+        now = self.clock()
+        if now >= self.__next_prune:
+            self._conn().execute("DELETE FROM used_token WHERE exp <= ?", (int(now), ))
+            self.__next_prune = now + self.prune_interval
+        if expire_at <= now:
+            return True
+        expire_at = min(expire_at, now + self.max_ttl)
+
+        cursor = self._conn().execute("INSERT OR IGNORE INTO used_token (digest, exp) VALUES (?, ?)",
+                                      (tokenDigest(token), int(expire_at)))
+        return cursor.rowcount == 1
+
+    def close(self):
+        if self.__conn is not None:
+            self.__conn.close()
+            self.__conn = None
+
+
+def createTokenReplayStore():
+    config = Config.getInstance()
+    if config.get('TOKEN_REPLAY_STORE', 'memory') == 'sqlite':
+        return SqliteReplayStore(path=config.get('TOKEN_REPLAY_PATH', './log/used_token.sqlite3'))
+    else:
+        return MemoryReplayStore(maxsize=config.get('TOKEN_REPLAY_MAXSIZE', 100000))
@@ -0,0 +1,33 @@
+import datetime
+
+
+class UserContext(object):
+    """
+    User row record returned by UserDAO. As the authenticated principal of a request it is resolved once
+    in TokenHandler.prepare and exposed to handlers as self.current_user.
+    Dates stay datetime objects until the response is encoded, see tool.Serializer.encodeUser.
+    """
+    __slots__ = ('id', 'first_name', 'last_name', 'username', 'password',
+                 'account_created', 'account_updated', 'verified')
+
+    # column order of the user row, see UserDAO
+    COLUMNS = "id, first_name, last_name, username, password, account_created, account_updated, verified"
+
+    def __init__(self, id: str, first_name: str, last_name: str, username: str, password: str,
+                 account_created: datetime.datetime, account_updated: datetime.datetime, verified: bool):
+        self.id = id
+        self.first_name = first_name
+        self.last_name = last_name
+        self.username = username
+        self.password = password  # bcrypt hash in base64
+        self.account_created = account_created
+        self.account_updated = account_updated
+        self.verified = verified
+
+    @classmethod
+    def fromRow(cls, row):
+        return cls(*row)
+
+    def toRow(self) -> tuple:
+        return (self.id, self.first_name, self.last_name, self.username, self.password,
+                self.account_created, self.account_updated, self.verified)
@@ -0,0 +1,175 @@
+import time
+import sqlite3
+import asyncio
+import threading
+import concurrent.futures
+
+import boto3
+from boto3.dynamodb.types import TypeDeserializer
+
+from tool.Config import Config
+from tool.Logger import Logger
+
+
+class VerificationStore(object):
+    """
+    Email verification records written by the signup Lambda, keyed by email.
+    A record carries an epoch-seconds ttl attribute, records past their ttl are treated as missing
+    even if the backend hasn't removed them yet. Blocking backend calls run on a dedicated executor.
+    """
+
+    def __init__(self, max_workers: int = 4):
+        self.max_workers = max_workers
+        self.__executor = None
+
+    async def _run(self, fn, *args):
+        if self.__executor is None:
+            self.__executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers,
+                                                                    thread_name_prefix=self.__class__.__name__)
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.__executor, fn, *args)
+
+    async def getRecord(self, email: str):
+        """ :return: record dict, None if there is no live record of the email """
+        return await self._run(self._getRecord, email, int(time.time()))
+
+    async def putRecord(self, email: str, token: str, ttl_seconds: int):
+        return await self._run(self._putRecord, email, token, int(time.time()) + ttl_seconds)
+
+    async def expireStale(self, batch_size: int = 25) -> int:
+        """ Delete records past their ttl in batches, :return: number of deleted records """
+        return await self._run(self._expireStale, int(time.time()), batch_size)
+
+    def close(self):
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=True)
+            self.__executor = None
+
+    def _getRecord(self, email, now):
+        raise NotImplementedError
+
+    def _putRecord(self, email, token, expire_at):
+        raise NotImplementedError
+
+    def _expireStale(self, now, batch_size):
+        raise NotImplementedError
+
+
+class DynamoVerificationStore(VerificationStore):
+
+    def __init__(self, table_name: str = 'verification', region_name: str = 'us-east-1', ttl_attribute: str = 'ttl',
+                 max_workers: int = 4):
+        super().__init__(max_workers=max_workers)
+        self.table_name = table_name
+        self.region_name = region_name
+        self.ttl_attribute = ttl_attribute
+        self.__client = None
+        self.__deserializer = TypeDeserializer()
+
+    def _client(self):
+        # one long-lived low level client per process, unlike resources it is safe to share between threads
+        if self.__client is None:
+            self.__client = boto3.session.Session().client('dynamodb', region_name=self.region_name)
+        return self.__client
+
+    def _getRecord(self, email, now):
+        response = self._client().get_item(TableName=self.table_name, Key={'email': {'S': email}})
+        item = response.get('Item')
+        if item is None:
+            return None
+        record = {key: self.__deserializer.deserialize(value) for key, value in item.items()}
+        expire_at = record.get(self.ttl_attribute)
+        if expire_at is not None and int(expire_at) <= now:
+            return None  # DynamoDB removes expired items lazily
+        return record
+
+    def _putRecord(self, email, token, expire_at):
+        self._client().put_item(TableName=self.table_name, Item={
+            'email': {'S': email},
+            'token': {'S': token},
+            self.ttl_attribute: {'N': str(expire_at)},
+        })
+
+    def _expireStale(self, now, batch_size):
+        deleted = 0
+        batch_size = min(batch_size, 25)  # batch_write_item limit
+        paginator = self._client().get_paginator('scan')
+        pages = paginator.paginate(TableName=self.table_name,
+                                   ProjectionExpression='email',
+                                   FilterExpression='#ttl <= :now',
+                                   ExpressionAttributeNames={'#ttl': self.ttl_attribute},
+                                   ExpressionAttributeValues={':now': {'N': str(now)}})
+        for page in pages:
+            items = page.get('Items', [])
+            for i in range(0, len(items), batch_size):
+                requests = [{'DeleteRequest': {'Key': {'email': item['email']}}} for item in items[i:i + batch_size]]
+                response = self._client().batch_write_item(RequestItems={self.table_name: requests})
+                unprocessed = response.get('UnprocessedItems', {}).get(self.table_name, [])
+                deleted += len(requests) - len(unprocessed)
+        return deleted
+
+
+class LocalVerificationStore(VerificationStore):
+    """ SQLite backed store, stands in for DynamoDB in tests and benchmarks. path ':memory:' keeps it in memory """
+
+    def __init__(self, path: str = ':memory:'):
+        super().__init__(max_workers=1)
+        self.__conn = sqlite3.connect(path, check_same_thread=False)
+        self.__lock = threading.Lock()
+        with self.__lock:
+            self.__conn.execute("CREATE TABLE IF NOT EXISTS verification "
+                                "(email TEXT PRIMARY KEY, token TEXT, ttl INTEGER)")
+            self.__conn.commit()
+
+    def _getRecord(self, email, now):
+        with self.__lock:
+            row = self.__conn.execute("SELECT email, token, ttl FROM verification WHERE email = ? AND ttl > ?",
+                                      (email, now)).fetchone()
+        if row is None:
+            return None
+        return {'email': row[0], 'token': row[1], 'ttl': row[2]}
+
+    def _putRecord(self, email, token, expire_at):
+        with self.__lock:
+            self.__conn.execute("INSERT OR REPLACE INTO verification (email, token, ttl) VALUES (?, ?, ?)",
+                                (email, token, expire_at))
+            self.__conn.commit()
+
+    def _expireStale(self, now, batch_size):
+        deleted = 0
+        while True:
+            with self.__lock:
+                cursor = self.__conn.execute(
+                    "DELETE FROM verification WHERE rowid IN "
+                    "(SELECT rowid FROM verification WHERE ttl <= ? LIMIT ?)", (now, batch_size))
+                self.__conn.commit()
+            deleted += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                return deleted
+
+    def close(self):
+        super().close()
+        with self.__lock:
+            self.__conn.close()
+
+
+def createVerificationStore() -> VerificationStore:
+    config = Config.getInstance()
+    backend = config.get('VERIFICATION_STORE', 'dynamodb')
+    if backend == 'local':
+        return LocalVerificationStore(path=config.get('VERIFICATION_STORE_PATH', ':memory:'))
+    elif backend == 'dynamodb':
+        return DynamoVerificationStore(table_name=config.get('VERIFICATION_TABLE', 'verification'),
+                                       region_name=config.get('AWS_REGION') or 'us-east-1',
+                                       ttl_attribute=config.get('VERIFICATION_TTL_ATTRIBUTE', 'ttl'))
+    else:
+        raise ValueError('unknown verification store backend [{}]'.format(backend))
+
+
+async def expireStaleRecords(store: VerificationStore):
+    try:
+        deleted = await store.expireStale()
+        if deleted:
+            Logger.getInstance().info('Expired {} stale verification records'.format(deleted))
+    except Exception as e:
+        Logger.getInstance().exception(e)
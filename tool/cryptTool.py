@@ -1,5 +1,9 @@
-import bcrypt
+import os
+import asyncio
 import base64
+import concurrent.futures
+
+import bcrypt
 
 
 def encodeBase64(b: bytes) -> str:
@@ -16,11 +20,108 @@ def encrypt(s: str) -> str:
 
     return encodeBase64(hashed)
 
+# list of strings -> list of base64 encrypted strings, one executor job for several passwords
+def encryptMany(passwords: list) -> list:
+    return [encrypt(s) for s in passwords]
+
 # check if same between string(original) and base64 encrypted string
 def checkSame(s: str, hashed: str) -> bool:
     return bcrypt.checkpw(s.encode(), decodeBase64(hashed))
 
 
+class CryptBusyError(Exception):
+    """ Raised when too many bcrypt jobs are already queued """
+    pass
+
+
+class CryptService(object):
+    """
+    Run bcrypt hashing and verification off the IOLoop.
+    kind 'process' uses a process pool, kind 'thread' uses a thread pool (bcrypt releases the GIL).
+    The executor is created lazily, so it is safe to build the service before forking workers.
+    """
+
+    def __init__(self, kind: str = 'process', max_workers: int = None, max_pending: int = 64):
+        if kind not in ('process', 'thread'):
+            raise ValueError('unknown crypt executor kind [{}]'.format(kind))
+
+        self.kind = kind
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.pending = 0
+        self.__executor = None
+
+    def __getExecutor(self):
+        if self.__executor is None:
+            if self.kind == 'process':
+                self.__executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self.__executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers,
+                                                                        thread_name_prefix='crypt')
+        return self.__executor
+
+    async def run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            raise CryptBusyError('crypt queue is full, pending[{}]'.format(self.pending))
+
+        self.pending += 1
+        try:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(self.__getExecutor(), fn, *args)
+        finally:
+            self.pending -= 1
+
+    async def runMany(self, fn, items: list, job_size: int = 8, concurrency: int = None) -> list:
+        """
+        fn(list of items) -> list of results, run on slices of job_size items with at most concurrency
+        slices in flight (default half the workers), so bulk work leaves room for interactive requests.
+        Every slice in flight counts as pending, raises CryptBusyError like run() when the queue is full.
+        :return: results in the order of items
+        """
+        concurrency = concurrency or max(1, self.max_workers // 2)
+        slices = [items[i:i + job_size] for i in range(0, len(items), job_size)]
+        results = [None] * len(slices)
+        next_slice = iter(range(len(slices)))
+
+        async def worker():
+            for index in next_slice:
+                results[index] = await self.run(fn, slices[index])
+
+        await asyncio.gather(*[worker() for _ in range(min(concurrency, len(slices)))])
+        return [result for chunk in results for result in chunk]
+
+    def shutdown(self, wait: bool = True):
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=wait)
+            self.__executor = None
+
+
+_crypt_service = CryptService(kind='thread')
+
+
+def initCryptService(kind: str = 'process', max_workers: int = None, max_pending: int = 64) -> CryptService:
+    global _crypt_service
+    _crypt_service.shutdown(wait=False)
+    _crypt_service = CryptService(kind=kind, max_workers=max_workers, max_pending=max_pending)
+    return _crypt_service
+
+
+def getCryptService() -> CryptService:
+    return _crypt_service
+
+
+async def encrypt_async(s: str) -> str:
+    return await _crypt_service.run(encrypt, s)
+
+
+async def encrypt_many_async(passwords: list) -> list:
+    return await _crypt_service.runMany(encryptMany, passwords)
+
+
+async def check_same_async(s: str, hashed: str) -> bool:
+    return await _crypt_service.run(checkSame, s, hashed)
+
+
 if __name__ == '__main__':
     passwd = '123456'
     print(passwd)
@@ -29,3 +130,4 @@ if __name__ == '__main__':
     print(type(code))
     print(checkSame('123456', code))
     print(checkSame('123', code))
+    print(asyncio.get_event_loop().run_until_complete(check_same_async('123456', code)))